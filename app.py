@@ -2,19 +2,53 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.responses import UJSONResponse
+from fastapi_cache import FastAPICache
 
+from core.config import get_config
 from db.session import init_db
+from lib.cache import register_cache
+from lib.credentials import shutdown_hash_pool
 from lib.exception_handler import register_exception_handlers
+from lib.invalidation import user_changes
+from lib.jobs import register_jobs, start_job_worker
 from lib.logging import setup_logging
+from lib.memory import memory_profiler
 from lib.middleware import register_middlewares
 from lib.prometheus import register_prometheus
+from lib.rate_limit import register_rate_limiter
+from lib.revocation import token_revocations
+from lib.timing import register_server_timing
+from lib.warmup import warm_up
 from routes import api_router
 
+config = get_config()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    app.state.ready = False
+    cache_backend = await register_cache()
+    if config.STATELESS_TOKENS:
+        await token_revocations.connect(config.REDIS_URL)
     await init_db()
+    if config.USER_CHANGES_LISTEN:
+        await user_changes.connect(config.DATABASE_URL)
+    if config.WARMUP_ENABLED:
+        await warm_up(app)
+    job_worker = await start_job_worker(app)
+    # Tracing started at launch with PYTHONTRACEMALLOC
+    memory_profiler.start_sampler()
+    app.state.ready = True
     yield
+    if job_worker is not None:
+        job_worker.cancel()
+    await app.state.job_backend.close()
+    memory_profiler.close()
+    shutdown_hash_pool()
+    await token_revocations.close()
+    await user_changes.close()
+    await cache_backend.close()
+    FastAPICache.reset()
 
 
 def create_app() -> FastAPI:
@@ -31,6 +65,9 @@ def create_app() -> FastAPI:
     register_middlewares(app)
     register_exception_handlers(app)
     register_prometheus(app)
+    register_rate_limiter(app)
+    register_jobs(app)
     app.include_router(api_router)
+    register_server_timing(app)
 
     return app
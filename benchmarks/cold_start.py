@@ -0,0 +1,92 @@
+"""Cold-start benchmark for the application
+
+Measures, in fresh interpreters, how long importing ``main`` takes and how long it takes from
+``app.create_app``, through the lifespan startup, to the first successful response. Exits with a
+non-zero status when the median of either measurement is over its budget.
+
+Usage:
+    python -m benchmarks.cold_start [--runs 5] [--import-budget 2.5] [--first-response-budget 3.5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from core.config import get_base_dir
+
+IMPORT_BUDGET_S = float(os.getenv("COLD_START_IMPORT_BUDGET", 2.5))
+FIRST_RESPONSE_BUDGET_S = float(os.getenv("COLD_START_FIRST_RESPONSE_BUDGET", 3.5))
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import main
+print(time.perf_counter() - start)
+"""
+
+FIRST_RESPONSE_SNIPPET = """
+import asyncio
+import time
+start = time.perf_counter()
+from httpx import AsyncClient, ASGITransport
+from app import create_app
+
+async def first_response():
+    app = create_app()
+    async with app.router.lifespan_context(app), \
+            AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/health/ready")
+        response.raise_for_status()
+
+asyncio.run(first_response())
+print(time.perf_counter() - start)
+"""
+
+
+def _run(snippet: str) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", snippet],
+        cwd=get_base_dir(),
+        env=os.environ.copy(),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    # The last line is the measurement, anything before it is output of the application
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_import_time(runs: int = 5) -> float:
+    """Median time, in seconds, to import ``main`` in a fresh interpreter"""
+    return statistics.median(_run(IMPORT_SNIPPET) for _ in range(runs))
+
+
+def measure_first_response_time(runs: int = 5) -> float:
+    """Median time, in seconds, from a fresh interpreter to the first successful response of ``create_app()``"""
+    return statistics.median(_run(FIRST_RESPONSE_SNIPPET) for _ in range(runs))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET_S)
+    parser.add_argument("--first-response-budget", type=float, default=FIRST_RESPONSE_BUDGET_S)
+    args = parser.parse_args()
+
+    import_time = measure_import_time(args.runs)
+    first_response_time = measure_first_response_time(args.runs)
+    report = {
+        "import_time_s": round(import_time, 4),
+        "import_budget_s": args.import_budget,
+        "first_response_time_s": round(first_response_time, 4),
+        "first_response_budget_s": args.first_response_budget,
+    }
+    print(json.dumps(report, indent=2))
+
+    return int(import_time > args.import_budget or first_response_time > args.first_response_budget)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""Load test replaying a mix of requests at a fixed concurrency
+
+Runs in-process against ``create_app()`` and the database of the current config through the ASGI
+clients of ``lib.auth``, or against a running server with ``--base-url``. Reports the throughput,
+status codes and p50/p95/p99 latencies of every endpoint as JSON, and with ``--compare`` the change
+from an earlier report, exiting with a non-zero status when a p95 regressed more than the threshold.
+
+Usage:
+    python -m benchmarks.loadtest [--workload mixed] [--concurrency 20] [--duration 10] [--requests N]
+                                  [--base-url http://localhost:8000] [--output report.json]
+                                  [--compare baseline.json] [--threshold 0.2]
+
+Login storms hit the login rate limit, the in-process run disables it. Set RATE_LIMIT_ENABLED=false
+on the server when targeting one with ``--base-url``.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from httpx import AsyncClient, TransportError
+
+from core.config import get_base_dir, get_config
+
+config = get_config()
+
+PROFILE = {
+    "first_name": "Load",
+    "last_name": "Test",
+    "university": "Load University",
+    "year": 2025,
+    "speciality": "Computer Science",
+    "department": "Performance",
+    "degree": "Bachelor",
+    "role": "Student",
+}
+
+# Operations with their relative weight in each workload
+WORKLOADS = {
+    "login": {"login": 1},
+    "me": {"me": 1},
+    "all_users": {"all_users": 1},
+    "profile": {"profile": 1},
+    "mixed": {"me": 6, "profile": 2, "all_users": 1, "login": 1},
+}
+
+
+@dataclass
+class Clients:
+    anonymous: AsyncClient
+    admin: AsyncClient
+    user: AsyncClient
+
+
+async def _request(clients: Clients, operation: str):
+    match operation:
+        case "login":
+            return await clients.anonymous.post(
+                "/login", json={"username": config.USER_USERNAME, "password": config.USER_PASSWORD})
+        case "me":
+            return await clients.user.get("/me")
+        case "all_users":
+            return await clients.admin.get("/all_users")
+        case "profile":
+            return await clients.user.put("/profile", json=PROFILE)
+    raise ValueError(f"Unknown operation {operation}")
+
+
+@asynccontextmanager
+async def in_process_clients() -> AsyncIterator[Clients]:
+    """Clients of an app created in this process, started with its lifespan"""
+    from app import create_app
+    from lib.auth import get_client, get_admin_client, get_user_client
+
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        app.state.rate_limiter = None
+        clients = Clients(await get_client(app), await get_admin_client(app), await get_user_client(app))
+        try:
+            yield clients
+        finally:
+            for client in (clients.anonymous, clients.admin, clients.user):
+                await client.aclose()
+
+
+@asynccontextmanager
+async def remote_clients(base_url: str) -> AsyncIterator[Clients]:
+    """Clients of a running server sharing this config's JWT secret"""
+    from lib.auth import JWTAuth, create_access_token
+
+    clients = Clients(
+        AsyncClient(base_url=base_url, timeout=30),
+        AsyncClient(base_url=base_url, auth=JWTAuth(create_access_token(data={"sub": "1"})), timeout=30),
+        AsyncClient(base_url=base_url, auth=JWTAuth(create_access_token(data={"sub": "2"})), timeout=30),
+    )
+    try:
+        yield clients
+    finally:
+        for client in (clients.anonymous, clients.admin, clients.user):
+            await client.aclose()
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(latencies: list[float], statuses: Counter, elapsed: float) -> dict:
+    latencies = sorted(latencies) or [0.0]
+    return {
+        "requests": sum(statuses.values()),
+        "errors": sum(count for status, count in statuses.items() if status >= 400 or status == 0),
+        "throughput_rps": round(sum(statuses.values()) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "status_codes": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def run_load_test(clients: Clients, workload: str = "mixed", concurrency: int = 20,
+                        duration: Optional[float] = 10, requests: Optional[int] = None, seed: int = 0) -> dict:
+    """Replay `workload` with `concurrency` simultaneous clients for `duration` seconds or `requests` requests"""
+    operations, weights = zip(*WORKLOADS[workload].items())
+    rng = random.Random(seed)
+    latencies: dict[str, list[float]] = defaultdict(list)
+    statuses: dict[str, Counter] = defaultdict(Counter)
+    remaining = requests
+
+    start_time = time.perf_counter()
+    deadline = start_time + duration if duration and not requests else None
+
+    async def user_loop():
+        nonlocal remaining
+        while True:
+            if remaining is not None:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+            elif time.perf_counter() >= deadline:
+                return
+            operation = rng.choices(operations, weights)[0]
+            request_start = time.perf_counter()
+            try:
+                status = (await _request(clients, operation)).status_code
+            except TransportError:
+                # Connection failures are reported as the status 0
+                status = 0
+            latencies[operation].append((time.perf_counter() - request_start) * 1000)
+            statuses[operation][status] += 1
+
+    await asyncio.gather(*(user_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    return {
+        "workload": workload,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "commit": _current_commit(),
+        "total": summarize(all_latencies, sum(statuses.values(), Counter()), elapsed),
+        "endpoints": {operation: summarize(latencies[operation], statuses[operation], elapsed)
+                      for operation in sorted(latencies)},
+    }
+
+
+def _current_commit() -> Optional[str]:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=get_base_dir(), capture_output=True,
+                            text=True)
+    return result.stdout.strip() or None
+
+
+def compare(report: dict, baseline: dict, threshold: float = 0.2) -> tuple[dict, bool]:
+    """Relative change of the throughput and p95 of every endpoint, and whether a p95 grew over `threshold`"""
+    changes, regressed = {}, False
+    for operation, current in {"total": report["total"], **report["endpoints"]}.items():
+        previous = baseline["endpoints"].get(operation) if operation != "total" else baseline["total"]
+        if not previous:
+            continue
+        p95_change = current["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0
+        throughput_change = (current["throughput_rps"] / previous["throughput_rps"] - 1
+                             if previous["throughput_rps"] else 0)
+        changes[operation] = {"throughput": round(throughput_change, 3), "p95": round(p95_change, 3)}
+        regressed |= p95_change > threshold
+    return changes, regressed
+
+
+async def _main(args) -> dict:
+    target = remote_clients(args.base_url) if args.base_url else in_process_clients()
+    async with target as clients:
+        return await run_load_test(clients, args.workload, args.concurrency, args.duration, args.requests,
+                                   args.seed)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds, ignored with --requests")
+    parser.add_argument("--requests", type=int, help="Total number of requests instead of a duration")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base-url", help="Server to load instead of an in-process app")
+    parser.add_argument("--output", help="File receiving the JSON report")
+    parser.add_argument("--compare", help="Earlier JSON report to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Tolerated relative p95 increase")
+    args = parser.parse_args()
+
+    report = asyncio.run(_main(args))
+    regressed = False
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["comparison"], regressed = compare(report, json.load(f), args.threshold)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    return int(regressed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""Microbenchmarks of the functions every request pays for, checked against stored baselines
+
+Each benchmark reports the best average time of one call, in microseconds, over several repeats.
+With ``--check`` the results are compared with ``benchmarks/baselines.json`` and the command exits
+with a non-zero status when one is slower than its baseline by more than the threshold. Baselines
+depend on the hardware and the config (Argon2 cost, log format), record them again with ``--update``
+on the machine running the checks.
+
+Usage:
+    APP_ENV=prod python -m benchmarks.micro [--only jwt,password,...] [--check] [--threshold 0.2] [--update]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import timeit
+from typing import Callable
+
+from core.config import get_base_dir
+
+BASELINES_PATH = os.path.join(get_base_dir(), "benchmarks", "baselines.json")
+
+
+def bench(function: Callable[[], object], number: int, repeat: int = 5) -> float:
+    """Best average time in microseconds of one call of `function` over `repeat` runs of `number` calls"""
+    function()
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+
+def bench_async(function: Callable[[], object], number: int, repeat: int = 5) -> float:
+    loop = asyncio.new_event_loop()
+    try:
+        return bench(lambda: loop.run_until_complete(function()), number, repeat)
+    finally:
+        loop.close()
+
+
+def jwt_benchmarks(scale: float) -> dict[str, float]:
+    from lib.auth import create_access_token, decode_access_token, decode_access_token_uncached, token_cache
+
+    token = create_access_token(data={"sub": "1"})
+    # The cached decoding is measured from a cache holding only this token
+    token_cache.clear()
+    return {
+        "jwt_create": bench(lambda: create_access_token(data={"sub": "1"}), int(5000 * scale) or 1),
+        "jwt_decode_uncached": bench(lambda: decode_access_token_uncached(token), int(5000 * scale) or 1),
+        "jwt_decode_cached": bench(lambda: decode_access_token(token), int(50000 * scale) or 1),
+    }
+
+
+def password_benchmarks(scale: float) -> dict[str, float]:
+    from lib.auth import hash_password, verify_password
+
+    hashed_password = hash_password("benchmark_password")
+    return {
+        "hash_password": bench(lambda: hash_password("benchmark_password"), int(10 * scale) or 1, repeat=3),
+        "verify_password": bench(lambda: verify_password("benchmark_password", hashed_password),
+                                 int(10 * scale) or 1, repeat=3),
+    }
+
+
+def logging_benchmarks(scale: float) -> dict[str, float]:
+    """The structlog processor chain applied by the console handler to a request log record"""
+    import structlog
+
+    from lib.logging import generate_logging_config
+
+    formatters = generate_logging_config(None)["formatters"]
+    options = next(iter(formatters.values()))
+    formatter = structlog.stdlib.ProcessorFormatter(
+        processors=options["processors"], foreign_pre_chain=options["foreign_pre_chain"])
+    message = json.dumps({
+        "request": {"method": "GET", "path": "/me", "ip": "127.0.0.1"},
+        "response": {"status": "successful", "status_code": 200, "time_taken": "0.0012s"},
+        "correlation_id": "0123456789abcdef0123456789abcdef",
+    })
+    record = logging.getLogger("lib.middleware").makeRecord(
+        "lib.middleware", logging.INFO, __file__, 1, message, None, None, "dispatch")
+    return {"log_record_format": bench(lambda: formatter.format(record), int(2000 * scale) or 1)}
+
+
+def serialization_benchmarks(scale: float) -> dict[str, float]:
+    from fastapi.responses import UJSONResponse
+
+    from schemas.user import ProfileResponse, UserResponse
+
+    profile = {"id": 1, "first_name": "Bench", "last_name": "Mark", "university": "Benchmark University",
+               "year": 2025, "role": "Student", "speciality": "Computer Science", "department": "Performance",
+               "degree": "Bachelor"}
+
+    def user_response():
+        return UserResponse(id=1, username="bench_mark", group="case", profile=ProfileResponse(**profile))
+
+    users = [user_response() for _ in range(100)]
+    return {
+        "user_response_build": bench(user_response, int(20000 * scale) or 1),
+        "user_response_encode": bench(lambda: UJSONResponse(content=users[0].model_dump(mode="json")),
+                                      int(20000 * scale) or 1),
+        "user_list_100_encode": bench(
+            lambda: UJSONResponse(content=[user.model_dump(mode="json") for user in users]), int(500 * scale) or 1),
+    }
+
+
+def logging_middleware_benchmarks(scale: float) -> dict[str, float]:
+    """One request through a bare app, with and without the request/response logging middleware"""
+    from fastapi import FastAPI
+
+    from lib.middleware import RequestResponseLoggingMiddleware
+
+    def create_app(with_logging: bool) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/ping")
+        async def ping():
+            return {"ping": "pong"}
+
+        if with_logging:
+            app.add_middleware(RequestResponseLoggingMiddleware)
+        return app
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/ping", "raw_path": b"/ping", "root_path": "", "query_string": b"",
+             "headers": [(b"host", b"test"), (b"x-request-id", b"0123456789abcdef")],
+             "client": ("127.0.0.1", 1234), "server": ("test", 80)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    # Keep the records out of the console, only the middleware's own work is measured
+    logger = logging.getLogger("lib.middleware")
+    disabled, logger.disabled = logger.disabled, True
+    number = int(2000 * scale) or 1
+    results = {}
+    try:
+        for name, app in (("request_without_logging_middleware", create_app(False)),
+                          ("request_with_logging_middleware", create_app(True))):
+            results[name] = bench_async(lambda: app(dict(scope), receive, send), number)
+    finally:
+        logger.disabled = disabled
+    return results
+
+
+SUITES = {
+    "jwt": jwt_benchmarks,
+    "password": password_benchmarks,
+    "logging": logging_benchmarks,
+    "serialization": serialization_benchmarks,
+    "logging_middleware": logging_middleware_benchmarks,
+}
+
+
+def run(suites: list[str] = None, scale: float = 1.0) -> dict[str, float]:
+    """Run the benchmarks of `suites`, all by default, with `scale` times the default number of calls"""
+    results = {}
+    for suite in suites or SUITES:
+        for name, value in SUITES[suite](scale).items():
+            results[name] = round(value, 3)
+    return results
+
+
+def check(results: dict[str, float], baselines: dict[str, float], threshold: float = 0.2) -> dict[str, float]:
+    """Relative slowdown of the results slower than their baseline by more than `threshold`"""
+    return {name: round(value / baselines[name] - 1, 3) for name, value in results.items()
+            if name in baselines and value > baselines[name] * (1 + threshold)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", default="", help=f"Comma separated suites among {', '.join(SUITES)}")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier of the number of calls")
+    parser.add_argument("--check", action="store_true", help="Compare with the stored baselines")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Tolerated relative slowdown")
+    parser.add_argument("--update", action="store_true", help="Store the results as the new baselines")
+    args = parser.parse_args()
+
+    results = run([suite for suite in args.only.split(",") if suite], args.scale)
+    report = {"results_us": results}
+    regressions = {}
+    if args.check:
+        with open(BASELINES_PATH, encoding="utf-8") as f:
+            regressions = check(results, json.load(f), args.threshold)
+        report["regressions"] = regressions
+    print(json.dumps(report, indent=2))
+
+    if args.update:
+        baselines = {}
+        if os.path.exists(BASELINES_PATH):
+            with open(BASELINES_PATH, encoding="utf-8") as f:
+                baselines = json.load(f)
+        with open(BASELINES_PATH, "w", encoding="utf-8") as f:
+            json.dump(baselines | results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    return int(bool(regressions))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
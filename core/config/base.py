@@ -2,7 +2,7 @@ import os
 from functools import lru_cache
 from typing import TypeAlias, Literal
 
-from pydantic import Field
+from pydantic import Field, model_validator
 from pydantic_settings import BaseSettings
 
 
@@ -11,15 +11,32 @@ def get_base_dir(): return os.path.dirname(os.path.dirname(os.path.dirname(os.pa
 
 LogLevel: TypeAlias = Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
 LogFormat: TypeAlias = Literal["plain", "json", "uvicorn"]
+RateLimitBackend: TypeAlias = Literal["memory", "redis"]
+JobQueueBackend: TypeAlias = Literal["sqlite", "redis"]
 
 
 class Config(BaseSettings):
     DATABASE_URL: str
+    # Connections to the database for all the workers, each worker's pool gets DB_POOL_SIZE / WORKERS, less one
+    # with USER_CHANGES_LISTEN for the connection listening for the changes, kept out of the pool
+    DB_POOL_SIZE: int = 30
+    DB_MAX_OVERFLOW: int = 20
+    WORKERS: int = 1  # Set by `python manage.py serve`, set it by hand for other multi-worker servers
     JWT_SECRET: str
     ALGORITHM: str = "HS256"
     FRONTEND_CORS_ORIGIN: list[str] = Field(default_factory=lambda: ["*"])
     ACCESS_TOKEN_EXPIRE_DAYS: int = 30
+    # Verified tokens kept in memory to skip signature checks on repeated requests, 0 disables the cache
+    JWT_CACHE_SIZE: int = 10000
+    # Embed the user's authorization claims in tokens so most requests are authorized without the database
+    STATELESS_TOKENS: bool = False
     MAX_USERS_PER_REQUEST: int = 100
+    MAX_USERS_PER_JOB: int = 10000
+    # Processes hashing passwords for imports and user creation jobs, in each API and job worker process. 0 splits
+    # the cores between the WORKERS, so a host runs about one hashing process per core.
+    HASH_WORKERS: int = 0
+    IMPORT_BATCH_SIZE: int = 5000  # Rows hashed, copied and merged at once by user imports
+    EXPORT_BATCH_SIZE: int = 1000  # Rows fetched per round trip from the server-side cursor of exports
     USERS_PATH: str = os.path.join(get_base_dir(), "users.json")
     ADMIN_USERNAME: str = "lg_admin"
     ADMIN_PASSWORD: str = "admin_password"
@@ -31,7 +48,78 @@ class Config(BaseSettings):
     SQLALCHEMY_ECHO: bool = False
     LOG_REQUEST_RESPONSE: bool = False
     PROFILING_ENABLED: bool = True
+    # Time spent per stage (JWT, database, hashing, serialization...) in a Server-Timing header and the logs
+    SERVER_TIMING_ENABLED: bool = False
     ENABLE_METRICS: bool = True
+    # Memory allocation tracing, started by an admin on /debug/memory/start (or PYTHONTRACEMALLOC)
+    TRACEMALLOC_MAX_SNAPSHOTS: int = 5
+    TRACEMALLOC_SAMPLE_INTERVAL: float = 60.0  # Seconds between exports of the top allocation sites, 0 disables
+    TRACEMALLOC_TOP_SITES: int = 20
+    # Response compression, codings in order of preference, br and zstd need the brotli and zstandard modules
+    COMPRESSION_ENCODINGS: list[str] = Field(default_factory=lambda: ["zstd", "br", "gzip"])
+    COMPRESSION_MINIMUM_SIZE: int = 1000
+    COMPRESSION_CONTENT_TYPES: list[str] = Field(
+        default_factory=lambda: ["application/json", "application/x-ndjson", "text/"])
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 5
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    COMPRESSION_CACHE_MAX_BYTES: int = 32 * 1024 * 1024  # 0 disables the compressed body cache
+    # Paths whose compressed bodies are cached even without an ETag, those served to many clients alike
+    COMPRESSION_CACHE_PATHS: list[str] = Field(default_factory=lambda: ["/all_users"])
+    # Background jobs, run by `python manage.py worker` or inside the API process with JOBS_IN_PROCESS
+    JOB_BACKEND: JobQueueBackend = "sqlite"
+    JOB_SQLITE_PATH: str = os.path.join(get_base_dir(), "jobs.sqlite3")
+    JOB_CONCURRENCY: int = 2
+    JOB_RESULT_TTL_SECONDS: int = 86400  # Redis backend only
+    JOBS_IN_PROCESS: bool = False
+    # Admission control, limits per worker beyond which requests get a 503, 0 disables a limit
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_IN_FLIGHT: int = 256
+    ADMISSION_MAX_EVENT_LOOP_LAG: float = 0.5  # Seconds
+    # Concurrent requests per path prefix, for the endpoints bound by Argon2 or serialization
+    ADMISSION_ROUTE_LIMITS: dict[str, int] = Field(default_factory=lambda: {
+        "/login": 16,
+        "/bulk_users/": 2,
+        "/jobs/bulk_users/": 8,
+        "/all_users": 8,
+        "/import/users": 1,
+        "/export/users": 4,
+    })
+    ADMISSION_EXEMPT_PATHS: list[str] = Field(default_factory=lambda: ["/health/", "/metrics"])
+    ADMISSION_RETRY_AFTER: int = 1  # Seconds
+    WARMUP_ENABLED: bool = False
+    WARMUP_DB_CONNECTIONS: int = 10
+    REDIS_URL: str = "redis://localhost"
+    REDIS_MAX_CONNECTIONS: int = 50  # Per worker
+    REDIS_SOCKET_TIMEOUT: float = 1.0  # Seconds
+    # In-process tier of the response cache, entries read from Redis are kept CACHE_L1_TTL seconds at most
+    CACHE_L1_MAX_ENTRIES: int = 10000
+    CACHE_L1_TTL: float = 10
+    # Follow the user changes notified by the database triggers to update the state kept by each worker
+    USER_CHANGES_LISTEN: bool = True
+    # Cached reads, served stale for CACHE_STALE_TTL seconds after their TTL while they are recomputed
+    ALL_USERS_CACHE_TTL: int = 60
+    CACHE_STALE_TTL: int = 300
+    CACHE_EARLY_REFRESH_BETA: float = 1.0  # Higher recomputes earlier before expiry, 0 only on expiry
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: RateLimitBackend = "memory"
+    RATE_LIMIT_WINDOW_SECONDS: int = 60
+    RATE_LIMIT_LOGIN_PER_IP: int = 30
+    RATE_LIMIT_LOGIN_PER_USERNAME: int = 10
+    # Proxies trusted for X-Forwarded-For and X-Forwarded-Proto, comma separated addresses or networks, or "*".
+    # The client address of requests coming through them, used for the per-IP limits, is the forwarded one.
+    FORWARDED_ALLOW_IPS: str = "127.0.0.1"
+    LOGIN_FAILURE_DELAY: float = 0.5
+    # Argon2 cost, pick values for the current hardware with `python manage.py calibrate-argon2`
+    ARGON2_TIME_COST: int = 3
+    ARGON2_MEMORY_COST: int = 65536  # KiB
+    ARGON2_PARALLELISM: int = 4
+
+    @model_validator(mode="after")
+    def split_hash_workers(self):
+        if self.HASH_WORKERS <= 0:
+            self.HASH_WORKERS = max(1, (os.cpu_count() or 1) // self.WORKERS)
+        return self
 
 
 @lru_cache
@@ -6,6 +6,7 @@ from .base import Config, LogFormat
 class ProdConfig(Config):
     FRONTEND_CORS_ORIGIN: list[str] = Field(default_factory=lambda: ["*"])
     LOG_FORMAT: LogFormat = "json"
+    WARMUP_ENABLED: bool = True
 
     class Config:
         env_file = ".env"
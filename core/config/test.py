@@ -13,3 +13,9 @@ class TestConfig(Config):
     SQLALCHEMY_ECHO: bool = False
     LOG_REQUEST_RESPONSE: bool = True
     ENABLE_METRICS: bool = True
+    RATE_LIMIT_LOGIN_PER_IP: int = 1000
+    LOGIN_FAILURE_DELAY: float = 0.05
+    ARGON2_TIME_COST: int = 1
+    ARGON2_MEMORY_COST: int = 8192
+    # Tests hash on the event loop, keep the shedding from depending on the machine's speed
+    ADMISSION_MAX_EVENT_LOOP_LAG: float = 0
@@ -1,3 +1,5 @@
+import logging
+import time
 from typing import AsyncGenerator
 
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
@@ -6,12 +8,15 @@ from core.config import get_config
 from lib.utils import auto_generate_users
 
 config = get_config()
+logger = logging.getLogger(__name__)
 
 async_engine = create_async_engine(
     config.DATABASE_URL,
     echo=False,
-    pool_size=30,  # Default pool size
-    max_overflow=20,  # Allow 20 additional connections beyond the pool size
+    # The pool limits are for all the workers of a host, each worker gets its share, less the connection
+    # following the user changes
+    pool_size=max(1, config.DB_POOL_SIZE // config.WORKERS - (1 if config.USER_CHANGES_LISTEN else 0)),
+    max_overflow=config.DB_MAX_OVERFLOW // config.WORKERS,
     pool_timeout=30,  # Wait 30 seconds for a connection before timeout
     pool_recycle=1800,  # Recycle connections every 30 minutes
     pool_pre_ping=True  # Check connection health before using
@@ -36,6 +41,7 @@ async def create_async_session() -> AsyncSession:
 
 async def init_db():
     db_session = await create_async_session()
+    start_time = time.perf_counter()
     try:
         if await auto_generate_users(db_session):
             print("Generated users")
@@ -43,3 +49,4 @@ async def init_db():
             #     print("Reset user passwords")
     finally:
         await db_session.close()
+        logger.info("init_db finished in %.4fs", time.perf_counter() - start_time)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from collections import Counter as Counts
+from typing import Optional
+
+from prometheus_client import Counter
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from core.config import get_config
+
+config = get_config()
+logger = logging.getLogger(__name__)
+
+SHED_REQUESTS = Counter(
+    "http_requests_shed_total",
+    "Requests rejected with a 503 by the admission control.",
+    ["route", "reason"],
+)
+
+
+class EventLoopLagMonitor:
+    """Measures how late the event loop wakes up a task sleeping for `interval` seconds"""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - expected)
+
+
+def route_path(scope: Scope) -> str:
+    """The path of the request within the app, without the `root_path` it is mounted at behind a proxy"""
+    path, root_path = scope["path"], scope.get("root_path", "")
+    if root_path and path.startswith(root_path) and path[len(root_path):len(root_path) + 1] in ("", "/"):
+        return path[len(root_path):] or "/"
+    return path
+
+
+class AdmissionControlMiddleware:
+    """
+    Reject requests with a 503 and a Retry-After header instead of queueing them when the worker is overloaded.
+
+    A request is rejected when `max_in_flight` requests are already being served, when the event loop lags
+    more than `max_lag` seconds behind, or when its path starts with a prefix of `route_limits` and that
+    many requests of the prefix are already being served. The limits apply per worker, 0 disables them.
+    Prefixes are matched against the path within the app, whatever `root_path` it is served under.
+    """
+
+    def __init__(self, app: ASGIApp, max_in_flight: int = 0, max_lag: float = 0, route_limits: dict[str, int] = None,
+                 exempt_paths: tuple[str, ...] = (), retry_after: int = 1):
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.max_lag = max_lag
+        self.route_limits = route_limits or {}
+        self.exempt_paths = tuple(exempt_paths)
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.route_in_flight: Counts[str] = Counts()
+        self.lag_monitor = EventLoopLagMonitor() if max_lag > 0 else None
+
+    def route_of(self, path: str) -> Optional[str]:
+        for prefix in self.route_limits:
+            if path.startswith(prefix):
+                return prefix
+        return None
+
+    def rejection_reason(self, route: Optional[str]) -> Optional[str]:
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return "in_flight"
+        if self.lag_monitor is not None and self.lag_monitor.lag > self.max_lag:
+            return "event_loop_lag"
+        if route is not None and self.route_in_flight[route] >= self.route_limits[route]:
+            return "route_limit"
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "lifespan" and self.lag_monitor is not None:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.lag_monitor.stop()
+            return
+
+        if scope["type"] != "http" or route_path(scope).startswith(self.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+
+        if self.lag_monitor is not None:
+            self.lag_monitor.start()
+
+        route = self.route_of(route_path(scope))
+        if reason := self.rejection_reason(route):
+            SHED_REQUESTS.labels(route=route or "*", reason=reason).inc()
+            logger.warning("Rejected %s %s: %s", scope["method"], scope["path"], reason)
+            await self.reject(send)
+            return
+
+        self.in_flight += 1
+        if route is not None:
+            self.route_in_flight[route] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            if route is not None:
+                self.route_in_flight[route] -= 1
+
+    async def reject(self, send: Send):
+        body = b'{"detail":"Server overloaded, retry later"}'
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,6 +1,10 @@
 import asyncio
+import hashlib
+import time
+from collections import OrderedDict
 from datetime import timedelta, datetime
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, TYPE_CHECKING
 
 from fastapi import FastAPI
 from fastapi.security import OAuth2PasswordBearer
@@ -8,25 +12,88 @@ from httpx import AsyncClient, ASGITransport, Auth
 
 from core.config import get_config
 from jose import jwt, JWTError
-from passlib.context import CryptContext
+from lib.timing import stage
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 config = get_config()
 
 
+@lru_cache
+def get_pwd_context() -> "CryptContext":
+    """Build the password hashing context on first use, keeping passlib and argon2 out of the import path"""
+    from passlib.context import CryptContext
+
+    return CryptContext(
+        schemes=["argon2"],
+        deprecated="auto",
+        argon2__rounds=config.ARGON2_TIME_COST,
+        argon2__memory_cost=config.ARGON2_MEMORY_COST,
+        argon2__parallelism=config.ARGON2_PARALLELISM,
+    )
+
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    with stage("hash"):
+        return get_pwd_context().verify(plain_password, hashed_password)
 
 
 async def verify_password_async(plain_password, hashed_password):
-    return await asyncio.to_thread(pwd_context.verify, plain_password, hashed_password)
+    return await asyncio.to_thread(verify_password, plain_password, hashed_password)
+
+
+async def verify_and_update_password_async(plain_password, hashed_password) -> tuple[bool, Optional[str]]:
+    """Verify the password and, if the hash was made with other Argon2 parameters, return a new hash for it"""
+    with stage("hash"):
+        return await asyncio.to_thread(get_pwd_context().verify_and_update, plain_password, hashed_password)
 
 
 def hash_password(password):
-    return pwd_context.hash(password)
+    with stage("hash"):
+        return get_pwd_context().hash(password)
+
+
+def calibrate_argon2(target_ms: float, parallelism: int = 4, max_memory_cost: int = 262144,
+                     min_memory_cost: int = 8192) -> dict[str, int | float]:
+    """
+    Find Argon2 parameters whose verification takes about `target_ms` on the current hardware.
+
+    Memory cost is preferred over time cost: it starts at `max_memory_cost` and is halved while a single
+    pass is over the target, then passes are added while they still fit in the target.
+
+    Returns:
+        dict: The time cost, memory cost (KiB) and parallelism, and the measured verify time in ms.
+    """
+    from passlib.hash import argon2
+
+    def measure(time_cost: int, memory_cost: int) -> float:
+        handler = argon2.using(rounds=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        hashed_password = handler.hash("calibration-password")
+        timings = []
+        for _ in range(3):
+            start_time = time.perf_counter()
+            handler.verify("calibration-password", hashed_password)
+            timings.append((time.perf_counter() - start_time) * 1000)
+        return min(timings)
+
+    time_cost, memory_cost = 1, max_memory_cost
+    elapsed = measure(time_cost, memory_cost)
+    while elapsed > target_ms and memory_cost // 2 >= min_memory_cost:
+        memory_cost //= 2
+        elapsed = measure(time_cost, memory_cost)
+
+    while (candidate := measure(time_cost + 1, memory_cost)) <= target_ms:
+        time_cost, elapsed = time_cost + 1, candidate
+
+    return {
+        "ARGON2_TIME_COST": time_cost,
+        "ARGON2_MEMORY_COST": memory_cost,
+        "ARGON2_PARALLELISM": parallelism,
+        "verify_ms": round(elapsed, 2),
+    }
 
 
 # JWT Token Creation
@@ -41,7 +108,58 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def decode_access_token(token: str):
+def create_user_access_token(user) -> str:
+    """Token for `user`, carrying its authorization claims and token version when STATELESS_TOKENS is set"""
+    data = {"sub": str(user.id)}
+    if config.STATELESS_TOKENS:
+        data.update({
+            "adm": user.is_admin,
+            "act": user.is_active,
+            "rst": user.has_password_reset or False,
+            "ver": user.token_version,
+        })
+    return create_access_token(data=data)
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified token payloads keyed by the token digest, emptied when the signing key changes.
+    Callers get their own copy of the payload, changing it does not change what later requests see.
+    """
+
+    def __init__(self):
+        self._payloads: OrderedDict[bytes, dict] = OrderedDict()
+        self._key = None
+
+    def get(self, token: str) -> Optional[dict]:
+        if self._key != (config.JWT_SECRET, config.ALGORITHM):
+            self.clear()
+            return None
+
+        digest = hashlib.sha256(token.encode()).digest()
+        payload = self._payloads.get(digest)
+        if payload is None:
+            return None
+        if "exp" in payload and payload["exp"] <= time.time():
+            del self._payloads[digest]
+            return None
+        self._payloads.move_to_end(digest)
+        return dict(payload)
+
+    def set(self, token: str, payload: dict):
+        self._payloads[hashlib.sha256(token.encode()).digest()] = dict(payload)
+        if len(self._payloads) > config.JWT_CACHE_SIZE:
+            self._payloads.popitem(last=False)
+
+    def clear(self):
+        self._payloads.clear()
+        self._key = (config.JWT_SECRET, config.ALGORITHM)
+
+
+token_cache = TokenCache()
+
+
+def decode_access_token_uncached(token: str):
     try:
         payload = jwt.decode(token, config.JWT_SECRET, algorithms=[config.ALGORITHM])
         return payload
@@ -49,6 +167,19 @@ def decode_access_token(token: str):
         return None
 
 
+def decode_access_token(token: str):
+    """Decode and verify the token, serving tokens verified before from `token_cache`"""
+    if config.JWT_CACHE_SIZE <= 0:
+        return decode_access_token_uncached(token)
+
+    if (payload := token_cache.get(token)) is not None:
+        return payload
+    payload = decode_access_token_uncached(token)
+    if payload is not None:
+        token_cache.set(token, payload)
+    return payload
+
+
 class JWTAuth(Auth):
     def __init__(self, token):
         self.token = token
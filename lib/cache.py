@@ -0,0 +1,383 @@
+import asyncio
+import logging
+import math
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+import orjson
+from fastapi_cache import FastAPICache
+from fastapi_cache.types import Backend
+from prometheus_client import Counter, Gauge
+
+from core.config import get_config
+
+config = get_config()
+logger = logging.getLogger(__name__)
+
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total",
+    "Reads of the coalescing cache by name and result (hit, stale, early_refresh, miss).",
+    ["name", "result"],
+)
+CACHE_TIER_LOOKUPS = Counter(
+    "cache_tier_lookups_total",
+    "Reads of the response cache backend by tier (l1 in process, l2 Redis) and result (hit, miss).",
+    ["tier", "result"],
+)
+CACHE_L1_ENTRIES = Gauge("cache_l1_entries", "Entries held by the in-process tier of the response cache.")
+
+
+class LocalCache:
+    """Least recently used values, at most `max_entries`, each expiring at its own time"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, now: float) -> Optional[tuple[float, bytes]]:
+        """The expiry time and value of `key`"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, value: bytes, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> int:
+        return int(self._entries.pop(key, None) is not None)
+
+    def delete_prefix(self, prefix: str) -> int:
+        keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class TieredBackend(Backend):
+    """
+    FastAPICache backend keeping the hot entries in process (L1) in front of Redis (L2).
+
+    Reads are served from the L1 when possible, otherwise from Redis and kept in the L1 for at most `l1_ttl`
+    seconds. Writes and invalidations go to both tiers and are published on `channel`, so the other workers
+    drop their L1 copy; `l1_ttl` bounds how stale a worker can be when it misses a message. The subscription
+    is renewed with a growing delay when lost, the L1 is then emptied since messages were missed meanwhile.
+    Without Redis, when it is not configured or unreachable on startup, the L1 alone keeps the entries for
+    their full TTL.
+    """
+
+    def __init__(self, max_entries: int = 10000, l1_ttl: float = 10, channel: str = "cache-invalidations",
+                 reconnect_delay: float = 1.0, max_reconnect_delay: float = 30):
+        self.local = LocalCache(max_entries)
+        self.l1_ttl = l1_ttl
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.redis = None
+        self._id = uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None
+
+    async def connect(self, url: str, max_connections: int = 50, socket_timeout: float = 1.0) -> bool:
+        """Use the Redis at `url` as L2 and follow the invalidations of the other workers"""
+        from redis import asyncio as aioredis
+
+        redis = aioredis.from_url(url, max_connections=max_connections, socket_timeout=socket_timeout,
+                                  socket_connect_timeout=socket_timeout, health_check_interval=30)
+        self.redis = redis
+        try:
+            pubsub = await self._subscribe()
+        except Exception as e:
+            logger.warning("The response cache is in process only, Redis is unavailable: %s", e)
+            self.redis = None
+            await redis.close()
+            return False
+
+        self._listener = asyncio.create_task(self._listen(pubsub))
+        return True
+
+    async def _subscribe(self):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.channel)
+        return pubsub
+
+    async def _listen(self, pubsub):
+        delay = self.reconnect_delay
+        try:
+            while True:
+                try:
+                    if pubsub is None:
+                        pubsub = await self._subscribe()
+                        # The invalidations sent meanwhile were missed
+                        self.local.clear()
+                        CACHE_L1_ENTRIES.set(0)
+                        logger.info("Following cache invalidations again")
+                    async for message in pubsub.listen():
+                        delay = self.reconnect_delay
+                        self._on_invalidation(message["data"])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("Lost the cache invalidations, entries may stay stale for %ss, resubscribing "
+                                   "in %.1fs: %s", self.l1_ttl, delay, e)
+                    if pubsub is not None:
+                        await self._close_pubsub(pubsub)
+                        pubsub = None
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_reconnect_delay)
+        finally:
+            if pubsub is not None:
+                await self._close_pubsub(pubsub)
+
+    @staticmethod
+    async def _close_pubsub(pubsub):
+        try:
+            await pubsub.close()
+        except Exception:
+            # Its connection is already lost
+            pass
+
+    def _on_invalidation(self, data: bytes):
+        try:
+            sender, kind, target = data.decode().split(":", 2)
+        except (UnicodeDecodeError, ValueError):
+            logger.warning("Ignored the malformed cache invalidation %r", data)
+            return
+        if sender == self._id:
+            return
+        if kind == "key":
+            self.local.delete(target)
+        else:
+            self.local.delete_prefix(target)
+        CACHE_L1_ENTRIES.set(len(self.local))
+
+    async def _publish(self, pipe, kind: str, target: str):
+        pipe.publish(self.channel, f"{self._id}:{kind}:{target}")
+        try:
+            await pipe.execute()
+        except Exception as e:
+            logger.warning("Cache write of %s failed: %s", target, e)
+
+    def _l1_expiry(self, now: float, ttl: Optional[float]) -> float:
+        ttl = ttl if ttl and ttl > 0 else math.inf
+        return now + (min(ttl, self.l1_ttl) if self.redis is not None else ttl)
+
+    async def get_with_ttl(self, key: str) -> tuple[int, Optional[bytes]]:
+        now = time.monotonic()
+        if (entry := self.local.get(key, now)) is not None:
+            CACHE_TIER_LOOKUPS.labels(tier="l1", result="hit").inc()
+            expires_at, value = entry
+            return (int(expires_at - now) if expires_at != math.inf else -1), value
+        CACHE_TIER_LOOKUPS.labels(tier="l1", result="miss").inc()
+        if self.redis is None:
+            return 0, None
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                ttl, value = await pipe.ttl(key).get(key).execute()
+        except Exception as e:
+            logger.warning("Cache read of %s failed: %s", key, e)
+            return 0, None
+        if value is None:
+            CACHE_TIER_LOOKUPS.labels(tier="l2", result="miss").inc()
+            return 0, None
+
+        CACHE_TIER_LOOKUPS.labels(tier="l2", result="hit").inc()
+        self.local.set(key, value, self._l1_expiry(now, ttl))
+        CACHE_L1_ENTRIES.set(len(self.local))
+        return ttl, value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.get_with_ttl(key))[1]
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        self.local.set(key, value, self._l1_expiry(time.monotonic(), expire))
+        CACHE_L1_ENTRIES.set(len(self.local))
+        if self.redis is not None:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.set(key, value, ex=expire)
+                await self._publish(pipe, "key", key)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        if namespace:
+            count = self.local.delete_prefix(namespace)
+        elif key:
+            count = self.local.delete(key)
+        else:
+            return 0
+        CACHE_L1_ENTRIES.set(len(self.local))
+        if self.redis is None:
+            return count
+
+        try:
+            keys = [key] if key else [name async for name in self.redis.scan_iter(match=f"{namespace}*")]
+        except Exception as e:
+            logger.warning("Cache invalidation of %s failed: %s", namespace, e)
+            return count
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if keys:
+                pipe.delete(*keys)
+            await self._publish(pipe, "key" if key else "prefix", key or namespace)
+        return max(count, len(keys))
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+
+class CoalescingCache:
+    """
+    Cache of computed values in the FastAPICache backend, protected against stampedes.
+
+    Concurrent misses of a key share a single computation (single-flight). Entries are kept `stale_ttl`
+    seconds after their `ttl`, during which the stale value is served while one background task recomputes
+    it (stale-while-revalidate). Fresh entries are also recomputed in the background a little before they
+    expire, with a probability growing as the expiry gets near and as the computation is slow (XFetch,
+    tuned by `beta`), so the refreshes of a popular key are spread instead of all happening at expiry.
+
+    Values must be serializable with orjson. Without a backend, before the app started, every read computes.
+    """
+
+    def __init__(self, stale_ttl: int = 300, beta: float = 1.0):
+        self.stale_ttl = stale_ttl
+        self.beta = beta
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self._generations: dict[str, int] = {}
+        self._refreshes: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _backend():
+        try:
+            return FastAPICache.get_backend()
+        except AssertionError:
+            return None
+
+    @staticmethod
+    def _full_key(key: str) -> str:
+        return f"{FastAPICache.get_prefix() or ''}:coalesced:{key}"
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int) -> Any:
+        """Cached value of `key`, computed by `compute` and kept `ttl` seconds when missing"""
+        backend = self._backend()
+        if backend is None:
+            return await self._single_flight(key, compute, ttl, None)
+
+        try:
+            entry = await backend.get(self._full_key(key))
+        except Exception as e:
+            logger.warning("Cache read of %s failed: %s", key, e)
+            entry = None
+
+        if entry is None:
+            CACHE_LOOKUPS.labels(name=key, result="miss").inc()
+            return await self._single_flight(key, compute, ttl, backend)
+
+        entry = orjson.loads(entry)
+        expires_at = entry["created_at"] + ttl
+        now = time.time()
+        if now >= expires_at:
+            CACHE_LOOKUPS.labels(name=key, result="stale").inc()
+            self._refresh(key, compute, ttl, backend)
+        elif now - entry["duration"] * self.beta * math.log(1 - random.random()) >= expires_at:
+            CACHE_LOOKUPS.labels(name=key, result="early_refresh").inc()
+            self._refresh(key, compute, ttl, backend)
+        else:
+            CACHE_LOOKUPS.labels(name=key, result="hit").inc()
+        return entry["value"]
+
+    def _single_flight(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int, backend) -> asyncio.Future:
+        """The computation of `key` in progress, started when there is none"""
+        if (future := self._in_flight.get(key)) is None:
+            future = asyncio.ensure_future(self._compute(key, compute, ttl, backend))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # Shielded so a cancelled request does not cancel the computation the others wait for
+        return asyncio.shield(future)
+
+    def _forget(self, key: str, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if not future.cancelled() and future.exception() is not None:
+            # Retrieved here so a failure nobody awaited anymore is not reported as never retrieved
+            logger.debug("Computation of %s failed: %s", key, future.exception())
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int, backend) -> Any:
+        generation = self._generations.get(key, 0)
+        start_time = time.perf_counter()
+        value = await compute()
+        duration = time.perf_counter() - start_time
+
+        # Invalidated while computing, the value may already be outdated
+        if backend is not None and self._generations.get(key, 0) == generation:
+            entry = orjson.dumps({"value": value, "created_at": time.time(), "duration": duration})
+            try:
+                await backend.set(self._full_key(key), entry, expire=ttl + self.stale_ttl)
+            except Exception as e:
+                logger.warning("Cache write of %s failed: %s", key, e)
+        return value
+
+    def _refresh(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int, backend):
+        if key in self._in_flight:
+            return
+        task = asyncio.ensure_future(self._single_flight(key, compute, ttl, backend))
+        self._refreshes.add(task)
+        task.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, task: asyncio.Task):
+        self._refreshes.discard(task)
+        if not task.cancelled() and (error := task.exception()) is not None:
+            logger.warning("Background cache refresh failed: %s", error)
+
+    def evict_local(self, key: str):
+        """Drop the in-process copy of `key`, for changes already invalidated in Redis by another process"""
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._in_flight.pop(key, None)
+        if isinstance(backend := self._backend(), TieredBackend):
+            backend.local.delete(self._full_key(key))
+            CACHE_L1_ENTRIES.set(len(backend.local))
+
+    async def invalidate(self, key: str):
+        """Drop the cached value of `key`, computations already started are not stored"""
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._in_flight.pop(key, None)
+        if (backend := self._backend()) is None:
+            return
+        try:
+            await backend.clear(key=self._full_key(key))
+        except KeyError:
+            # Raised by the InMemoryBackend of fastapi-cache for missing keys
+            pass
+        except Exception as e:
+            logger.warning("Cache invalidation of %s failed: %s", key, e)
+
+
+response_cache = CoalescingCache(stale_ttl=config.CACHE_STALE_TTL, beta=config.CACHE_EARLY_REFRESH_BETA)
+
+
+async def register_cache() -> TieredBackend:
+    """Initialize the response cache, called on startup so the Redis client is only built when serving"""
+    backend = TieredBackend(max_entries=config.CACHE_L1_MAX_ENTRIES, l1_ttl=config.CACHE_L1_TTL)
+    if config.REDIS_URL:
+        await backend.connect(config.REDIS_URL, max_connections=config.REDIS_MAX_CONNECTIONS,
+                              socket_timeout=config.REDIS_SOCKET_TIMEOUT)
+    FastAPICache.init(backend, prefix="fastapi-cache")
+    return backend
@@ -0,0 +1,279 @@
+import gzip
+import hashlib
+import logging
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.config import get_config
+from lib.admission import route_path
+from lib.timing import stage
+
+config = get_config()
+logger = logging.getLogger(__name__)
+
+
+class Encoder:
+    """A content coding, `compress` for whole bodies and `compressor` for streamed ones"""
+    name: str
+
+    def compress(self, body: bytes) -> bytes:
+        raise NotImplementedError
+
+    def compressor(self):
+        """Object whose `compress(chunk)` and `flush()` return the compressed stream"""
+        raise NotImplementedError
+
+
+class GzipEncoder(Encoder):
+    name = "gzip"
+
+    def __init__(self, level: int):
+        self.level = level
+
+    def compress(self, body: bytes) -> bytes:
+        return gzip.compress(body, compresslevel=self.level, mtime=0)
+
+    def compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+
+class BrotliEncoder(Encoder):
+    name = "br"
+
+    def __init__(self, quality: int):
+        import brotli
+
+        self.brotli = brotli
+        self.quality = quality
+
+    def compress(self, body: bytes) -> bytes:
+        return self.brotli.compress(body, quality=self.quality)
+
+    def compressor(self):
+        return _BrotliStream(self.brotli.Compressor(quality=self.quality))
+
+
+class _BrotliStream:
+    """zlib-like interface over a brotli compressor"""
+
+    def __init__(self, compressor):
+        self._compressor = compressor
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._compressor.process(chunk)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdEncoder(Encoder):
+    name = "zstd"
+
+    def __init__(self, level: int):
+        import zstandard
+
+        self.zstd = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, body: bytes) -> bytes:
+        return self.zstd.compress(body)
+
+    def compressor(self):
+        return self.zstd.compressobj()
+
+
+def create_encoders(encodings: list[str]) -> list[Encoder]:
+    """Encoders for `encodings`, in order of preference, skipping those whose library is not installed"""
+    factories = {
+        "zstd": lambda: ZstdEncoder(config.COMPRESSION_ZSTD_LEVEL),
+        "br": lambda: BrotliEncoder(config.COMPRESSION_BROTLI_QUALITY),
+        "gzip": lambda: GzipEncoder(config.COMPRESSION_GZIP_LEVEL),
+    }
+    encoders = []
+    for encoding in encodings:
+        try:
+            encoders.append(factories[encoding]())
+        except ImportError:
+            logger.warning("The module for the %s encoding was not found. Skipping it.", encoding)
+    return encoders
+
+
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    """Map each coding of an Accept-Encoding header to its quality value"""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+class CompressedBodyCache:
+    """LRU of compressed bodies keyed by ETag (or body digest) and encoding, bounded by their total size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._bodies: OrderedDict[tuple[bytes, str], bytes] = OrderedDict()
+
+    def get(self, key: tuple[bytes, str]) -> Optional[bytes]:
+        body = self._bodies.get(key)
+        if body is not None:
+            self._bodies.move_to_end(key)
+        return body
+
+    def set(self, key: tuple[bytes, str], body: bytes):
+        if len(body) > self.max_bytes or key in self._bodies:
+            return
+        self._bodies[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self._bodies.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with the best coding the client accepts among zstd, br and gzip.
+
+    Only responses of a compressible content type and at least `minimum_size` bytes are compressed.
+    Whole bodies are compressed at once. Those with an ETag, and those of `cache_paths` by digest, are
+    cached so a repeated payload is only compressed once per coding, the one-off bodies of the other paths
+    would only evict them. Streamed bodies are compressed chunk by chunk.
+    """
+
+    def __init__(self, app: ASGIApp, encoders: list[Encoder], minimum_size: int = 1000,
+                 content_types: tuple[str, ...] = ("application/json", "text/"), cache_max_bytes: int = 0,
+                 cache_paths: tuple[str, ...] = ()):
+        self.app = app
+        self.encoders = encoders
+        self.minimum_size = minimum_size
+        self.content_types = tuple(content_types)
+        self.cache = CompressedBodyCache(cache_max_bytes) if cache_max_bytes > 0 else None
+        self.cache_paths = frozenset(cache_paths)
+
+    def select_encoder(self, accept_encoding: str) -> Optional[Encoder]:
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoder in self.encoders:
+            if accepted.get(encoder.name, accepted.get("*", 0)) > 0:
+                return encoder
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoder = self.select_encoder(Headers(scope=scope).get("Accept-Encoding", ""))
+        if encoder is None:
+            await self.app(scope, receive, send)
+            return
+
+        await CompressionResponder(self, encoder, send).run(scope, receive)
+
+
+class CompressionResponder:
+    # Bodies of a known length up to this size are collected and compressed at once, larger ones are streamed
+    MAX_BUFFERED_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, middleware: CompressionMiddleware, encoder: Encoder, send: Send):
+        self.middleware = middleware
+        self.encoder = encoder
+        self.send = send
+        self.path = ""
+        self.query_string = b""
+        self.start_message: Optional[Message] = None
+        self.content_length: Optional[int] = None
+        self.buffer = bytearray()
+        self.compressor = None
+        self.passthrough = False
+
+    async def run(self, scope: Scope, receive: Receive):
+        self.path = route_path(scope)
+        self.query_string = scope.get("query_string", b"")
+        await self.middleware.app(scope, receive, self.send_compressed)
+
+    def _should_compress(self, headers: Headers) -> bool:
+        return ("Content-Encoding" not in headers
+                and headers.get("Content-Type", "").startswith(self.middleware.content_types))
+
+    def _set_encoding_headers(self, headers: MutableHeaders):
+        headers["Content-Encoding"] = self.encoder.name
+        headers.add_vary_header("Accept-Encoding")
+
+    def _compress_body(self, body: bytes, headers: Headers) -> bytes:
+        cache = self.middleware.cache
+        etag = headers.get("ETag")
+        if cache is None or not (etag or self.path in self.middleware.cache_paths):
+            return self.encoder.compress(body)
+
+        # ETags are only unique per resource, hence the path and query in the key
+        if etag:
+            digest = b"%s?%s %s" % (self.path.encode(), self.query_string, etag.encode())
+        else:
+            digest = hashlib.blake2b(body, digest_size=16).digest()
+        key = (digest, self.encoder.name)
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = self.encoder.compress(body)
+            cache.set(key, compressed)
+        return compressed
+
+    async def send_compressed(self, message: Message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = not self._should_compress(headers)
+            if self.passthrough:
+                await self.send(message)
+            elif headers.get("Content-Length", "").isdigit():
+                self.content_length = int(headers["Content-Length"])
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+
+        if self.content_length is not None and self.content_length <= self.MAX_BUFFERED_SIZE:
+            # The size is known, the body may still come in several messages when wrapped by another middleware
+            self.buffer += body
+            if more_body:
+                return
+            body = bytes(self.buffer)
+            if len(body) >= self.middleware.minimum_size:
+                with stage("compress"):
+                    body = self._compress_body(body, headers)
+                self._set_encoding_headers(headers)
+                headers["Content-Length"] = str(len(body))
+            self.passthrough = True
+            await self.send(self.start_message)
+            await self.send({"type": "http.response.body", "body": body})
+            return
+
+        if self.compressor is None:
+            # First chunk of a streamed body
+            self.compressor = self.encoder.compressor()
+            self._set_encoding_headers(headers)
+            if "Content-Length" in headers:
+                del headers["Content-Length"]
+            await self.send(self.start_message)
+
+        with stage("compress"):
+            chunk = self.compressor.compress(body)
+            if not more_body:
+                chunk += self.compressor.flush()
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+from sqlalchemy import Integer, String, column, func, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from core.config import get_config
+from lib.auth import hash_password
+from lib.revocation import token_revocations
+from models.user import User
+
+config = get_config()
+
+_hash_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _hash_passwords(passwords: list[str]) -> list[str]:
+    return [hash_password(password) for password in passwords]
+
+
+def create_hash_pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool for Argon2 hashing, spawned so the children don't inherit the parent's DB connections"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def get_hash_pool() -> ProcessPoolExecutor:
+    """The pool of HASH_WORKERS processes shared by the requests and jobs of this process, started on first use"""
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = create_hash_pool(config.HASH_WORKERS)
+    return _hash_pool
+
+
+def shutdown_hash_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(cancel_futures=True)
+        _hash_pool = None
+
+
+async def hash_passwords_parallel(passwords: list[str], pool: ProcessPoolExecutor, workers: int) -> list[str]:
+    """Hash `passwords` split evenly across the `workers` processes of `pool`, keeping their order"""
+    if not passwords:
+        return []
+    loop = asyncio.get_running_loop()
+    chunk_size = -(-len(passwords) // workers)
+    chunks = [passwords[i:i + chunk_size] for i in range(0, len(passwords), chunk_size)]
+    results = await asyncio.gather(*(loop.run_in_executor(pool, _hash_passwords, chunk) for chunk in chunks))
+    return [hashed_password for chunk in results for hashed_password in chunk]
+
+
+def _read_checkpoint(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"last_id": 0, "rotated": 0}
+
+
+def _write_checkpoint(path: str, checkpoint: dict):
+    # Write then rename so an interrupted write never leaves a corrupt checkpoint behind
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
+
+
+async def rotate_user_passwords(
+        session: AsyncSession,
+        output_path: str,
+        checkpoint_path: str,
+        batch_size: int = 1000,
+        workers: Optional[int] = None,
+        group: Optional[str] = None,
+        resume: bool = False,
+        on_progress: Optional[Callable[[int, int, float], None]] = None,
+) -> int:
+    """
+    Give every non-admin user a new random password that must be reset on the next login.
+
+    Users are streamed in primary key order in batches of `batch_size`, the batch is hashed across
+    `workers` processes and committed on its own. The new credentials are appended to `output_path`
+    as JSON lines and the last committed id is saved to `checkpoint_path`, so an interrupted rotation
+    continues where it stopped when run again with `resume`. When done, the credentials are merged
+    into the users file.
+
+    Returns:
+        int: The number of users rotated, including those rotated before resuming.
+    """
+    from passlib.utils import generate_password
+
+    if not resume:
+        for path in (output_path, checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+    checkpoint = _read_checkpoint(checkpoint_path)
+
+    conditions = [User.is_admin.is_(False)]
+    if group:
+        conditions.append(User.group == group)
+    result = await session.execute(
+        select(func.count()).select_from(User).where(*conditions, User.id > checkpoint["last_id"]))
+    total = checkpoint["rotated"] + result.scalar()
+
+    workers = workers or os.cpu_count()
+    start_time = time.perf_counter()
+    started_at = checkpoint["rotated"]
+    with create_hash_pool(workers) as pool, open(output_path, "a", encoding="utf-8") as output:
+        while True:
+            result = await session.execute(
+                select(User.id, User.username)
+                .where(*conditions, User.id > checkpoint["last_id"])
+                .order_by(User.id)
+                .limit(batch_size)
+            )
+            batch = result.all()
+            # Not left idle in a transaction, holding a connection, while the batch is hashed
+            await session.commit()
+            if not batch:
+                break
+
+            passwords = [generate_password(12) for _ in batch]
+            hashed_passwords = await hash_passwords_parallel(passwords, pool, workers)
+
+            for (_, username), password in zip(batch, passwords):
+                output.write(json.dumps({"username": username, "password": password}) + "\n")
+            output.flush()
+            os.fsync(output.fileno())
+
+            new_passwords = values(column("id", Integer), column("password", String), name="new_passwords").data(
+                [(user_id, hashed_password) for (user_id, _), hashed_password in zip(batch, hashed_passwords)])
+            # One statement for the batch, the tokens issued with the old passwords stop being accepted
+            result = await session.execute(
+                update(User)
+                .where(User.id == new_passwords.c.id)
+                .values(password=new_passwords.c.password, has_password_reset=True,
+                        token_version=User.token_version + 1)
+                .returning(User.id, User.token_version)
+                .execution_options(synchronize_session=False)
+            )
+            versions = result.all()
+            await session.commit()
+            for user_id, token_version in versions:
+                await token_revocations.revoke(user_id, token_version)
+
+            checkpoint = {"last_id": batch[-1][0], "rotated": checkpoint["rotated"] + len(batch)}
+            _write_checkpoint(checkpoint_path, checkpoint)
+
+            if on_progress:
+                elapsed = time.perf_counter() - start_time
+                on_progress(checkpoint["rotated"], total, (checkpoint["rotated"] - started_at) / elapsed)
+
+    _merge_credentials(output_path)
+    return checkpoint["rotated"]
+
+
+def _merge_credentials(output_path: str):
+    try:
+        with open(config.USERS_PATH, "r", encoding="utf-8") as f:
+            users = json.load(f)
+    except FileNotFoundError:
+        users = {}
+
+    # A batch written before an interruption may appear twice, the latest line is the committed one
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            credentials = json.loads(line)
+            users[credentials["username"]] = credentials["password"]
+
+    with open(config.USERS_PATH, "w", encoding="utf-8") as f:
+        json.dump(users, f, indent=4)
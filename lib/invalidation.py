@@ -0,0 +1,145 @@
+import asyncio
+import inspect
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional, Union
+
+from core.config import get_config
+
+config = get_config()
+logger = logging.getLogger(__name__)
+
+CHANNEL = "user_changes"
+
+
+@dataclass
+class UserChanges:
+    """Users inserted, updated or deleted, with their token version when known. `everything` when too many
+    users changed, or notifications may have been missed, to list them. `table` is the changed table, "user"
+    or "profile", None when unknown."""
+    user_ids: set[int] = field(default_factory=set)
+    token_versions: dict[int, int] = field(default_factory=dict)
+    everything: bool = False
+    table: Optional[str] = None
+
+    @classmethod
+    def parse(cls, payload: str) -> "UserChanges":
+        """Parse `table|items`, the table is missing from the payloads sent before the notify_changed_table
+        migration"""
+        table, _, payload = payload.rpartition("|")
+        if payload == "*":
+            return cls(everything=True, table=table or None)
+        changes = cls(table=table or None)
+        for item in payload.split(","):
+            user_id, _, version = item.partition(":")
+            changes.user_ids.add(int(user_id))
+            if version:
+                changes.token_versions[int(user_id)] = int(version)
+        return changes
+
+
+class UserChangeListener:
+    """
+    Follows the changes of users and profiles notified by the database and passes them to the handlers.
+
+    Triggers on the user and profile tables (see the notify_user_changes migration) notify the ids of the
+    changed users on commit, whatever made the change. Every worker keeps one LISTEN connection, so the state
+    it keeps in process, like the token revocations or the cached responses, is updated on every worker within
+    milliseconds. The connection is reopened when lost, or retried when it cannot be opened, the handlers then
+    get `everything` since notifications were missed meanwhile.
+    """
+
+    def __init__(self, channel: str = CHANNEL, reconnect_delay: float = 1.0):
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.handlers: list[Callable[[UserChanges], Union[None, Awaitable[None]]]] = []
+        self._url: Optional[str] = None
+        self._connection = None
+        self._reconnect: Optional[asyncio.Task] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def subscribe(self, handler: Callable[[UserChanges], Union[None, Awaitable[None]]]):
+        """Register `handler`, called with every change. Coroutine functions are run as tasks."""
+        self.handlers.append(handler)
+        return handler
+
+    def dispatch(self, changes: UserChanges):
+        for handler in self.handlers:
+            try:
+                result = handler(changes)
+            except Exception:
+                logger.exception("User change handler %s failed", handler.__qualname__)
+                continue
+            if inspect.isawaitable(result):
+                task = asyncio.ensure_future(result)
+                self._tasks.add(task)
+                task.add_done_callback(self._handler_done)
+
+    def _handler_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and (error := task.exception()) is not None:
+            logger.error("User change handler failed: %s", error)
+
+    def _on_notification(self, connection, pid: int, channel: str, payload: str):
+        try:
+            changes = UserChanges.parse(payload)
+        except ValueError:
+            logger.warning("Ignored the malformed user changes %r", payload)
+            return
+        self.dispatch(changes)
+
+    def _on_termination(self, connection):
+        if self._url is not None and (self._reconnect is None or self._reconnect.done()):
+            logger.warning("Lost the connection following user changes, reconnecting")
+            self._reconnect = asyncio.get_running_loop().create_task(self._keep_connected())
+
+    async def _listen(self):
+        import asyncpg
+
+        connection = await asyncpg.connect(self._url)
+        connection.add_termination_listener(self._on_termination)
+        await connection.add_listener(self.channel, self._on_notification)
+        self._connection = connection
+
+    async def _keep_connected(self):
+        while self._url is not None:
+            try:
+                await self._listen()
+            except Exception as e:
+                logger.warning("Could not follow user changes: %s", e)
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            self.dispatch(UserChanges(everything=True))
+            return
+
+    async def connect(self, database_url: str) -> bool:
+        """
+        Start listening on the database of `database_url`, a SQLAlchemy URL. When the database cannot be
+        reached, keep trying in the background and return False.
+        """
+        from sqlalchemy.engine import make_url
+
+        self._url = make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        try:
+            await self._listen()
+        except Exception as e:
+            logger.warning("Could not follow user changes, retrying in the background: %s", e)
+            self._reconnect = asyncio.get_running_loop().create_task(self._keep_connected())
+            return False
+        # Nothing is known of the changes made before
+        self.dispatch(UserChanges(everything=True))
+        return True
+
+    async def close(self):
+        self._url = None
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            self._reconnect = None
+        for task in self._tasks:
+            task.cancel()
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+
+user_changes = UserChangeListener()
@@ -0,0 +1,348 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import FastAPI
+
+from core.config import get_config
+
+config = get_config()
+logger = logging.getLogger(__name__)
+
+# Reports the progress of a running job as (done, total)
+Progress = Callable[[int, int], Awaitable[None]]
+
+JOB_HANDLERS: dict[str, Callable[..., Awaitable[Any]]] = {}
+
+
+def job(name: str):
+    """Register an async function as the handler of the jobs called `name`.
+
+    It is called with a database session, a progress callback and the job parameters as keyword
+    arguments, and returns a JSON serializable result.
+    """
+
+    def decorator(handler):
+        JOB_HANDLERS[name] = handler
+        return handler
+
+    return decorator
+
+
+def new_job(name: str, params: dict) -> dict:
+    return {
+        "id": uuid.uuid4().hex,
+        "name": name,
+        "params": params,
+        "status": "queued",
+        "progress": 0,
+        "total": None,
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+    }
+
+
+class JobBackend(ABC):
+    """Queue and store of jobs, shared by the API, which enqueues them, and the workers running them"""
+
+    @abstractmethod
+    async def enqueue(self, name: str, params: dict) -> dict:
+        """Queue a job and return it"""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[dict]:
+        """The job with its status, progress and result, None when unknown or expired"""
+
+    @abstractmethod
+    async def dequeue(self, timeout: float) -> Optional[dict]:
+        """Mark the oldest queued job as running and return it, waiting up to `timeout` seconds for one"""
+
+    @abstractmethod
+    async def update(self, job_id: str, **fields):
+        """Set fields of a job, like its progress or result"""
+
+    async def recover(self) -> int:
+        """Fail the jobs left running by workers that died, returning how many"""
+        return 0
+
+    async def close(self):
+        pass
+
+
+class SQLiteJobBackend(JobBackend):
+    """Jobs kept in a SQLite file, for local development and tests. Workers poll it for new jobs."""
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = None
+        self._lock = asyncio.Lock()
+
+    async def _connection(self):
+        if self._db is None:
+            import aiosqlite
+
+            db = await aiosqlite.connect(self.path, isolation_level=None)
+            db.row_factory = aiosqlite.Row
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY, name TEXT, params TEXT, status TEXT, progress INTEGER, total INTEGER,
+                    result TEXT, error TEXT, created_at REAL, started_at REAL, finished_at REAL
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (status, created_at)")
+            self._db = db
+        return self._db
+
+    @staticmethod
+    def _to_job(row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    async def enqueue(self, name: str, params: dict) -> dict:
+        job = new_job(name, params)
+        db = await self._connection()
+        await db.execute(
+            "INSERT INTO jobs VALUES (:id, :name, :params, :status, :progress, :total, :result, :error, "
+            ":created_at, :started_at, :finished_at)",
+            {**job, "params": json.dumps(params)},
+        )
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        db = await self._connection()
+        async with db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)) as cursor:
+            row = await cursor.fetchone()
+        return self._to_job(row) if row is not None else None
+
+    async def dequeue(self, timeout: float) -> Optional[dict]:
+        db = await self._connection()
+        deadline = time.monotonic() + timeout
+        while True:
+            # The update claims the job atomically, so several workers can poll the same file
+            async with self._lock, db.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ? WHERE id = "
+                    "(SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1) RETURNING *",
+                    (time.time(),)) as cursor:
+                row = await cursor.fetchone()
+            if row is not None:
+                return self._to_job(row)
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    async def update(self, job_id: str, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        assignments = ", ".join(f"{key} = :{key}" for key in fields)
+        db = await self._connection()
+        await db.execute(f"UPDATE jobs SET {assignments} WHERE id = :id", {**fields, "id": job_id})
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+class RedisJobBackend(JobBackend):
+    """
+    Jobs kept in Redis hashes expiring `ttl` seconds after they finish, their ids queued in a list.
+
+    A worker moves the jobs it takes to its own processing list with BLMOVE (Redis 6.2+), so no job is lost
+    between taking and starting it, and renews a lease every `lease / 3` seconds. The jobs in the lists of
+    workers whose lease expired are failed by `recover`, run when a worker starts and with every renewal.
+    """
+
+    def __init__(self, url: str, prefix: str = "jobs", ttl: int = 86400, lease: int = 30):
+        from redis import asyncio as aioredis
+
+        self.redis = aioredis.from_url(url)
+        self.queue = f"{prefix}:queue"
+        self.workers = f"{prefix}:workers"
+        self.prefix = prefix
+        self.ttl = ttl
+        self.lease = lease
+        self.worker_id = uuid.uuid4().hex
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}:{job_id}"
+
+    def _processing_key(self, worker_id: str) -> str:
+        return f"{self.prefix}:processing:{worker_id}"
+
+    def _worker_key(self, worker_id: str) -> str:
+        return f"{self.prefix}:worker:{worker_id}"
+
+    async def enqueue(self, name: str, params: dict) -> dict:
+        job = new_job(name, params)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job["id"]), mapping={key: json.dumps(value) for key, value in job.items()})
+            pipe.rpush(self.queue, job["id"])
+            await pipe.execute()
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        fields = await self.redis.hgetall(self._key(job_id))
+        return {key.decode(): json.loads(value) for key, value in fields.items()} or None
+
+    async def _renew_lease(self):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._worker_key(self.worker_id), 1, ex=self.lease)
+            pipe.sadd(self.workers, self.worker_id)
+            await pipe.execute()
+
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self._renew_lease()
+                await self.recover()
+            except Exception as e:
+                logger.warning("Could not renew the lease of job worker %s: %s", self.worker_id, e)
+
+    async def dequeue(self, timeout: float) -> Optional[dict]:
+        if self._heartbeat is None:
+            await self._renew_lease()
+            self._heartbeat = asyncio.create_task(self._keep_alive())
+        item = await self.redis.blmove(self.queue, self._processing_key(self.worker_id),
+                                       max(1, round(timeout)), "LEFT", "RIGHT")
+        if item is None:
+            return None
+        job_id = item.decode()
+        await self.update(job_id, status="running", started_at=time.time())
+        return await self.get(job_id)
+
+    async def update(self, job_id: str, **fields):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), mapping={key: json.dumps(value) for key, value in fields.items()})
+            if "finished_at" in fields:
+                pipe.expire(self._key(job_id), self.ttl)
+                pipe.lrem(self._processing_key(self.worker_id), 0, job_id)
+            await pipe.execute()
+
+    async def recover(self) -> int:
+        failed = 0
+        for worker_id in await self.redis.smembers(self.workers):
+            worker_id = worker_id.decode()
+            if worker_id == self.worker_id or await self.redis.exists(self._worker_key(worker_id)):
+                continue
+            # Not requeued, jobs like bulk_users are not safe to run twice
+            while (job_id := await self.redis.lpop(self._processing_key(worker_id))) is not None:
+                await self.update(job_id.decode(), status="failed", error="The worker running the job stopped",
+                                  finished_at=time.time())
+                failed += 1
+            await self.redis.srem(self.workers, worker_id)
+        if failed:
+            logger.warning("Failed %d jobs left running by stopped workers", failed)
+        return failed
+
+    async def close(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+            # Its running jobs, if any, are failed by the other workers
+            await self.redis.delete(self._worker_key(self.worker_id))
+        await self.redis.close()
+
+
+def create_job_backend() -> JobBackend:
+    match config.JOB_BACKEND:
+        case "redis":
+            return RedisJobBackend(config.REDIS_URL, ttl=config.JOB_RESULT_TTL_SECONDS)
+        case _:
+            return SQLiteJobBackend(config.JOB_SQLITE_PATH)
+
+
+class JobWorker:
+    """Runs queued jobs, at most `concurrency` at a time, each with its own database session"""
+
+    def __init__(self, backend: JobBackend, concurrency: int = 2):
+        self.backend = backend
+        self.concurrency = concurrency
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+
+    async def run(self, burst: bool = False):
+        """Run jobs until stopped, or until the queue is empty with `burst`"""
+        slots = asyncio.Semaphore(self.concurrency)
+        running: set[asyncio.Task] = set()
+        await self.backend.recover()
+        try:
+            while not self._stopping:
+                await slots.acquire()
+                job = await self.backend.dequeue(timeout=0 if burst else 1)
+                if job is None:
+                    slots.release()
+                    if burst:
+                        break
+                    continue
+                task = asyncio.create_task(self._run_job(job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    async def _run_job(self, job: dict):
+        from db.session import async_session_factory
+
+        job_id = job["id"]
+
+        async def progress(done: int, total: int):
+            await self.backend.update(job_id, progress=done, total=total)
+
+        start_time = time.perf_counter()
+        try:
+            handler = JOB_HANDLERS[job["name"]]
+            async with async_session_factory() as session:
+                result = await handler(session, progress, **job["params"])
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job_id, job["name"])
+            await self.backend.update(job_id, status="failed", error=str(e) or type(e).__name__,
+                                      finished_at=time.time())
+            return
+        logger.info("Job %s (%s) finished in %.2fs", job_id, job["name"], time.perf_counter() - start_time)
+        await self.backend.update(job_id, status="succeeded", result=result, finished_at=time.time())
+
+
+@job("bulk_users")
+async def bulk_users_job(session, progress: Progress, user_count: int, batch_size: int = 100):
+    from lib.utils import create_bulk_users, load_usernames, save_credentials
+    from services.user import invalidate_all_users
+
+    usernames = await load_usernames(session)
+    users = []
+    while len(users) < user_count:
+        users += await create_bulk_users(min(batch_size, user_count - len(users)), session,
+                                         current_usernames=usernames, save=False)
+        await progress(len(users), user_count)
+    save_credentials(users)
+    await invalidate_all_users()
+    return users
+
+
+def register_jobs(app: FastAPI):
+    app.state.job_backend = create_job_backend()
+
+
+async def start_job_worker(app: FastAPI) -> Optional[asyncio.Task]:
+    """Run jobs inside the API process when JOBS_IN_PROCESS is set, otherwise `manage.py worker` runs them"""
+    if not config.JOBS_IN_PROCESS:
+        return None
+    worker = JobWorker(app.state.job_backend, config.JOB_CONCURRENCY)
+    return asyncio.create_task(worker.run())
@@ -0,0 +1,248 @@
+"""Prefork launcher serving the app with several uvicorn workers sharing one listening socket
+
+The master imports the app once, freezes the garbage collector so the preloaded objects stay in
+copy-on-write pages shared with the workers, then forks the workers. It replaces the workers that
+die, and on SIGHUP re-executes itself with the same socket to load new code and config: the old
+workers are only asked to finish their requests and exit once every new one has run its lifespan
+startup, so no connection is refused during the restart. SIGTERM or SIGINT stops the workers gracefully.
+
+Workers dying before they are ready, like with a bad config or the database down, are restarted with
+an exponential backoff, and the launcher exits after `max_failures` of them in a row.
+"""
+import gc
+import importlib.util
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from typing import Optional
+
+# Configured by the app's logging setup, unlike the loggers created before the app is imported
+logger = logging.getLogger("uvicorn.error")
+
+# Set on re-execution to hand over the listening socket and the workers to retire
+LISTEN_FD_ENV = "LAUNCHER_LISTEN_FD"
+OLD_WORKERS_ENV = "LAUNCHER_OLD_WORKERS"
+
+
+def event_loop_name() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_protocol_name() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def _listen(host: str, port: int, backlog: int) -> socket.socket:
+    if fd := os.environ.pop(LISTEN_FD_ENV, None):
+        sock = socket.socket(fileno=int(fd))
+    else:
+        sock = socket.create_server((host, port), backlog=backlog)
+    # Kept open across the re-execution on SIGHUP
+    sock.set_inheritable(True)
+    return sock
+
+
+class Launcher:
+    def __init__(self, app: str, host: str, port: int, workers: int, backlog: int = 2048,
+                 graceful_timeout: int = 30, access_log: bool = True, max_failures: int = 5,
+                 backoff: float = 0.5, max_backoff: float = 30):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.backlog = backlog
+        self.graceful_timeout = graceful_timeout
+        self.access_log = access_log
+        self.max_failures = max_failures
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sock: Optional[socket.socket] = None
+        self.pids: set[int] = set()
+        # Workers whose lifespan startup finished, they write their pid to the pipe once it has
+        self.ready: set[int] = set()
+        self._ready_read: Optional[int] = None
+        self._ready_write: Optional[int] = None
+        self._ready_buffer = b""
+        self.signal: Optional[int] = None
+
+    def preload(self):
+        """Import the app before forking, see `DB_POOL_SIZE` for how the pool is split between workers"""
+        os.environ["WORKERS"] = str(self.workers)
+        module, _, attribute = self.app.partition(":")
+        app = getattr(importlib.import_module(module), attribute)
+        gc.collect()
+        gc.freeze()
+        return app
+
+    def spawn_worker(self, app) -> int:
+        pid = os.fork()
+        if pid:
+            return pid
+
+        # Worker process
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+        exit_code = 0
+        try:
+            import uvicorn
+            from uvicorn.config import LOGGING_CONFIG
+
+            from core.config import get_config
+            from db.session import async_engine
+
+            # Never share the connections opened by the master, if any
+            async_engine.sync_engine.dispose(close=False)
+            ready_write = self._ready_write
+
+            class Server(uvicorn.Server):
+                async def startup(self, sockets=None):
+                    await super().startup(sockets=sockets)
+                    if not self.should_exit:
+                        os.write(ready_write, f"{os.getpid()}\n".encode())
+
+            server = Server(uvicorn.Config(
+                app,
+                loop=event_loop_name(),
+                http=http_protocol_name(),
+                lifespan="on",
+                # Keep the logging set up by the app unless it leaves it to uvicorn
+                log_config=LOGGING_CONFIG if get_config().LOG_FORMAT == "uvicorn" else None,
+                access_log=self.access_log,
+                proxy_headers=True,
+                forwarded_allow_ips=get_config().FORWARDED_ALLOW_IPS,
+                timeout_graceful_shutdown=self.graceful_timeout,
+            ))
+            server.run(sockets=[self.sock])
+        except Exception:
+            logger.exception("Worker %s crashed", os.getpid())
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def handle_signal(self, sig, frame):
+        self.signal = sig
+
+    def stop_workers(self, pids: set[int]):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reap_workers(self) -> set[int]:
+        """Collect the exited children and return the pids of those that were serving"""
+        exited = set()
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in self.pids:
+                self.pids.discard(pid)
+                exited.add(pid)
+        return exited
+
+    def wait_for_ready(self, timeout: float) -> set[int]:
+        """Wait up to `timeout` seconds for workers to report ready, returning those that did"""
+        try:
+            readable, _, _ = select.select([self._ready_read], [], [], timeout)
+        except InterruptedError:
+            return set()
+        if not readable:
+            return set()
+        *lines, self._ready_buffer = (self._ready_buffer + os.read(self._ready_read, 4096)).split(b"\n")
+        ready = {int(line) for line in lines} & self.pids
+        self.ready |= ready
+        return ready
+
+    def reexec(self, old_workers: set[int]):
+        """Start a new master with the same socket, it retires the current workers once its own are up"""
+        logger.info("Restarting the workers with the current code and config")
+        os.environ[LISTEN_FD_ENV] = str(self.sock.fileno())
+        os.environ[OLD_WORKERS_ENV] = ",".join(map(str, self.pids | old_workers))
+        os.execv(sys.executable, [sys.executable, *sys.argv])
+
+    def run(self):
+        # Before the preload, which takes a while, so the signals received meanwhile are not lost
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self.handle_signal)
+        self.sock = _listen(self.host, self.port, self.backlog)
+        old_workers = {int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, "").split(",") if pid}
+        app = self.preload()
+        self._ready_read, self._ready_write = os.pipe()
+
+        for _ in range(self.workers):
+            self.pids.add(self.spawn_worker(app))
+        logger.info("Serving %s on %s:%s with %s workers (%s, %s)", self.app, self.host, self.port, self.workers,
+                    event_loop_name(), http_protocol_name())
+
+        exit_code = 0
+        failures = 0
+        respawns: list[float] = []
+        while True:
+            if self.wait_for_ready(0.2):
+                failures = 0
+            sig, self.signal = self.signal, None
+            if sig in (signal.SIGTERM, signal.SIGINT):
+                break
+            if sig == signal.SIGHUP:
+                self.reexec(old_workers)
+            if old_workers and len(self.ready) == self.workers:
+                # Every new worker accepts connections, the previous ones finish their requests and exit
+                self.stop_workers(old_workers)
+                old_workers = set()
+
+            for pid in self.reap_workers():
+                if pid in self.ready:
+                    self.ready.discard(pid)
+                    logger.warning("Worker %s exited, starting a new one", pid)
+                    respawns.append(time.monotonic())
+                    continue
+                failures += 1
+                if failures >= self.max_failures:
+                    logger.error("%s workers in a row exited before being ready, stopping", failures)
+                    exit_code = 1
+                    break
+                delay = min(self.backoff * 2 ** (failures - 1), self.max_backoff)
+                logger.warning("Worker %s exited before being ready, starting a new one in %.1fs", pid, delay)
+                respawns.append(time.monotonic() + delay)
+            if exit_code:
+                break
+
+            now = time.monotonic()
+            for respawn_at in [respawn_at for respawn_at in respawns if respawn_at <= now]:
+                respawns.remove(respawn_at)
+                self.pids.add(self.spawn_worker(app))
+
+        # Also the previous workers when the new ones never got ready
+        self.pids |= old_workers
+        self.stop_workers(self.pids)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.pids and time.monotonic() < deadline:
+            self.reap_workers()
+            time.sleep(0.1)
+        for pid in self.pids:
+            os.kill(pid, signal.SIGKILL)
+        if exit_code:
+            raise SystemExit(exit_code)
+
+
+def serve(app: str = "main:app", host: str = "0.0.0.0", port: int = 8000, workers: Optional[int] = None, **kwargs):
+    """Serve `app` with `workers` processes, one per core by default"""
+    workers = workers or os.cpu_count() or 1
+    if not hasattr(os, "fork"):
+        import uvicorn
+
+        from core.config import get_config
+
+        # No fork on Windows, uvicorn spawns the workers and each imports the app
+        uvicorn.run(app, host=host, port=port, workers=workers, loop=event_loop_name(), http=http_protocol_name(),
+                    proxy_headers=True, forwarded_allow_ips=get_config().FORWARDED_ALLOW_IPS)
+        return
+    Launcher(app, host, port, workers, **kwargs).run()
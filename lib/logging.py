@@ -85,35 +85,35 @@ def generate_logging_config(app: FastAPI) -> dict:
         cache_logger_on_first_use=True,
     )
 
+    # Only the selected renderer is built, the dev console renderer is not needed for json logs
+    formatter = "json" if config.LOG_FORMAT == "json" else "colored"
+    if formatter == "json":
+        renderers = [
+            structlog.processors.format_exc_info,
+            structlog.processors.JSONRenderer(),
+        ]
+    else:
+        renderers = [
+            structlog.dev.ConsoleRenderer(
+                colors=True, exception_formatter=structlog.dev.rich_traceback
+            ),
+        ]
+
     return {
         "version": 1,
         "formatters": {
-            "json": {
+            formatter: {
                 "()": structlog.stdlib.ProcessorFormatter,
-                "processors": common_formatter_processors
-                              + [
-                                  structlog.processors.format_exc_info,
-                                  structlog.processors.JSONRenderer(),
-                              ],
+                "processors": common_formatter_processors + renderers,
                 # Processors applied to non-structlog loggers
                 "foreign_pre_chain": processors,
             },
-            "colored": {
-                "()": structlog.stdlib.ProcessorFormatter,
-                "processors": common_formatter_processors
-                              + [
-                                  structlog.dev.ConsoleRenderer(
-                                      colors=True, exception_formatter=structlog.dev.rich_traceback
-                                  ),
-                              ],
-                "foreign_pre_chain": processors,
-            },
         },
         "handlers": {
             "console": {
                 "level": config.LOG_LEVEL,
                 "class": "logging.StreamHandler",
-                "formatter": "json" if config.LOG_FORMAT == "json" else "colored",
+                "formatter": formatter,
                 "stream": sys.stdout,
             }
         },
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import os
+import sys
+import tracemalloc
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Literal, Optional
+
+from prometheus_client import Gauge
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from core.config import get_config
+
+config = get_config()
+logger = logging.getLogger(__name__)
+
+GroupBy = Literal["lineno", "filename", "traceback", "route"]
+
+TRACED_MEMORY = Gauge("tracemalloc_traced_bytes", "Memory allocated by Python and still in use, while tracing.")
+TRACED_MEMORY_PEAK = Gauge("tracemalloc_peak_bytes", "Peak of the memory allocated by Python since tracing started.")
+TOP_ALLOCATION_SIZE = Gauge(
+    "tracemalloc_top_allocation_bytes",
+    "Memory in use allocated at each of the top allocation sites (file:line).",
+    ["site"],
+)
+TOP_ALLOCATION_BLOCKS = Gauge(
+    "tracemalloc_top_allocation_blocks",
+    "Memory blocks in use allocated at each of the top allocation sites (file:line).",
+    ["site"],
+)
+
+# The allocations of tracemalloc itself and of the import machinery are noise
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+# Longest first, so files are shown relative to the most specific entry of the path
+_PATH_PREFIXES = sorted({os.path.join(os.path.abspath(path), "") for path in sys.path if path}, key=len, reverse=True)
+
+
+def short_filename(filename: str) -> str:
+    """`filename` relative to the entry of sys.path it was imported from"""
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+def frame_site(frame: tracemalloc.Frame) -> str:
+    return f"{short_filename(frame.filename)}:{frame.lineno}"
+
+
+@dataclass
+class Snapshot:
+    id: int
+    taken_at: datetime
+    snapshot: tracemalloc.Snapshot
+    traced_bytes: int
+    # Requests and bytes they left allocated, per route, since tracing started
+    routes: dict[str, tuple[int, int]]
+
+
+@dataclass
+class AllocationDiff:
+    """What changed at an allocation site between two snapshots. For routes, the count is of requests."""
+    site: str
+    size_diff: int
+    size: int
+    count_diff: int
+    count: int
+    traceback: Optional[list[str]] = None
+
+
+class MemoryProfiler:
+    """
+    Memory allocations traced with tracemalloc, to attribute the growth of a worker.
+
+    Snapshots are compared per allocation site (file and line, file, or full traceback), or per route. The
+    ORM runs queries in greenlets, whose stacks do not include the endpoint, so routes are instead credited
+    with the traced memory each of their requests leaves allocated (see MemoryTracingMiddleware). Concurrent
+    requests are credited with each other's allocations, the figures per route are exact when they do not
+    overlap.
+
+    While tracing, a sampler exports the top allocation sites to Prometheus every `sample_interval`
+    seconds. Tracing slows allocations down and every snapshot holds a copy of the traces, it is meant for
+    staging or for a worker under investigation.
+    """
+
+    def __init__(self, max_snapshots: int = 5, sample_interval: float = 60.0, top_sites: int = 20):
+        self.max_snapshots = max_snapshots
+        self.sample_interval = sample_interval
+        self.top_sites = top_sites
+        self.snapshots: OrderedDict[int, Snapshot] = OrderedDict()
+        # Requests and bytes they left allocated, per route
+        self.routes: dict[str, list[int]] = {}
+        self._last_id = 0
+        self._sampler: Optional[asyncio.Task] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        """Start tracing, keeping `frames` frames of the traceback of each allocation"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self.routes.clear()
+        self.start_sampler()
+
+    def stop(self):
+        self.close()
+        tracemalloc.stop()
+        self.snapshots.clear()
+        self.routes.clear()
+        TOP_ALLOCATION_SIZE.clear()
+        TOP_ALLOCATION_BLOCKS.clear()
+
+    def record_request(self, route: str, size: int):
+        stats = self.routes.setdefault(route, [0, 0])
+        stats[0] += 1
+        stats[1] += size
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def current(self, snapshot_id: int = 0) -> Snapshot:
+        """A snapshot of now"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("Memory allocations are not traced")
+        return Snapshot(
+            id=snapshot_id,
+            taken_at=datetime.now(timezone.utc),
+            snapshot=self._take_snapshot(),
+            traced_bytes=tracemalloc.get_traced_memory()[0],
+            # Copied at once, requests are recorded meanwhile when called from a thread
+            routes={route: tuple(stats) for route, stats in list(self.routes.items())},
+        )
+
+    def take_snapshot(self) -> Snapshot:
+        """Take and keep a snapshot, dropping the oldest past `max_snapshots`"""
+        self._last_id += 1
+        snapshot = self.current(self._last_id)
+        self.snapshots[snapshot.id] = snapshot
+        while len(self.snapshots) > self.max_snapshots:
+            self.snapshots.popitem(last=False)
+        return snapshot
+
+    def diff(self, start: Snapshot, end: Snapshot, group_by: GroupBy = "lineno",
+             limit: int = 20) -> list[AllocationDiff]:
+        """The sites whose allocations grew or shrank the most from `start` to `end`"""
+        if group_by == "route":
+            diffs = []
+            for route, (requests, size) in end.routes.items():
+                start_requests, start_size = start.routes.get(route, (0, 0))
+                diffs.append(AllocationDiff(site=route, size_diff=size - start_size, size=size,
+                                            count_diff=requests - start_requests, count=requests))
+            diffs.sort(key=lambda diff: abs(diff.size_diff), reverse=True)
+            return diffs[:limit]
+
+        diffs = []
+        for stat in end.snapshot.compare_to(start.snapshot, group_by)[:limit]:
+            frame = stat.traceback[-1]
+            diffs.append(AllocationDiff(
+                site=short_filename(frame.filename) if group_by == "filename" else frame_site(frame),
+                size_diff=stat.size_diff,
+                size=stat.size,
+                count_diff=stat.count_diff,
+                count=stat.count,
+                traceback=[frame_site(frame) for frame in stat.traceback] if group_by == "traceback" else None,
+            ))
+        return diffs
+
+    def _top_sites(self) -> list[tracemalloc.Statistic]:
+        return self._take_snapshot().statistics("lineno")[:self.top_sites]
+
+    async def sample(self):
+        """Export the memory traced and the top allocation sites"""
+        current, peak = tracemalloc.get_traced_memory()
+        TRACED_MEMORY.set(current)
+        TRACED_MEMORY_PEAK.set(peak)
+        # Taking a snapshot of many traces takes a while, the event loop is left free meanwhile
+        statistics = await asyncio.to_thread(self._top_sites)
+        TOP_ALLOCATION_SIZE.clear()
+        TOP_ALLOCATION_BLOCKS.clear()
+        for stat in statistics:
+            site = frame_site(stat.traceback[-1])
+            TOP_ALLOCATION_SIZE.labels(site).set(stat.size)
+            TOP_ALLOCATION_BLOCKS.labels(site).set(stat.count)
+
+    async def _sample_periodically(self):
+        while tracemalloc.is_tracing():
+            try:
+                await self.sample()
+            except Exception:
+                logger.exception("Could not sample the memory allocations")
+            await asyncio.sleep(self.sample_interval)
+
+    def start_sampler(self):
+        """Export the top allocation sites while tracing, also when started by PYTHONTRACEMALLOC"""
+        if (self.sample_interval > 0 and tracemalloc.is_tracing()
+                and (self._sampler is None or self._sampler.done())):
+            self._sampler = asyncio.get_running_loop().create_task(self._sample_periodically())
+
+    def close(self):
+        if self._sampler is not None:
+            self._sampler.cancel()
+            self._sampler = None
+
+
+class MemoryTracingMiddleware:
+    """Credit each route with the traced memory its requests leave allocated, while tracing"""
+
+    def __init__(self, app: ASGIApp, profiler: Optional[MemoryProfiler] = None):
+        self.app = app
+        self.profiler = profiler or memory_profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not tracemalloc.is_tracing():
+            await self.app(scope, receive, send)
+            return
+
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # Tracing may have been stopped by this very request
+            if tracemalloc.is_tracing():
+                route = scope.get("route")
+                name = f"{scope['method']} {route.path}" if route is not None else "<unmatched>"
+                self.profiler.record_request(name, tracemalloc.get_traced_memory()[0] - before)
+
+
+memory_profiler = MemoryProfiler(
+    max_snapshots=config.TRACEMALLOC_MAX_SNAPSHOTS,
+    sample_interval=config.TRACEMALLOC_SAMPLE_INTERVAL,
+    top_sites=config.TRACEMALLOC_TOP_SITES,
+)
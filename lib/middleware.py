@@ -7,17 +7,14 @@ from typing import Any, Callable
 from asgi_correlation_id import CorrelationIdMiddleware
 from fastapi import Request, Response, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
-from pyinstrument import Profiler
-from pyinstrument.renderers.html import HTMLRenderer
-from pyinstrument.renderers.speedscope import SpeedscopeRenderer
-from redis import asyncio as aioredis
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.middleware.gzip import GZipMiddleware
 
 import logging
 from core.config import get_config
+from lib.admission import AdmissionControlMiddleware
+from lib.compression import CompressionMiddleware, create_encoders
+from lib.memory import MemoryTracingMiddleware
+from lib.timing import ServerTimingMiddleware
 
 config = get_config()
 
@@ -142,13 +139,18 @@ def register_profiling_middleware(app: FastAPI):
 
             Updated to store profiles in subdirectories and keep only the last 10 responses.
             """
-            profile_type_to_ext = {"html": "html", "speedscope": "speedscope.json"}
-            profile_type_to_renderer = {
-                "html": HTMLRenderer,
-                "speedscope": SpeedscopeRenderer,
-            }
-
             if request.query_params.get("profile", False):
+                # Imported on first use, pyinstrument is only needed when a profile is requested
+                from pyinstrument import Profiler
+                from pyinstrument.renderers.html import HTMLRenderer
+                from pyinstrument.renderers.speedscope import SpeedscopeRenderer
+
+                profile_type_to_ext = {"html": "html", "speedscope": "speedscope.json"}
+                profile_type_to_renderer = {
+                    "html": HTMLRenderer,
+                    "speedscope": SpeedscopeRenderer,
+                }
+
                 profile_type = request.query_params.get("profile_format", "speedscope")
                 with Profiler(interval=0.001, async_mode="enabled") as profiler:
                     response = await call_next(request)
@@ -186,14 +188,36 @@ def register_correlation_id_middleware(app: FastAPI):
     app.add_middleware(CorrelationIdMiddleware)
 
 
-def register_gzip_middleware(app: FastAPI):
-    app.add_middleware(GZipMiddleware, minimum_size=1000)
+def register_compression_middleware(app: FastAPI):
+    app.add_middleware(
+        CompressionMiddleware,
+        encoders=create_encoders(config.COMPRESSION_ENCODINGS),
+        minimum_size=config.COMPRESSION_MINIMUM_SIZE,
+        content_types=config.COMPRESSION_CONTENT_TYPES,
+        cache_max_bytes=config.COMPRESSION_CACHE_MAX_BYTES,
+        cache_paths=config.COMPRESSION_CACHE_PATHS,
+    )
+
+
+def register_server_timing_middleware(app: FastAPI):
+    if config.SERVER_TIMING_ENABLED:
+        app.add_middleware(ServerTimingMiddleware)
+
 
+def register_memory_tracing_middleware(app: FastAPI):
+    app.add_middleware(MemoryTracingMiddleware)
 
-def register_redis():
-    redis = aioredis.from_url("redis://localhost")
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
 
+def register_admission_control_middleware(app: FastAPI):
+    if config.ADMISSION_ENABLED:
+        app.add_middleware(
+            AdmissionControlMiddleware,
+            max_in_flight=config.ADMISSION_MAX_IN_FLIGHT,
+            max_lag=config.ADMISSION_MAX_EVENT_LOOP_LAG,
+            route_limits=config.ADMISSION_ROUTE_LIMITS,
+            exempt_paths=config.ADMISSION_EXEMPT_PATHS,
+            retry_after=config.ADMISSION_RETRY_AFTER,
+        )
 
 
 def register_middlewares(app: FastAPI):
@@ -201,5 +225,10 @@ def register_middlewares(app: FastAPI):
     register_correlation_id_middleware(app)
     register_request_response_logging_middleware(app)
     register_profiling_middleware(app)
-    register_gzip_middleware(app)
-    register_redis()
+    register_compression_middleware(app)
+    # Wraps the compression so it is timed too
+    register_server_timing_middleware(app)
+    # Only measures while tracing, wraps the other middlewares to include what they keep, like log buffers
+    register_memory_tracing_middleware(app)
+    # Added last so it is the outermost middleware and rejected requests cost as little as possible
+    register_admission_control_middleware(app)
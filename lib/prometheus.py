@@ -1,20 +1,26 @@
-from typing import Callable
+from typing import Callable, TYPE_CHECKING
 
-import psutil
 from fastapi import FastAPI
 from prometheus_client import Gauge
-from prometheus_fastapi_instrumentator import Instrumentator
-from prometheus_fastapi_instrumentator.metrics import Info
 
+from core.config import get_config
+
+if TYPE_CHECKING:
+    from prometheus_fastapi_instrumentator.metrics import Info
+
+config = get_config()
+
+
+def cpu_usage_metric() -> Callable[["Info"], None]:
+    import psutil
 
-def cpu_usage_metric() -> Callable[[Info], None]:
     # Define a Prometheus Gauge metric for CPU usage
     METRIC = Gauge(
         "process_cpu_usage_percent",
         "CPU usage of the process as a percentage."
     )
 
-    def instrumentation(info: Info) -> None:
+    def instrumentation(info: "Info") -> None:
         # Get the current CPU usage percentage
         cpu_usage = psutil.Process().cpu_percent(interval=None)
         # Update the Gauge with the current CPU usage
@@ -23,13 +29,15 @@ def cpu_usage_metric() -> Callable[[Info], None]:
     return instrumentation
 
 
-def memory_usage_metric() -> Callable[[Info], None]:
+def memory_usage_metric() -> Callable[["Info"], None]:
+    import psutil
+
     METRIC = Gauge(
         "process_memory_usage_bytes",
         "Memory usage of the process in bytes."
     )
 
-    def instrumentation(info: Info) -> None:
+    def instrumentation(info: "Info") -> None:
         # Get the current process memory usage (RSS)
         memory_usage = psutil.Process().memory_info().rss
         # Update the Gauge with the current memory usage
@@ -39,6 +47,11 @@ def memory_usage_metric() -> Callable[[Info], None]:
 
 
 def register_prometheus(app: FastAPI):
+    if not config.ENABLE_METRICS:
+        return
+
+    from prometheus_fastapi_instrumentator import Instrumentator
+
     instrumentator = Instrumentator(
         # should_respect_env_var=True,
         excluded_handlers=["/metrics"],
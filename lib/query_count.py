@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Savepoints stand in for transactions in the tests, they are counted as the transaction they replace
+SAVEPOINT_STATEMENTS = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+TRANSACTION_EVENTS = ("begin", "commit", "rollback", "savepoint", "release_savepoint", "rollback_savepoint")
+
+
+@dataclass
+class QueryCount:
+    """SQL statements executed, and round trips to the database including the transaction control ones"""
+    statements: list[str] = field(default_factory=list)
+    round_trips: int = 0
+
+    def __str__(self) -> str:
+        lines = "\n".join(f"  {statement}" for statement in self.statements)
+        return f"{len(self.statements)} statements, {self.round_trips} round trips\n{lines}"
+
+
+@contextmanager
+def count_queries(engine: AsyncEngine) -> Iterator[QueryCount]:
+    """
+    Count the statements and round trips made through `engine` while the block runs.
+
+    Every connection of the engine is counted, not only those of the current task. The pings of
+    `pool_pre_ping` bypass the engine events and are not counted.
+    """
+    count = QueryCount()
+    sync_engine = engine.sync_engine
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(SAVEPOINT_STATEMENTS):
+            return
+        count.statements.append(" ".join(statement.split()))
+        count.round_trips += 1
+
+    def on_transaction(conn, *args):
+        count.round_trips += 1
+
+    listeners = [("before_cursor_execute", on_execute)]
+    listeners += [(name, on_transaction) for name in TRANSACTION_EVENTS]
+    for name, listener in listeners:
+        event.listen(sync_engine, name, listener)
+    try:
+        yield count
+    finally:
+        for name, listener in listeners:
+            event.remove(sync_engine, name, listener)
+
+
+def assert_query_budget(count: QueryCount, statements: Optional[int] = None, round_trips: Optional[int] = None):
+    """Fail when more statements or round trips than budgeted were made"""
+    if statements is not None and len(count.statements) > statements:
+        raise AssertionError(f"Query budget of {statements} statements exceeded: {count}")
+    if round_trips is not None and count.round_trips > round_trips:
+        raise AssertionError(f"Query budget of {round_trips} round trips exceeded: {count}")
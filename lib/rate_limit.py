@@ -0,0 +1,121 @@
+import logging
+import math
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+
+from fastapi import FastAPI, HTTPException, Request, status
+
+from core.config import get_config
+
+config = get_config()
+logger = logging.getLogger(__name__)
+
+# Atomic sliding window log: drop hits older than the window, then either record the hit
+# or return how long until the oldest hit leaves the window
+SLIDING_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+if redis.call('ZCARD', key) >= limit then
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    return tostring(oldest[2] + window - now)
+end
+redis.call('ZADD', key, now, ARGV[4])
+redis.call('PEXPIRE', key, math.ceil(window * 1000))
+return '0'
+"""
+
+
+class RateLimiter(ABC):
+    """Sliding window rate limiter"""
+
+    @abstractmethod
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        """Record a hit for `key` and return 0 if it is allowed, otherwise the seconds until it would be"""
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Per-process limiter keeping the hit timestamps of at most `max_keys` keys"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._hits: OrderedDict[str, deque[float]] = OrderedDict()
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        now = time.monotonic()
+        hits = self._hits.get(key)
+        if hits is None:
+            hits = self._hits[key] = deque()
+            if len(self._hits) > self.max_keys:
+                self._hits.popitem(last=False)
+        else:
+            self._hits.move_to_end(key)
+
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+        if len(hits) >= limit:
+            return hits[0] + window - now
+
+        hits.append(now)
+        return 0
+
+
+class RedisRateLimiter(RateLimiter):
+    """Limiter shared by all workers, falling back to a per-process limiter when Redis is unavailable"""
+
+    def __init__(self, url: str, prefix: str = "rate-limit"):
+        from redis import asyncio as aioredis
+
+        self.redis = aioredis.from_url(url)
+        self.prefix = prefix
+        self.script = self.redis.register_script(SLIDING_WINDOW_SCRIPT)
+        self.fallback = MemoryRateLimiter()
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        try:
+            retry_after = await self.script(
+                keys=[f"{self.prefix}:{key}"], args=[time.time(), window, limit, uuid.uuid4().hex]
+            )
+        except Exception as e:
+            logger.warning("Redis rate limiter unavailable, using the in-memory limiter: %s", e)
+            return await self.fallback.hit(key, limit, window)
+        return float(retry_after)
+
+
+def create_rate_limiter() -> RateLimiter:
+    match config.RATE_LIMIT_BACKEND:
+        case "redis":
+            return RedisRateLimiter(config.REDIS_URL)
+        case _:
+            return MemoryRateLimiter()
+
+
+async def check_login_rate_limit(request: Request, username: str):
+    """
+    Reject login attempts over the per-IP or per-username limit, call it before any database or hashing work.
+    Behind a proxy the client address is the one it forwards, when listed in FORWARDED_ALLOW_IPS.
+    """
+    limiter: RateLimiter | None = getattr(request.app.state, "rate_limiter", None)
+    if limiter is None:
+        return
+
+    window = config.RATE_LIMIT_WINDOW_SECONDS
+    ip = request.client.host if request.client is not None else "unknown"
+    retry_after = await limiter.hit(f"login:ip:{ip}", config.RATE_LIMIT_LOGIN_PER_IP, window)
+    if not retry_after:
+        retry_after = await limiter.hit(f"login:username:{username.lower()}",
+                                        config.RATE_LIMIT_LOGIN_PER_USERNAME, window)
+
+    if retry_after:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail="Too many login attempts",
+                            headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+def register_rate_limiter(app: FastAPI):
+    if config.RATE_LIMIT_ENABLED:
+        app.state.rate_limiter = create_rate_limiter()
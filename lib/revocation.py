@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from core.config import get_config
+from lib.invalidation import UserChanges, user_changes
+
+config = get_config()
+logger = logging.getLogger(__name__)
+
+
+class TokenRevocations:
+    """
+    Minimum accepted token version per user.
+
+    A user's tokens are revoked by bumping `User.token_version`; tokens carrying an older `ver` claim are
+    rejected without a database lookup. When connected to Redis the versions are kept in a hash, loaded
+    on startup, and changes are broadcast to every worker over pub/sub.
+
+    Only tokens issued with STATELESS_TOKENS carry a version, nothing is kept otherwise. A version is
+    forgotten `ttl` seconds after it was set, the tokens it rejects have all expired by then.
+    """
+
+    def __init__(self, key: str = "token-versions", channel: str = "token-revocations", ttl: Optional[float] = None):
+        self.key = key
+        self.channel = channel
+        self.ttl = ttl if ttl is not None else config.ACCESS_TOKEN_EXPIRE_DAYS * 86400
+        # Minimum version per user and when it was set, the oldest first
+        self._versions: OrderedDict[int, tuple[int, float]] = OrderedDict()
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+    def is_revoked(self, user_id: int, version: int) -> bool:
+        entry = self._versions.get(user_id)
+        return entry is not None and version < entry[0]
+
+    def _set(self, user_id: int, version: int):
+        if not config.STATELESS_TOKENS:
+            return
+        now = time.monotonic()
+        entry = self._versions.get(user_id)
+        if entry is None or version > entry[0]:
+            self._versions[user_id] = (version, now)
+            self._versions.move_to_end(user_id)
+        self._prune(now)
+
+    def _prune(self, now: float):
+        while self._versions:
+            user_id, (_, set_at) = next(iter(self._versions.items()))
+            if now - set_at < self.ttl:
+                return
+            del self._versions[user_id]
+
+    async def revoke(self, user_id: int, version: int):
+        """Reject the tokens of `user_id` older than `version`, on this worker and the others"""
+        self._set(user_id, version)
+        if self._redis is None:
+            return
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.hset(self.key, str(user_id), version)
+                pipe.publish(self.channel, f"{user_id}:{version}")
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Could not broadcast token revocation of user %s: %s", user_id, e)
+
+    async def apply_user_changes(self, changes: UserChanges):
+        """Follow the token versions notified by the database, see lib.invalidation"""
+        for user_id, version in changes.token_versions.items():
+            self._set(user_id, version)
+        if changes.everything and config.STATELESS_TOKENS:
+            await self.load_versions()
+
+    async def load_versions(self):
+        """Read the versions of the users whose tokens were ever revoked from the database"""
+        from sqlalchemy import text
+
+        from db.session import async_engine
+
+        async with async_engine.connect() as connection:
+            result = await connection.execute(text('SELECT id, token_version FROM "user" WHERE token_version > 0'))
+            for user_id, version in result:
+                self._set(user_id, version)
+
+    async def connect(self, url: str):
+        """Load the known versions from Redis and follow the revocations published by other workers"""
+        from redis import asyncio as aioredis
+
+        redis = aioredis.from_url(url)
+        try:
+            versions = await redis.hgetall(self.key)
+        except Exception as e:
+            logger.warning("Token revocations are not shared between workers, Redis is unavailable: %s", e)
+            await redis.close()
+            return
+
+        for user_id, version in versions.items():
+            self._set(int(user_id), int(version))
+        self._redis = redis
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub):
+        try:
+            async for message in pubsub.listen():
+                user_id, version = message["data"].decode().split(":")
+                self._set(int(user_id), int(version))
+        except Exception as e:
+            logger.warning("Stopped following token revocations: %s", e)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+
+token_revocations = TokenRevocations()
+user_changes.subscribe(token_revocations.apply_user_changes)
@@ -0,0 +1,119 @@
+import random
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from lib.auth import hash_password
+
+FIRST_NAMES = ["adam", "amira", "ben", "chloe", "david", "elena", "farah", "george", "hana", "ivan", "jana",
+               "karim", "lina", "marco", "nour", "omar", "paula", "rami", "sara", "tom", "yara", "zaid"]
+LAST_NAMES = ["ali", "baker", "costa", "dubois", "haddad", "ibrahim", "jones", "khalil", "lopez", "mansour",
+              "nasser", "novak", "petrov", "rossi", "saleh", "schmidt", "smith", "tanaka", "wilson", "youssef"]
+UNIVERSITIES = ["Cairo University", "American University of Beirut", "University of Jordan", "Qatar University",
+                "King Saud University", "University of Tunis", "Ain Shams University", "Damascus University",
+                "Mohammed V University", "University of Baghdad", "Birzeit University", "Alexandria University"]
+SPECIALITIES = ["Computer Science", "Medicine", "Pharmacy", "Civil Engineering", "Architecture", "Economics",
+                "Law", "Mathematics", "Physics", "Biology"]
+DEPARTMENTS = ["Engineering", "Health Sciences", "Sciences", "Humanities", "Business", "Software Engineering"]
+DEGREES = ["Bachelor", "Master", "PhD"]
+ROLES = ["Student", "Teaching Assistant", "Researcher", "Lecturer"]
+# Groups with their share of the users
+GROUPS = {"case": 0.5, "control": 0.4, "pilot": 0.1}
+
+USER_COLUMNS = ["id", "username", "password", "created_at", "is_admin", "is_active", "group", "is_akg",
+                "has_password_reset", "token_version"]
+PROFILE_COLUMNS = ["created_at", "first_name", "last_name", "university", "year", "role", "speciality",
+                   "department", "degree", "user_id"]
+
+SEED_EPOCH = datetime(2024, 1, 1)
+
+
+def generate_people(count: int, seed: int = 0, profile_ratio: float = 0.9) -> Iterator[tuple]:
+    """
+    Yields `count` users as (username, created_at, group, is_active, is_akg, profile) tuples, profile being None
+    or a tuple of the profile columns from first_name to degree.
+
+    The same seed always gives the same users, whatever the batch size they are loaded with.
+    """
+    rng = random.Random(seed)
+    groups, weights = zip(*GROUPS.items())
+    for index in range(count):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        username = f"{first_name}_{last_name}_{seed}_{index}"
+        created_at = SEED_EPOCH + timedelta(seconds=rng.randrange(2 * 365 * 24 * 3600))
+        group = rng.choices(groups, weights)[0]
+        is_active = rng.random() >= 0.02
+        is_akg = rng.random() < 0.7
+        profile = None
+        if rng.random() < profile_ratio:
+            profile = (first_name.capitalize(), last_name.capitalize(), rng.choice(UNIVERSITIES),
+                       rng.randint(2018, 2026), rng.choice(ROLES), rng.choice(SPECIALITIES),
+                       rng.choice(DEPARTMENTS), rng.choice(DEGREES))
+        yield username, created_at, group, is_active, is_akg, profile
+
+
+async def _reserve_user_ids(session: AsyncSession, count: int) -> list[int]:
+    result = await session.execute(
+        text("SELECT nextval(pg_get_serial_sequence('\"user\"', 'id')) FROM generate_series(1, :count)"),
+        {"count": count})
+    return result.scalars().all()
+
+
+async def _copy_batch(session: AsyncSession, batch: list[tuple], hashed_password: str) -> int:
+    ids = await _reserve_user_ids(session, len(batch))
+    users, profiles = [], []
+    for user_id, (username, created_at, group, is_active, is_akg, profile) in zip(ids, batch):
+        users.append((user_id, username, hashed_password, created_at, False, is_active, group, is_akg, False, 0))
+        if profile is not None:
+            profiles.append((created_at, *profile, user_id))
+
+    connection = (await (await session.connection()).get_raw_connection()).driver_connection
+    await connection.copy_records_to_table("user", records=users, columns=USER_COLUMNS)
+    await connection.copy_records_to_table("profile", records=profiles, columns=PROFILE_COLUMNS)
+    await session.commit()
+    return len(profiles)
+
+
+async def seed_users(session: AsyncSession, count: int, seed: int = 0, password: str = "seed_password",
+                     profile_ratio: float = 0.9, batch_size: int = 50000,
+                     on_progress: Optional[Callable[[int, int], None]] = None) -> tuple[int, int]:
+    """
+    Create `count` synthetic users, `profile_ratio` of them with a profile, for performance testing.
+
+    The rows are generated from `seed` by `generate_people` and loaded with COPY, `batch_size` users per
+    transaction. Every user shares one password, hashed once, and the tables are analyzed at the end so the
+    planner sees the new sizes. Seeding twice with the same seed is refused, the usernames would repeat.
+
+    Returns:
+        tuple[int, int]: The number of users and of profiles created.
+    """
+    people = generate_people(count, seed, profile_ratio)
+    first = next(people, None)
+    if first is None:
+        return 0, 0
+    result = await session.execute(text('SELECT 1 FROM "user" WHERE username = :username'),
+                                   {"username": first[0]})
+    if result.first() is not None:
+        raise ValueError(f"The database was already seeded with the seed {seed}")
+
+    hashed_password = hash_password(password)
+    created, profiles, batch = 0, 0, [first]
+    for person in people:
+        if len(batch) >= batch_size:
+            profiles += await _copy_batch(session, batch, hashed_password)
+            created += len(batch)
+            batch = []
+            if on_progress:
+                on_progress(created, count)
+        batch.append(person)
+
+    profiles += await _copy_batch(session, batch, hashed_password)
+    created += len(batch)
+    if on_progress:
+        on_progress(created, count)
+
+    await session.execute(text('ANALYZE "user", profile'))
+    await session.commit()
+    return created, profiles
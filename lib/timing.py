@@ -0,0 +1,189 @@
+import functools
+import inspect
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from fastapi import FastAPI
+from fastapi.routing import APIRoute, request_response
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.config import get_config
+
+config = get_config()
+logger = logging.getLogger(__name__)
+
+STAGE_DESCRIPTIONS = {
+    "jwt": "JWT decode",
+    "db": "Database",
+    "hash": "Password hashing",
+    "endpoint": "Endpoint",
+    "serialize": "Response validation and serialization",
+    "compress": "Compression",
+}
+
+
+class RequestTimings:
+    def __init__(self):
+        # Seconds and number of times spent in each stage
+        self.stages: dict[str, list] = {}
+        self.endpoint_end: Optional[float] = None
+
+    def add(self, name: str, duration: float):
+        stage_timing = self.stages.setdefault(name, [0.0, 0])
+        stage_timing[0] += duration
+        stage_timing[1] += 1
+
+    def as_ms(self) -> dict[str, float]:
+        return {name: round(duration * 1000, 3) for name, (duration, _) in self.stages.items()}
+
+
+_timings: ContextVar[Optional[RequestTimings]] = ContextVar("server_timings", default=None)
+
+
+def record(name: str, duration: float):
+    """Add `duration` seconds to the stage `name` of the current request, if it is timed"""
+    if (timings := _timings.get()) is not None:
+        timings.add(name, duration)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the block as part of the stage `name` of the current request"""
+    if _timings.get() is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start_time)
+
+
+def server_timing_header(timings: RequestTimings, total: float) -> str:
+    metrics = []
+    for name, (duration, count) in timings.stages.items():
+        description = STAGE_DESCRIPTIONS.get(name, name)
+        if count > 1:
+            description = f"{description} ({count})"
+        metrics.append(f'{name};dur={duration * 1000:.3f};desc="{description}"')
+    metrics.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(metrics)
+
+
+class ServerTimingMiddleware:
+    """
+    Report the time spent in each stage of a request (see STAGE_DESCRIPTIONS) in a Server-Timing header,
+    shown by the browser devtools, and in a log line with the stages as fields.
+
+    The stages are timed with `stage` where the work is done. Compression is only included when this
+    middleware wraps the compression one.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        start_time = time.perf_counter()
+        status_code = None
+
+        async def send_with_timing(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing_header(timings, time.perf_counter() - start_time))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+            logger.info(json.dumps({
+                "request": {"method": scope["method"], "path": scope["path"]},
+                "response": {"status_code": status_code},
+                "server_timing": timings.as_ms() | {"total": round((time.perf_counter() - start_time) * 1000, 3)},
+            }))
+
+
+def _endpoint_done(start_time: float):
+    if (timings := _timings.get()) is not None:
+        timings.endpoint_end = time.perf_counter()
+        timings.add("endpoint", timings.endpoint_end - start_time)
+
+
+def _timed_endpoint(call):
+    """The endpoint timed as the `endpoint` stage"""
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def timed_call(**values):
+            start_time = time.perf_counter()
+            try:
+                return await call(**values)
+            finally:
+                _endpoint_done(start_time)
+    else:
+        @functools.wraps(call)
+        def timed_call(**values):
+            start_time = time.perf_counter()
+            try:
+                return call(**values)
+            finally:
+                _endpoint_done(start_time)
+    return timed_call
+
+
+def _timed_handler(handler):
+    """The route handler, timing what follows the endpoint as the `serialize` stage"""
+    @functools.wraps(handler)
+    async def timed_handler(request):
+        response = await handler(request)
+        # The return value of the endpoint was validated against the response model and rendered
+        if (timings := _timings.get()) is not None and timings.endpoint_end is not None:
+            timings.add("serialize", time.perf_counter() - timings.endpoint_end)
+        return response
+    return timed_handler
+
+
+def _instrument_routes(app: FastAPI):
+    for route in app.routes:
+        if isinstance(route, APIRoute) and not getattr(route, "timed", False):
+            route.dependant.call = _timed_endpoint(route.dependant.call)
+            route.app = request_response(_timed_handler(route.get_route_handler()))
+            route.timed = True
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.timing_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record("db", time.perf_counter() - context.timing_start)
+
+
+def _instrument_engine():
+    from sqlalchemy import event
+
+    from db.session import async_engine
+
+    if not event.contains(async_engine.sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(async_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(async_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def register_server_timing(app: FastAPI):
+    """Time the stages of every request, to call once the routes are included"""
+    if not config.SERVER_TIMING_ENABLED:
+        return
+    _instrument_routes(app)
+    _instrument_engine()
@@ -0,0 +1,156 @@
+import asyncio
+import csv
+import itertools
+import json
+from contextlib import nullcontext
+from typing import Iterable, Optional
+
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import get_config
+from lib.credentials import create_hash_pool, get_hash_pool, hash_passwords_parallel
+from schemas.user import UserImportRow, UserImportError, UserImportResponse, NewUser, PROFILE_IMPORT_FIELDS
+
+config = get_config()
+
+STAGING_COLUMNS = ["line", "username", "password", "group", "has_password_reset", *PROFILE_IMPORT_FIELDS]
+
+CREATE_STAGING_TABLE = text("""
+    CREATE TEMPORARY TABLE user_import (
+        line integer, username text, password text, "group" text, has_password_reset boolean,
+        first_name text, last_name text, university text, year integer, speciality text, department text,
+        degree text, role text
+    ) ON COMMIT DROP
+""")
+# Dropped explicitly too, a commit only releases a savepoint when the session is nested in a transaction
+DROP_STAGING_TABLE = text("DROP TABLE IF EXISTS user_import")
+
+# Usernames are unique case-insensitively (see the unique_lower_username migration), the taken ones are
+# skipped, also when a concurrent import creates them meanwhile
+MERGE_STAGING_TABLE = text("""
+    WITH inserted AS (
+        INSERT INTO "user" (username, password, created_at, is_admin, is_active, "group", is_akg,
+                            has_password_reset, token_version)
+        SELECT s.username, s.password, LOCALTIMESTAMP, false, true, s."group", false, s.has_password_reset, 0
+        FROM user_import s
+        ORDER BY s.line
+        ON CONFLICT ((lower(username))) DO NOTHING
+        RETURNING id, username
+    ), profiles AS (
+        INSERT INTO profile (created_at, first_name, last_name, university, year, role, speciality, department,
+                             degree, user_id)
+        SELECT LOCALTIMESTAMP, s.first_name, s.last_name, s.university, s.year, s.role, s.speciality,
+               s.department, s.degree, i.id
+        FROM inserted i JOIN user_import s ON s.username = i.username
+        WHERE s.first_name IS NOT NULL
+    )
+    SELECT username FROM inserted
+""")
+
+
+def _validation_message(error: ValidationError) -> str:
+    first = error.errors()[0]
+    location = ".".join(str(part) for part in first["loc"])
+    return f"{location}: {first['msg']}" if location else first["msg"]
+
+
+async def _load_batch(session: AsyncSession, batch: list[tuple[int, UserImportRow]], pool, workers: int,
+                      result: UserImportResponse):
+    from passlib.utils import generate_password
+
+    generated = {line: generate_password(12) for line, row in batch if row.password is None}
+    hashed_passwords = await hash_passwords_parallel(
+        [row.password or generated[line] for line, row in batch], pool, workers)
+
+    records = [
+        (line, row.username, hashed_password, row.group, line in generated,
+         *(getattr(row, field) for field in PROFILE_IMPORT_FIELDS))
+        for (line, row), hashed_password in zip(batch, hashed_passwords)
+    ]
+
+    await session.execute(CREATE_STAGING_TABLE)
+    connection = await (await session.connection()).get_raw_connection()
+    await connection.driver_connection.copy_records_to_table("user_import", records=records, columns=STAGING_COLUMNS)
+    inserted = set((await session.execute(MERGE_STAGING_TABLE)).scalars().all())
+    await session.execute(DROP_STAGING_TABLE)
+    await session.commit()
+
+    result.created += len(inserted)
+    for line, row in batch:
+        if row.username not in inserted:
+            result.errors.append(UserImportError(line=line, username=row.username, error="username already exists"))
+        elif line in generated:
+            result.credentials.append(NewUser(username=row.username, password=generated[line]))
+
+
+def _read_rows(reader: csv.DictReader, count: int) -> list[tuple[int, dict]]:
+    """The next `count` rows of `reader` at most, with their line number"""
+    return [(reader.line_num, values) for values in itertools.islice(reader, count)]
+
+
+async def import_users(session: AsyncSession, lines: Iterable[str], batch_size: int = 5000,
+                       workers: Optional[int] = None) -> UserImportResponse:
+    """
+    Create the users, and their profiles when given, listed in a CSV with a header row.
+
+    The CSV is read as a stream, in a thread since uploads may be spilled to disk, and loaded in batches of
+    `batch_size` rows. Each batch is hashed across `workers` new processes, or the shared hashing pool by
+    default, copied into a temporary staging table with COPY and merged into the user and profile tables
+    with set-based inserts, then committed. Users without a password get a random one that must be reset on
+    the next login, returned in the credentials and added to the users file.
+
+    Returns:
+        UserImportResponse: The number of users created, the errors of the rejected rows by line and the
+        generated credentials.
+    """
+    result = UserImportResponse(created=0, errors=[], credentials=[])
+    seen = set()
+    batch: list[tuple[int, UserImportRow]] = []
+
+    reader = csv.DictReader(lines)
+    pool_context = create_hash_pool(workers) if workers else nullcontext(get_hash_pool())
+    workers = workers or config.HASH_WORKERS
+    with pool_context as pool:
+        while rows := await asyncio.to_thread(_read_rows, reader, batch_size):
+            for line, values in rows:
+                username = (values.get("username") or "").strip() or None
+                try:
+                    # Empty cells fall back to the defaults
+                    row = UserImportRow(**{key: value.strip() for key, value in values.items()
+                                           if key and value and value.strip()})
+                except ValidationError as e:
+                    result.errors.append(UserImportError(line=line, username=username,
+                                                         error=_validation_message(e)))
+                    continue
+                if row.username.lower() in seen:
+                    result.errors.append(UserImportError(line=line, username=username, error="duplicate username"))
+                    continue
+                seen.add(row.username.lower())
+
+                batch.append((line, row))
+                if len(batch) >= batch_size:
+                    await _load_batch(session, batch, pool, workers, result)
+                    batch = []
+
+        if batch:
+            await _load_batch(session, batch, pool, workers, result)
+
+    if result.credentials:
+        _save_credentials(result.credentials)
+    return result
+
+
+def _save_credentials(credentials: list[NewUser]):
+    try:
+        with open(config.USERS_PATH, "r", encoding="utf-8") as f:
+            users = json.load(f)
+    except FileNotFoundError:
+        users = {}
+
+    for user in credentials:
+        users[user.username] = user.password
+
+    with open(config.USERS_PATH, "w", encoding="utf-8") as f:
+        json.dump(users, f, indent=4)
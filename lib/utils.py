@@ -3,20 +3,23 @@ import random
 import re
 import string
 from collections import Counter
-from typing import List
+from typing import List, Optional
 
-from passlib.utils import generate_password
-from random_username.generate import generate_username
+from sqlalchemy import exists
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import text
 from sqlmodel import select
 
 from core.config import get_config
 from lib.auth import hash_password
+from lib.revocation import token_revocations
 from models.user import User
 
 config = get_config()
 
+# Key of the Postgres advisory lock serializing first-run seeding across workers
+SEED_ADVISORY_LOCK_KEY = 0x5EED
+
 
 def generate_unique_ids(limit: int = 10, old_ids=None) -> List[str]:
     if old_ids is None:
@@ -31,52 +34,84 @@ def generate_unique_ids(limit: int = 10, old_ids=None) -> List[str]:
     return ids
 
 
-async def create_bulk_users(users: int, session: AsyncSession):
+async def load_usernames(session: AsyncSession) -> set[str]:
     result = await session.execute(select(User.username))
-    current_usernames = set(result.scalars().all())
+    return set(result.scalars().all())
+
+
+def save_credentials(users: list[dict]):
+    """Add the generated `users` credentials to the users file"""
+    try:
+        with open(config.USERS_PATH, "r", encoding="utf-8") as f:
+            old_users = json.load(f)
+    except FileNotFoundError:
+        old_users = {}
+
+    for user in users:
+        old_users[user["username"]] = user["password"]
+
+    with open(config.USERS_PATH, "w", encoding="utf-8") as f:
+        json.dump(old_users, f, indent=4)
+
+
+async def create_bulk_users(users: int, session: AsyncSession, current_usernames: Optional[set[str]] = None,
+                            save: bool = True):
+    """
+    Create `users` users with random names and passwords, hashed on the shared hashing pool.
+
+    `current_usernames`, the taken usernames, is loaded when not given and updated with the new ones.
+    The credentials are added to the users file unless `save` is False.
+    """
+    from passlib.utils import generate_password
+    from random_username.generate import generate_username
+
+    from lib.credentials import get_hash_pool, hash_passwords_parallel
+
+    if current_usernames is None:
+        current_usernames = await load_usernames(session)
 
     def new_username():
         u = generate_username(1)[0]
         return re.sub(r'(?<!^)(?=[A-Z])', '_', re.sub(r'\d+', '', u)).lower()
 
-    new_users = []
-    while len(new_users) < users:
+    usernames = []
+    while len(usernames) < users:
         username = new_username()
         while username in current_usernames:
             username = new_username()
-
-        password = generate_password(12)  # Use a more secure password length
-        hashed_password = hash_password(password)
-
-        user = User(username=username, password=hashed_password,
-                    has_password_reset=True)
-        session.add(user)
-
-        new_users.append({"username": username, "password": password})
+        usernames.append(username)
         current_usernames.add(username)
 
+    passwords = [generate_password(12) for _ in usernames]  # Use a more secure password length
+    # Argon2 is CPU bound, hashed in other processes so the event loop keeps serving requests
+    hashed_passwords = await hash_passwords_parallel(passwords, get_hash_pool(), config.HASH_WORKERS)
+
+    session.add_all(User(username=username, password=hashed_password, has_password_reset=True)
+                    for username, hashed_password in zip(usernames, hashed_passwords))
     await session.commit()
 
-    try:
-        with open(config.USERS_PATH, "r", encoding="utf-8") as f:
-            old_users = json.load(f)
-    except FileNotFoundError:
-        old_users = {}
+    new_users = [{"username": username, "password": password} for username, password in zip(usernames, passwords)]
+    if save:
+        save_credentials(new_users)
 
-    for user in new_users:
-        old_users[user["username"]] = user["password"]
+    return new_users
 
-    with open(config.USERS_PATH, "w", encoding="utf-8") as f:
-        json.dump(old_users, f, indent=4)
 
-    return new_users
+async def has_users(session: AsyncSession) -> bool:
+    result = await session.execute(select(exists().select_from(User)))
+    return bool(result.scalar())
 
 
 async def auto_generate_users(session: AsyncSession, add_test_users=False):
     users = []
 
-    result = await session.execute(select(User))
-    if len(result.scalars().all()) > 0:
+    if await has_users(session):
+        return False
+
+    # Only one worker seeds; the others wait for its commit and then see the rows
+    await session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SEED_ADVISORY_LOCK_KEY})
+    if await has_users(session):
+        await session.rollback()
         return False
 
     admin = User(username=config.ADMIN_USERNAME, password=hash_password(
@@ -135,15 +170,21 @@ async def reset_user_passwords(session: AsyncSession):
     if not users_list:
         return False
 
+    versions = []
     for user in users_list:
         if user.username == config.ADMIN_USERNAME:
             user.password = hash_password(config.ADMIN_PASSWORD)
         else:
             user.password = hash_password(user.username)
+        # The tokens issued with the old passwords stop being accepted
+        user.token_version += 1
         users.append((user.username, user.password))
+        versions.append((user.id, user.token_version))
         session.add(user)
 
     await session.commit()
+    for user_id, token_version in versions:
+        await token_revocations.revoke(user_id, token_version)
 
     with open(config.USERS_PATH, "w") as f:
         json.dump(dict(users), f, indent=4)
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+from contextlib import AsyncExitStack
+
+from fastapi import FastAPI
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi_cache import FastAPICache
+from sqlalchemy import text
+
+from core.config import get_config
+from db.session import async_engine
+from lib.auth import create_access_token, decode_access_token, hash_password, verify_and_update_password_async
+from schemas.user import UserResponse, ProfileResponse
+
+config = get_config()
+logger = logging.getLogger(__name__)
+
+
+async def warm_up_db(connections: int):
+    """Open `connections` pool connections at once so they are all established before the first request"""
+    connections = min(connections, async_engine.pool.size())
+    if connections <= 0:
+        return
+
+    async def open_connection(stack: AsyncExitStack):
+        connection = await stack.enter_async_context(async_engine.connect())
+        await connection.execute(text("SELECT 1"))
+
+    # Every connection is held until all are opened, otherwise the pool hands back the same one
+    async with AsyncExitStack() as stack:
+        results = await asyncio.gather(*(open_connection(stack) for _ in range(connections)),
+                                       return_exceptions=True)
+    if errors := [result for result in results if isinstance(result, Exception)]:
+        logger.warning("Database warm-up failed for %d of %d connections: %s", len(errors), connections, errors[0])
+
+
+async def warm_up_redis():
+    try:
+        backend = FastAPICache.get_backend()
+    except AssertionError:
+        return
+
+    if redis := getattr(backend, "redis", None):
+        try:
+            await asyncio.wait_for(redis.ping(), timeout=2)
+        except Exception as e:
+            logger.warning("Redis warm-up failed: %s", e)
+
+
+async def warm_up_auth():
+    """Initialize the Argon2 context, the hashing thread pool and the JWT code paths"""
+    hashed_password = await asyncio.to_thread(hash_password, "warm-up-password")
+    await verify_and_update_password_async("warm-up-password", hashed_password)
+    decode_access_token(create_access_token(data={"sub": "0"}))
+
+
+def warm_up_serializers(app: FastAPI):
+    """Run the response models and renderer once, and build the OpenAPI schema"""
+    user = UserResponse(
+        id=0,
+        username="warm_up",
+        profile=ProfileResponse(id=0, first_name="Warm", last_name="Up", university="Warm Up", year=2025,
+                                role="Warm Up", speciality="Warm Up", department="Warm Up", degree="Warm Up"),
+    )
+    response_class = app.router.default_response_class
+    if isinstance(response_class, DefaultPlaceholder):
+        response_class = response_class.value
+    response_class(content=[user.model_dump(mode="json")])
+    app.openapi()
+
+
+async def warm_up(app: FastAPI):
+    """Pre-open pool connections and exercise the hot paths so the first requests don't pay for them"""
+    start_time = time.perf_counter()
+    await asyncio.gather(
+        warm_up_db(config.WARMUP_DB_CONNECTIONS),
+        warm_up_redis(),
+        warm_up_auth(),
+    )
+    warm_up_serializers(app)
+    logger.info("Warm-up finished in %.4fs", time.perf_counter() - start_time)
@@ -0,0 +1,166 @@
+"""Maintenance commands, run `python manage.py --help` to list them"""
+import asyncio
+from typing import Optional
+
+import typer
+
+cli = typer.Typer(no_args_is_help=True, add_completion=False)
+
+
+@cli.callback()
+def main():
+    """Maintenance commands"""
+
+
+@cli.command()
+def calibrate_argon2(
+        target_ms: float = typer.Option(250, help="Target password verification time in milliseconds"),
+        parallelism: int = typer.Option(4, help="Argon2 lanes"),
+        max_memory_cost: int = typer.Option(262144, help="Upper bound for the memory cost in KiB"),
+):
+    """Pick Argon2 parameters for the current hardware and print them as settings for .env"""
+    from lib.auth import calibrate_argon2 as calibrate
+
+    result = calibrate(target_ms, parallelism=parallelism, max_memory_cost=max_memory_cost)
+    typer.echo(f"# Password verification takes {result.pop('verify_ms')}ms with:", err=True)
+    for key, value in result.items():
+        typer.echo(f"{key}={value}")
+
+
+@cli.command()
+def rotate_passwords(
+        batch_size: int = typer.Option(1000, help="Users hashed and committed per batch"),
+        workers: Optional[int] = typer.Option(None, help="Hashing processes, defaults to the number of cores"),
+        group: Optional[str] = typer.Option(None, help="Only rotate the users of this group"),
+        output: Optional[str] = typer.Option(None, help="JSON lines file receiving the new credentials"),
+        checkpoint: Optional[str] = typer.Option(None, help="File keeping the progress of the rotation"),
+        resume: bool = typer.Option(False, help="Continue an interrupted rotation from its checkpoint"),
+):
+    """Give every non-admin user a new random password, in resumable batches hashed on all cores"""
+    from core.config import get_config
+    from db.session import async_session_factory
+    from lib.credentials import rotate_user_passwords
+
+    config = get_config()
+
+    def on_progress(rotated: int, total: int, rate: float):
+        typer.echo(f"{rotated}/{total} users rotated ({rate:.1f} users/s)", err=True)
+
+    async def rotate():
+        async with async_session_factory() as session:
+            return await rotate_user_passwords(
+                session,
+                output_path=output or f"{config.USERS_PATH}.rotation.jsonl",
+                checkpoint_path=checkpoint or f"{config.USERS_PATH}.rotation.checkpoint",
+                batch_size=batch_size,
+                workers=workers,
+                group=group,
+                resume=resume,
+                on_progress=on_progress,
+            )
+
+    typer.echo(f"Rotated {asyncio.run(rotate())} users")
+
+
+@cli.command()
+def import_users(
+        path: str = typer.Argument(..., help="CSV with a username column and optional password, group and "
+                                             "profile columns"),
+        batch_size: int = typer.Option(5000, help="Rows hashed, copied and merged at once"),
+        workers: Optional[int] = typer.Option(None, help="Hashing processes, defaults to HASH_WORKERS"),
+):
+    """Create users and profiles from a CSV, reporting the rejected rows"""
+    from db.session import async_session_factory
+    from lib.user_import import import_users as import_csv
+
+    async def load():
+        async with async_session_factory() as session:
+            with open(path, encoding="utf-8-sig", newline="") as lines:
+                return await import_csv(session, lines, batch_size=batch_size, workers=workers)
+
+    result = asyncio.run(load())
+    for error in result.errors:
+        typer.echo(f"line {error.line}: {error.username or ''} {error.error}", err=True)
+    typer.echo(f"Created {result.created} users, {len(result.errors)} rows rejected, "
+               f"{len(result.credentials)} passwords generated")
+
+
+@cli.command()
+def seed(
+        users: int = typer.Option(100000, help="Users to create"),
+        seed: int = typer.Option(0, help="Random seed, the same seed gives the same users"),
+        password: str = typer.Option("seed_password", help="Password shared by every seeded user"),
+        profiles: float = typer.Option(0.9, help="Share of the users having a profile"),
+        batch_size: int = typer.Option(50000, help="Users copied and committed at once"),
+):
+    """Fill the database with synthetic users and profiles for performance testing"""
+    from db.session import async_session_factory
+    from lib.seed import seed_users
+
+    def on_progress(created: int, total: int):
+        typer.echo(f"{created}/{total} users created", err=True)
+
+    async def load():
+        async with async_session_factory() as session:
+            return await seed_users(session, users, seed=seed, password=password, profile_ratio=profiles,
+                                    batch_size=batch_size, on_progress=on_progress)
+
+    try:
+        created, created_profiles = asyncio.run(load())
+    except ValueError as e:
+        raise typer.BadParameter(str(e), param_hint="--seed")
+    typer.echo(f"Created {created} users and {created_profiles} profiles, all with the password {password}")
+
+
+@cli.command()
+def worker(
+        concurrency: Optional[int] = typer.Option(None, help="Jobs run at once, defaults to JOB_CONCURRENCY"),
+        burst: bool = typer.Option(False, help="Exit once the queue is empty"),
+):
+    """Run the background jobs queued by the API"""
+    import signal
+
+    from core.config import get_config
+    from lib.cache import register_cache
+    from lib.credentials import shutdown_hash_pool
+    from lib.jobs import JobWorker, create_job_backend
+
+    config = get_config()
+
+    async def run():
+        # Jobs invalidate cached responses
+        cache_backend = await register_cache()
+        backend = create_job_backend()
+        job_worker = JobWorker(backend, concurrency or config.JOB_CONCURRENCY)
+        loop = asyncio.get_running_loop()
+        # Finish the running jobs before exiting
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, job_worker.stop)
+        try:
+            await job_worker.run(burst=burst)
+        finally:
+            await backend.close()
+            await cache_backend.close()
+            shutdown_hash_pool()
+
+    typer.echo(f"Worker started with the {config.JOB_BACKEND} backend", err=True)
+    asyncio.run(run())
+
+
+@cli.command()
+def serve(
+        host: str = typer.Option("0.0.0.0", help="Address to listen on"),
+        port: int = typer.Option(8000, help="Port to listen on"),
+        workers: Optional[int] = typer.Option(None, help="Worker processes, defaults to the number of cores"),
+        graceful_timeout: int = typer.Option(30, help="Seconds given to the workers to finish their requests"),
+        access_log: bool = typer.Option(True, help="Log every request"),
+):
+    """Serve the API with preloaded workers, send SIGHUP to restart them without downtime"""
+    from lib.launcher import serve as serve_app
+
+    serve_app("main:app", host=host, port=port, workers=workers, graceful_timeout=graceful_timeout,
+              access_log=access_log)
+
+
+if __name__ == "__main__":
+    cli()
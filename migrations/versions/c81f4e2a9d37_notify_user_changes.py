@@ -0,0 +1,58 @@
+"""notify user changes
+
+Revision ID: c81f4e2a9d37
+Revises: ae400ad61a88
+Create Date: 2026-10-19 16:42:11.508214
+
+"""
+from typing import Sequence, Union
+from alembic import op
+
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c81f4e2a9d37'
+down_revision: Union[str, None] = 'ae400ad61a88'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Statement level, a bulk update sends one notification. The payload is limited to 8000 bytes, past
+# MAX_NOTIFIED_USERS changed users '*' is sent and the listeners treat every user as changed.
+MAX_NOTIFIED_USERS = 500
+
+NOTIFY_FUNCTION = """
+CREATE FUNCTION notify_{table}_changes() RETURNS trigger AS $$
+DECLARE
+    payload text;
+BEGIN
+    SELECT CASE WHEN count(*) > {max_users} THEN '*' ELSE string_agg({item}, ',') END
+    INTO payload FROM changed_rows WHERE {user_id} IS NOT NULL;
+    IF payload IS NOT NULL THEN
+        PERFORM pg_notify('user_changes', payload);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+# The token version is sent along so the listeners revoke tokens without a query
+ITEMS = {
+    "user": ("id", "id::text || ':' || token_version::text"),
+    "profile": ("user_id", "user_id::text"),
+}
+
+
+def upgrade() -> None:
+    for table, (user_id, item) in ITEMS.items():
+        op.execute(NOTIFY_FUNCTION.format(table=table, user_id=user_id, item=item, max_users=MAX_NOTIFIED_USERS))
+        for event, rows in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            op.execute(f'CREATE TRIGGER {table}_{event.lower()}_notify AFTER {event} ON "{table}" '
+                       f'REFERENCING {rows} TABLE AS changed_rows '
+                       f'FOR EACH STATEMENT EXECUTE FUNCTION notify_{table}_changes()')
+
+
+def downgrade() -> None:
+    for table in ITEMS:
+        for event in ("insert", "update", "delete"):
+            op.execute(f'DROP TRIGGER {table}_{event}_notify ON "{table}"')
+        op.execute(f'DROP FUNCTION notify_{table}_changes()')
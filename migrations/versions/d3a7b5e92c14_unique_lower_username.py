@@ -0,0 +1,28 @@
+"""unique lower username
+
+Revision ID: d3a7b5e92c14
+Revises: c81f4e2a9d37
+Create Date: 2026-10-19 18:05:27.114902
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a7b5e92c14'
+down_revision: Union[str, None] = 'c81f4e2a9d37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Usernames are compared case-insensitively, concurrent imports rely on it through ON CONFLICT. Fails while
+# usernames differing only by case exist, rename them first.
+def upgrade() -> None:
+    op.create_index('user_username_lower_key', 'user', [sa.text('lower(username)')], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('user_username_lower_key', table_name='user')
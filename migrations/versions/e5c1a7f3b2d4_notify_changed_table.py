@@ -0,0 +1,53 @@
+"""notify changed table
+
+Revision ID: e5c1a7f3b2d4
+Revises: d3a7b5e92c14
+Create Date: 2026-10-19 21:14:37.902615
+
+"""
+from typing import Sequence, Union
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5c1a7f3b2d4'
+down_revision: Union[str, None] = 'd3a7b5e92c14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MAX_NOTIFIED_USERS = 500
+
+# Same as in notify_user_changes, the payload is prefixed with '{prefix}' so the listeners know the table
+NOTIFY_FUNCTION = """
+CREATE OR REPLACE FUNCTION notify_{table}_changes() RETURNS trigger AS $$
+DECLARE
+    payload text;
+BEGIN
+    SELECT CASE WHEN count(*) > {max_users} THEN '*' ELSE string_agg({item}, ',') END
+    INTO payload FROM changed_rows WHERE {user_id} IS NOT NULL;
+    IF payload IS NOT NULL THEN
+        PERFORM pg_notify('user_changes', '{prefix}' || payload);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+ITEMS = {
+    "user": ("id", "id::text || ':' || token_version::text"),
+    "profile": ("user_id", "user_id::text"),
+}
+
+
+def _replace_functions(with_table: bool):
+    for table, (user_id, item) in ITEMS.items():
+        op.execute(NOTIFY_FUNCTION.format(table=table, user_id=user_id, item=item, max_users=MAX_NOTIFIED_USERS,
+                                          prefix=f"{table}|" if with_table else ""))
+
+
+def upgrade() -> None:
+    _replace_functions(with_table=True)
+
+
+def downgrade() -> None:
+    _replace_functions(with_table=False)
@@ -16,6 +16,8 @@ class User(BaseSQLModel, table=True):
     group: str = Field(default="case")  # control
     is_akg: bool = Field(default=False, nullable=True)
     has_password_reset: bool = Field(default=False, nullable=True)
+    # Bumped to revoke every token issued before, see lib.revocation
+    token_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
     profile: Optional["Profile"] = Relationship(back_populates="user",
                                                 sa_relationship_kwargs={'lazy': 'selectin', 'uselist': False})
 
@@ -1,10 +1,16 @@
 from fastapi import APIRouter
 
+from routes.health import router as health
+from routes.jobs import router as jobs
+from routes.memory import router as memory
 from routes.user import router as users
 
 api_router = APIRouter()
 
 routers = [
+    health,
+    jobs,
+    memory,
     users
 ]
 
@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Request, HTTPException, status
+
+router = APIRouter()
+
+
+@router.get("/health/live", tags=["Health"])
+async def live():
+    return {"status": "ok"}
+
+
+@router.get("/health/ready", tags=["Health"])
+async def ready(request: Request):
+    """Report ready only once the startup hooks, including the optional warm-up, have finished"""
+    if not getattr(request.app.state, "ready", False):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Not ready")
+    return {"status": "ok"}
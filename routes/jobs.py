@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+
+from core.config import get_config
+from lib.jobs import JobBackend
+from schemas.job import JobResponse
+from schemas.user import Principal
+from services.user import get_current_principal
+
+router = APIRouter()
+config = get_config()
+
+
+def get_job_backend(request: Request) -> JobBackend:
+    return request.app.state.job_backend
+
+
+@router.post("/jobs/bulk_users/{user_count}", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED,
+             tags=["Jobs"])
+async def enqueue_bulk_users(
+        *,
+        user_count: int,
+        backend: JobBackend = Depends(get_job_backend),
+        current_user: Principal = Depends(get_current_principal)
+):
+    """Create `user_count` users in the background, poll `/jobs/{job_id}` for the progress and credentials"""
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+
+    if user_count <= 0 or user_count > config.MAX_USERS_PER_JOB:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"User count must be between 1 and {config.MAX_USERS_PER_JOB}")
+
+    return await backend.enqueue("bulk_users", {"user_count": user_count})
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse, tags=["Jobs"])
+async def get_job(
+        *,
+        job_id: str,
+        backend: JobBackend = Depends(get_job_backend),
+        current_user: Principal = Depends(get_current_principal)
+):
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+
+    job = await backend.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
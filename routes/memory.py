@@ -0,0 +1,100 @@
+import asyncio
+import tracemalloc
+from dataclasses import asdict
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from lib.memory import GroupBy, Snapshot, memory_profiler
+from schemas.memory import MemoryDiffResponse, MemoryStatusResponse, SnapshotResponse
+from schemas.user import Principal
+from services.user import get_current_principal
+
+router = APIRouter(prefix="/debug/memory", tags=["Debug"])
+
+
+def require_admin(current_user: Principal = Depends(get_current_principal)):
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+
+
+def require_tracing():
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="Memory allocations are not traced, POST /debug/memory/start first")
+
+
+def snapshot_response(snapshot: Snapshot) -> SnapshotResponse:
+    return SnapshotResponse(id=snapshot.id, taken_at=snapshot.taken_at, traced_bytes=snapshot.traced_bytes)
+
+
+def memory_status() -> MemoryStatusResponse:
+    traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    return MemoryStatusResponse(
+        tracing=tracemalloc.is_tracing(),
+        frames=tracemalloc.get_traceback_limit(),
+        traced_bytes=traced_bytes,
+        peak_bytes=peak_bytes,
+        overhead_bytes=tracemalloc.get_tracemalloc_memory(),
+        snapshots=[snapshot_response(snapshot) for snapshot in memory_profiler.snapshots.values()],
+    )
+
+
+@router.get("", response_model=MemoryStatusResponse, dependencies=[Depends(require_admin)])
+async def get_memory_status():
+    """Tracing state of the worker serving the request, each worker is traced on its own"""
+    return memory_status()
+
+
+@router.post("/start", response_model=MemoryStatusResponse, dependencies=[Depends(require_admin)])
+async def start_tracing(frames: int = Query(1, ge=1, le=100)):
+    """
+    Trace the allocations with `frames` frames of traceback each, more frames cost more memory and time.
+    Nothing changes when already tracing.
+    """
+    memory_profiler.start(frames)
+    return memory_status()
+
+
+@router.post("/stop", response_model=MemoryStatusResponse, dependencies=[Depends(require_admin)])
+async def stop_tracing():
+    """Stop tracing and drop the snapshots"""
+    memory_profiler.stop()
+    return memory_status()
+
+
+@router.post("/snapshots", response_model=SnapshotResponse, status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(require_admin), Depends(require_tracing)])
+async def take_snapshot():
+    snapshot = await asyncio.to_thread(memory_profiler.take_snapshot)
+    return snapshot_response(snapshot)
+
+
+@router.get("/diff", response_model=MemoryDiffResponse,
+            dependencies=[Depends(require_admin), Depends(require_tracing)])
+async def diff_snapshots(
+        *,
+        start: int,
+        end: Optional[int] = None,
+        group_by: GroupBy = "lineno",
+        limit: int = Query(20, ge=1, le=1000)
+):
+    """
+    The allocation sites that grew or shrank the most from the snapshot `start` to the snapshot `end`,
+    or to now. `route` credits each route with the memory its requests left allocated.
+    """
+    snapshots = memory_profiler.snapshots
+    if start not in snapshots or (end is not None and end not in snapshots):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+
+    start_snapshot = snapshots[start]
+    end_snapshot = snapshots[end] if end is not None else await asyncio.to_thread(memory_profiler.current)
+    allocations = await asyncio.to_thread(memory_profiler.diff, start_snapshot, end_snapshot, group_by, limit)
+    return MemoryDiffResponse(
+        start=start,
+        end=end,
+        group_by=group_by,
+        traced_bytes_diff=end_snapshot.traced_bytes - start_snapshot.traced_bytes,
+        allocations=[asdict(allocation) for allocation in allocations],
+    )
@@ -1,17 +1,28 @@
 import asyncio
-from typing import List
+import csv
+import io
+from typing import List, Literal, AsyncIterator
 
-from fastapi import APIRouter
+import orjson
+
+from fastapi import APIRouter, Request, UploadFile
+from fastapi.responses import StreamingResponse
 from fastapi_cache.decorator import cache
 from sqlmodel import select
 from core.config import get_config
 from db.session import get_async_session
-from lib.auth import verify_password, create_access_token, hash_password, verify_password_async
+from lib.auth import verify_password, create_user_access_token, hash_password, verify_and_update_password_async
+from lib.rate_limit import check_login_rate_limit
+from lib.user_import import import_users
 from lib.utils import create_bulk_users
 from models.user import User, Profile
-from schemas.user import Token, ProfileResponse, ProfileUpdateRequest, UserResponse, LoginRequest, NewUser
-from services.user import get_current_user, get_all_users
+from schemas.user import Token, ProfileResponse, ProfileUpdateRequest, ProfileUpdateResponse, UserResponse, \
+    LoginRequest, NewUser, BulkBlockRequest, BulkBlockResponse, BlockResult, Principal, UserImportResponse
+from services.user import get_current_user, bulk_set_active, get_current_principal, revoke_user_tokens, \
+    stream_users_with_profiles, get_all_users_cached, invalidate_all_users, EXPORT_COLUMNS
 
+from sqlalchemy import update
+from sqlalchemy.orm import noload
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from datetime import datetime, timezone
@@ -22,20 +33,34 @@ config = get_config()
 
 
 @router.post("/login", response_model=Token)
-async def login(request: LoginRequest, session: AsyncSession = Depends(get_async_session)):
+async def login(request: LoginRequest, http_request: Request, session: AsyncSession = Depends(get_async_session)):
     username, password = request.username, request.password
-    result = await session.execute(select(User).where(User.username == username))
+    await check_login_rate_limit(http_request, username)
+
+    # The profile is not part of the token, skip its selectin load
+    result = await session.execute(select(User).where(User.username == username).options(noload(User.profile)))
     user = result.scalars().first()
-    is_valid = await verify_password_async(password, user.password) if user else False
+    # Give the connection back to the pool before the password verification and the failure delay
+    await session.close()
+    is_valid, new_hash = await verify_and_update_password_async(password, user.password) if user else (False, None)
 
     if not is_valid:
         # Add a small delay to prevent brute-force attacks
-        await asyncio.sleep(0.5)
+        await asyncio.sleep(config.LOGIN_FAILURE_DELAY)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Invalid username or password")
 
+    if new_hash:
+        # The stored hash uses outdated Argon2 parameters, upgrade it transparently
+        await session.execute(update(User).where(User.id == user.id).values(password=new_hash))
+        await session.commit()
+
+    return token_response(user)
+
+
+def token_response(user: User) -> Token:
     return Token(
-        access_token=create_access_token(data={"sub": str(user.id)}),
+        access_token=create_user_access_token(user),
         token_type="bearer",
         username=user.username,
         is_admin=user.is_admin,
@@ -46,7 +71,7 @@ async def login(request: LoginRequest, session: AsyncSession = Depends(get_async
 
 
 # Password Reset
-@router.post("/reset_password", response_model=str, tags=["User"])
+@router.post("/reset_password", response_model=Token, tags=["User"])
 async def reset_password(
         new_password: str,
         current_user: User = Depends(get_current_user),
@@ -58,21 +83,20 @@ async def reset_password(
 
     current_user.password = hash_password(new_password)
     current_user.has_password_reset = False
-    session.add(current_user)
-    await session.commit()
+    await revoke_user_tokens(session, current_user)
 
-    return {"msg": "Password reset successfully"}
+    # The token of this request was revoked along with the others
+    return token_response(current_user)
 
 
-@router.put("/profile", response_model=ProfileResponse, tags=["User"])
+@router.put("/profile", response_model=ProfileUpdateResponse, tags=["User"])
 async def update_profile(
         profile_data: ProfileUpdateRequest,
         current_user: User = Depends(get_current_user),
         session: AsyncSession = Depends(get_async_session)
 ):
-    # Fetch user profile
-    result = await session.execute(select(Profile).where(Profile.user_id == current_user.id))
-    profile = result.scalars().first()
+    # Loaded along with the user
+    profile = current_user.profile
 
     profile_data_dict = profile_data.dict(
         exclude_none=True)  # Remove None values
@@ -101,9 +125,18 @@ async def update_profile(
         profile = Profile(user_id=current_user.id, **profile_data_dict)
         session.add(profile)
 
-    await session.commit()
-    await session.refresh(profile)
-    return ProfileResponse(**profile.dict())
+    # Built before the commit expires the profile, saving a refresh
+    await session.flush()
+    response = ProfileUpdateResponse(**profile.dict())
+    if not new_password:
+        await session.commit()
+        return response
+
+    # The new password and the revocation of the tokens issued before are committed together
+    await revoke_user_tokens(session, current_user)
+    # The token of this request was revoked along with the others
+    response.access_token = create_user_access_token(current_user)
+    return response
 
 
 @router.get("/akg", response_model=ProfileResponse, tags=["User"])
@@ -122,6 +155,7 @@ async def update_akg(
     session.add(current_user)
     await session.commit()
     await session.refresh(current_user)
+    await invalidate_all_users()
 
     if not current_user.profile:
         raise HTTPException(status_code=404, detail="User profile not found")
@@ -129,18 +163,14 @@ async def update_akg(
     return ProfileResponse(**current_user.profile.model_dump(mode="json"))
 
 
-@cache(expire=60)
 @router.get("/all_users", response_model=List[UserResponse], tags=["User"])
-async def all_users(
-        session: AsyncSession = Depends(get_async_session),
-        current_user: User = Depends(get_current_user)
-):
+async def all_users(current_user: Principal = Depends(get_current_principal)):
     if not current_user.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
 
-    users = await get_all_users(session)
-    return [UserResponse(**user.model_dump(mode="json")) for user in users]
+    # Coalesced and served stale while recomputed, see lib.cache
+    return await get_all_users_cached()
 
 
 @cache(expire=60)
@@ -158,7 +188,7 @@ async def bulk_users(
         *,
         user_count: int,
         session: AsyncSession = Depends(get_async_session),
-        current_user: User = Depends(get_current_user)
+        current_user: Principal = Depends(get_current_principal)
 ):
     if not current_user.is_admin:
         raise HTTPException(
@@ -168,7 +198,9 @@ async def bulk_users(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail=f"User count must be between 1 and {config.MAX_USERS_PER_REQUEST}")
 
-    return await create_bulk_users(user_count, session)
+    new_users = await create_bulk_users(user_count, session)
+    await invalidate_all_users()
+    return new_users
 
 
 @router.post("/users/{username}/block", tags=["User"])
@@ -176,7 +208,7 @@ async def block_user(
         *,
         username: str,
         session: AsyncSession = Depends(get_async_session),
-        current_user: User = Depends(get_current_user)
+        current_user: Principal = Depends(get_current_principal)
 ):
     if not current_user.is_admin:
         raise HTTPException(
@@ -195,8 +227,93 @@ async def block_user(
                             detail="Cannot block/unblock an admin user")
 
     user.is_active = not user.is_active
-    session.add(user)
-    await session.commit()
-    await session.refresh(user)
+    await revoke_user_tokens(session, user)
 
     return {"success": True, "message": f"User {username} {'unblocked' if user.is_active else 'blocked'} successfully"}
+
+
+@router.post("/users/block", response_model=BulkBlockResponse, tags=["User"])
+async def bulk_block_users(
+        *,
+        request: BulkBlockRequest,
+        session: AsyncSession = Depends(get_async_session),
+        current_user: Principal = Depends(get_current_principal)
+):
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+
+    if not (request.usernames or request.group or request.university):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="At least one of usernames, group or university is required")
+
+    updated, admins = await bulk_set_active(session, not request.block, usernames=request.usernames,
+                                            group=request.group, university=request.university)
+
+    outcome = "blocked" if request.block else "unblocked"
+    results = [BlockResult(username=username, success=True, status=outcome) for username in updated]
+    if request.usernames:
+        seen = {username.lower() for username in updated + admins}
+        results += [BlockResult(username=username, success=False, status="admin") for username in admins]
+        results += [BlockResult(username=username, success=False, status="not_found")
+                    for username in dict.fromkeys(request.usernames) if username.lower() not in seen]
+
+    return BulkBlockResponse(updated=len(updated), results=results)
+
+
+async def _export_csv() -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(column.key for column in EXPORT_COLUMNS)
+    async for rows in stream_users_with_profiles(config.EXPORT_BATCH_SIZE):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if remaining := buffer.getvalue():
+        yield remaining
+
+
+async def _export_ndjson() -> AsyncIterator[bytes]:
+    async for rows in stream_users_with_profiles(config.EXPORT_BATCH_SIZE):
+        yield b"".join(orjson.dumps(row._asdict()) + b"\n" for row in rows)
+
+
+@router.get("/export/users", tags=["User"])
+async def export_users(
+        *,
+        format: Literal["csv", "ndjson"] = "ndjson",
+        current_user: Principal = Depends(get_current_principal)
+):
+    """Stream every user with its profile, compressed on the fly when the client accepts it.
+
+    If the client disconnects, the stream is cancelled and its database cursor closed.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+
+    content, media_type = (_export_csv(), "text/csv") if format == "csv" else (_export_ndjson(), "application/x-ndjson")
+    return StreamingResponse(content, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="users.{format}"'})
+
+
+@router.post("/import/users", response_model=UserImportResponse, tags=["User"])
+async def import_users_csv(
+        *,
+        file: UploadFile,
+        session: AsyncSession = Depends(get_async_session),
+        current_user: Principal = Depends(get_current_principal)
+):
+    """Create users, and optionally their profiles, from a CSV with a `username` column.
+
+    Rows are validated one by one, the rejected ones are reported with their line number.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+
+    lines = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    result = await import_users(session, lines, batch_size=config.IMPORT_BATCH_SIZE)
+    await invalidate_all_users()
+    return result
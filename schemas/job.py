@@ -0,0 +1,19 @@
+from datetime import datetime
+from typing import Any, Literal, Optional
+
+from pydantic import BaseModel
+
+JobStatus = Literal["queued", "running", "succeeded", "failed"]
+
+
+class JobResponse(BaseModel):
+    id: str
+    name: str
+    status: JobStatus
+    progress: int = 0
+    total: Optional[int] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
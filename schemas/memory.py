@@ -0,0 +1,40 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+from lib.memory import GroupBy
+
+
+class SnapshotResponse(BaseModel):
+    id: int
+    taken_at: datetime
+    traced_bytes: int
+
+
+class MemoryStatusResponse(BaseModel):
+    tracing: bool
+    frames: int
+    traced_bytes: int
+    peak_bytes: int
+    # Memory used by tracemalloc itself for the traces
+    overhead_bytes: int
+    snapshots: list[SnapshotResponse]
+
+
+class AllocationDiffResponse(BaseModel):
+    site: str
+    size_diff: int
+    size: int
+    count_diff: int
+    count: int
+    traceback: Optional[list[str]] = None
+
+
+class MemoryDiffResponse(BaseModel):
+    start: int
+    # None when compared to the memory at the time of the request
+    end: Optional[int] = None
+    group_by: GroupBy
+    traced_bytes_diff: int
+    allocations: list[AllocationDiffResponse]
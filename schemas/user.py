@@ -1,8 +1,8 @@
 import math
 import time
-from typing import Optional, List
+from typing import Optional, List, Literal
 
-from pydantic import Field
+from pydantic import Field, model_validator
 
 from models.user import User
 
@@ -55,6 +55,11 @@ class ProfileResponse(BaseModel):
     degree: str
 
 
+class ProfileUpdateResponse(ProfileResponse):
+    # A new token when the password changed, the ones issued before are revoked
+    access_token: Optional[str] = None
+
+
 class UserResponse(BaseModel):
     id: int
     username: str
@@ -66,6 +71,70 @@ class UserResponse(BaseModel):
     profile: Optional[ProfileResponse] = None
 
 
+class BulkBlockRequest(BaseModel):
+    usernames: Optional[List[str]] = Field(None, min_length=1)
+    group: Optional[str] = None
+    university: Optional[str] = None
+    block: bool = True
+
+
+class BlockResult(BaseModel):
+    username: str
+    success: bool
+    status: Literal["blocked", "unblocked", "admin", "not_found"]
+
+
+class BulkBlockResponse(BaseModel):
+    updated: int
+    results: List[BlockResult]
+
+
+class UserImportRow(BaseModel):
+    username: Annotated[str, StringConstraints(
+        min_length=3, max_length=50, pattern=r"^[a-zA-Z0-9_.-]+$")]
+    # As required to log in
+    password: Optional[Annotated[str, StringConstraints(min_length=8, max_length=100)]] = None
+    group: str = Field(default="case")
+    first_name: Optional[str] = Field(None, min_length=2, max_length=50)
+    last_name: Optional[str] = Field(None, min_length=2, max_length=50)
+    university: Optional[str] = Field(None, min_length=2, max_length=100)
+    year: Optional[int] = Field(None, ge=1900, le=2100)
+    speciality: Optional[str] = Field(None, min_length=2, max_length=100)
+    department: Optional[str] = Field(None, min_length=2, max_length=100)
+    degree: Optional[str] = Field(None, min_length=2, max_length=100)
+    role: Optional[str] = Field(None, min_length=2, max_length=50)
+
+    @model_validator(mode="after")
+    def check_profile_complete(self):
+        profile = [getattr(self, field) for field in PROFILE_IMPORT_FIELDS]
+        if any(value is not None for value in profile) and not all(value is not None for value in profile):
+            raise ValueError("profile fields must be all set or all empty")
+        return self
+
+
+PROFILE_IMPORT_FIELDS = ["first_name", "last_name", "university", "year", "speciality", "department", "degree", "role"]
+
+
+class UserImportError(BaseModel):
+    line: int
+    username: Optional[str] = None
+    error: str
+
+
+class UserImportResponse(BaseModel):
+    created: int
+    errors: List[UserImportError]
+    credentials: List[NewUser]
+
+
+class Principal(BaseModel):
+    """The authorization facts about the current user, available without loading the user"""
+    id: int
+    is_admin: bool = False
+    is_active: bool = True
+    has_password_reset: bool = False
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -1,17 +1,31 @@
 import json
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Sequence
 
 from core.config import get_config
-from db.session import get_async_session
+from db.session import get_async_session, async_session_factory
 from fastapi import Depends, HTTPException, status
 from lib.auth import verify_password, oauth2_scheme, decode_access_token
-from models.user import User
+from lib.cache import response_cache
+from lib.invalidation import UserChanges, user_changes
+from lib.revocation import token_revocations
+from lib.timing import stage
+from models.user import User, Profile
+from schemas.user import Principal, UserResponse
+from sqlalchemy import func, update, Row
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import noload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.future import select
 from sqlmodel import select
 
 config = get_config()
 
+EXPORT_COLUMNS = [
+    User.id, User.username, User.created_at, User.is_admin, User.is_active, User.group, User.is_akg,
+    User.has_password_reset, Profile.first_name, Profile.last_name, Profile.university, Profile.year,
+    Profile.role, Profile.speciality, Profile.department, Profile.degree,
+]
+
 
 def has_reset_password(user: User) -> bool:
     """
@@ -37,30 +51,160 @@ def has_reset_password(user: User) -> bool:
 
 
 async def get_all_users(session: AsyncSession):
-    result = await session.execute(select(User).where(User.is_admin.is_(False)))
+    # The listing has no profiles, skip their selectin load
+    result = await session.execute(select(User).where(User.is_admin.is_(False)).options(noload(User.profile)))
     return result.scalars().all()
 
-async def get_current_user(
-        token: Annotated[str, Depends(oauth2_scheme)],
-        session: Annotated[AsyncSession, Depends(get_async_session)]
-):
+
+ALL_USERS_CACHE_KEY = "all_users"
+
+
+async def load_all_users() -> list[dict]:
+    """The `/all_users` listing, in its own session since the cache may compute it after the request ended"""
+    async with async_session_factory() as session:
+        users = await get_all_users(session)
+    return [UserResponse(**user.model_dump(mode="json")).model_dump(mode="json") for user in users]
+
+
+async def get_all_users_cached() -> list[dict]:
+    return await response_cache.get_or_compute(ALL_USERS_CACHE_KEY, load_all_users, ttl=config.ALL_USERS_CACHE_TTL)
+
+
+async def invalidate_all_users():
+    """Called when users are created or their listed fields change"""
+    await response_cache.invalidate(ALL_USERS_CACHE_KEY)
+
+
+@user_changes.subscribe
+def evict_cached_user_responses(changes: UserChanges):
+    """The process making a change invalidates Redis, the others only drop their own copy"""
+    # The listing has no profiles
+    if changes.table != "profile":
+        response_cache.evict_local(ALL_USERS_CACHE_KEY)
+
+
+async def stream_users_with_profiles(batch_size: int) -> AsyncIterator[Sequence[Row]]:
+    """
+    Yields every user joined with its profile, `batch_size` rows at a time, from a server-side cursor.
+
+    The rows are never all held in memory. The session is opened here rather than taken from the request
+    since it has to live as long as the response is streamed, and it is closed if the client disconnects.
+    """
+    async with async_session_factory() as session:
+        result = await session.stream(
+            select(*EXPORT_COLUMNS)
+            .outerjoin(Profile, Profile.user_id == User.id)
+            .order_by(User.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for rows in result.partitions():
+            yield rows
+
+
+async def bulk_set_active(
+        session: AsyncSession,
+        is_active: bool,
+        usernames: list[str] | None = None,
+        group: str | None = None,
+        university: str | None = None,
+) -> tuple[list[str], list[str]]:
+    """
+    Sets `is_active` for every non-admin user matching all the given selectors.
+
+    The change is applied with a single set-based ``UPDATE ... RETURNING`` so the whole
+    cohort is updated in one round trip and one transaction, whatever its size. The tokens
+    issued to the updated users before the change are revoked.
+
+    Returns:
+        tuple: The usernames that were updated and, when `usernames` is given, the requested
+        usernames that matched an admin account and were skipped.
+    """
+    conditions = [User.is_admin.is_(False)]
+    if usernames:
+        conditions.append(func.lower(User.username).in_({username.lower() for username in usernames}))
+    if group:
+        conditions.append(User.group == group)
+    if university:
+        conditions.append(User.id.in_(select(Profile.user_id).where(Profile.university == university)))
+
+    result = await session.execute(
+        update(User)
+        .where(*conditions)
+        .values(is_active=is_active, token_version=User.token_version + 1)
+        .returning(User.id, User.username, User.token_version)
+        .execution_options(synchronize_session=False)
+    )
+    rows = result.all()
+    updated = [username for _, username, _ in rows]
+
+    admins = []
+    if usernames:
+        result = await session.execute(
+            select(User.username).where(
+                User.is_admin.is_(True),
+                func.lower(User.username).in_({username.lower() for username in usernames}))
+        )
+        admins = list(result.scalars().all())
+
+    await session.commit()
+    for user_id, _, token_version in rows:
+        await token_revocations.revoke(user_id, token_version)
+    await invalidate_all_users()
+    return updated, admins
+
+
+async def revoke_user_tokens(session: AsyncSession, user: User):
+    """
+    Commit the pending changes of the session along with a bump of the token version of `user`, in one
+    transaction, so every token issued before stops being accepted exactly when a new password or a block
+    applies. `user` is left loaded with its new version, to issue it a new token.
+    """
+    result = await session.execute(
+        update(User).where(User.id == user.id).values(token_version=User.token_version + 1)
+        .returning(User.token_version).execution_options(synchronize_session=False)
+    )
+    set_committed_value(user, "token_version", result.scalar_one())
+    await session.flush()
+    # Not expired by the commit, saving a refresh
+    session.expunge(user)
+    await session.commit()
+    await token_revocations.revoke(user.id, user.token_version)
+    await invalidate_all_users()
+
+
+def _decode_token_payload(token: str) -> dict:
     # Decode the access token
-    payload = decode_access_token(token)
+    with stage("jwt"):
+        payload = decode_access_token(token)
     if payload is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
 
-    user_id = payload.get("sub")
-
-    if not user_id:
+    if not payload.get("sub"):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token payload"
         )
 
-    result = await session.execute(select(User).filter(User.id == int(user_id)))
+    version = payload.get("ver")
+    if version is not None and token_revocations.is_revoked(int(payload["sub"]), version):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token revoked"
+        )
+
+    return payload
+
+
+async def get_current_user(
+        token: Annotated[str, Depends(oauth2_scheme)],
+        session: Annotated[AsyncSession, Depends(get_async_session)]
+):
+    payload = _decode_token_payload(token)
+
+    result = await session.execute(select(User).filter(User.id == int(payload["sub"])))
     user = result.scalars().first()
 
     if user is None:
@@ -69,4 +213,54 @@ async def get_current_user(
             detail="User not found"
         )
 
+    if payload.get("ver", user.token_version) < user.token_version:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token revoked"
+        )
+
+    if not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User is blocked"
+        )
+
     return user
+
+
+async def get_current_principal(
+        token: Annotated[str, Depends(oauth2_scheme)],
+        session: Annotated[AsyncSession, Depends(get_async_session)]
+) -> Principal:
+    """
+    Authorizes the request like `get_current_user`, for routes that only need to know who the user is.
+
+    Tokens carrying claims (see STATELESS_TOKENS) are trusted as long as their version has not been
+    revoked, so no query is made. Other tokens are checked against the database. Blocked users are rejected.
+    """
+    payload = _decode_token_payload(token)
+
+    if config.STATELESS_TOKENS and "ver" in payload:
+        principal = Principal(id=int(payload["sub"]), is_admin=payload["adm"], is_active=payload["act"],
+                              has_password_reset=payload["rst"])
+    else:
+        result = await session.execute(
+            select(User.id, User.is_admin, User.is_active, User.has_password_reset, User.token_version)
+            .where(User.id == int(payload["sub"]))
+        )
+        row = result.first()
+        if row is None or payload.get("ver", row.token_version) < row.token_version:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found" if row is None else "Token revoked"
+            )
+        principal = Principal(id=row.id, is_admin=row.is_admin, is_active=row.is_active,
+                              has_password_reset=row.has_password_reset or False)
+
+    if not principal.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User is blocked"
+        )
+
+    return principal
@@ -1,19 +1,86 @@
 import asyncio
+import os
+
+from core.config.test import TestConfig
+
+
+def use_worker_database():
+    """
+    Give each pytest-xdist worker its own database, cloned from the test database used as template.
+
+    Must run before the engine is created, the clone and the worker's own generated users file
+    are picked up through the DATABASE_URL and USERS_PATH environment variables. Serial runs use
+    the test database itself.
+    """
+    worker = os.getenv("PYTEST_XDIST_WORKER")
+    if not worker:
+        return
+
+    import asyncpg
+    from sqlalchemy.engine import make_url
+
+    test_config = TestConfig()
+    url = make_url(test_config.DATABASE_URL)
+    database = f"{url.database}_{worker}"
+
+    async def clone():
+        connection = await asyncpg.connect(user=url.username, password=url.password, host=url.host,
+                                           port=url.port or 5432, database="postgres")
+        try:
+            await connection.execute(f'DROP DATABASE IF EXISTS "{database}" WITH (FORCE)')
+            # Concurrent clones of the same template are rejected, retry until the other workers are done
+            for attempt in range(50):
+                try:
+                    await connection.execute(f'CREATE DATABASE "{database}" TEMPLATE "{url.database}"')
+                    break
+                except asyncpg.ObjectInUseError:
+                    await asyncio.sleep(0.1 * (attempt + 1))
+            else:
+                raise RuntimeError(f"Could not clone the {url.database} database for {worker}")
+        finally:
+            await connection.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(clone())
+    finally:
+        loop.close()
+    os.environ["DATABASE_URL"] = url.set(database=database).render_as_string(hide_password=False)
+    users_path, extension = os.path.splitext(test_config.USERS_PATH)
+    os.environ["USERS_PATH"] = f"{users_path}_{worker}{extension}"
+
 
-from pytest_asyncio import fixture as asyncio_fixture
-from pytest import fixture
-from sqlmodel import select
+use_worker_database()
 
-from app import create_app
-from db.session import auto_generate_users, create_async_session, async_session_factory
-from lib.auth import get_client, get_admin_client, get_user_client
-from lib.utils import clear_database
-from models import User, Profile
-from core.config import get_config
+import pytest  # noqa: E402
+from pytest_asyncio import fixture as asyncio_fixture  # noqa: E402
+from pytest import fixture  # noqa: E402
+from sqlmodel import select  # noqa: E402
+
+from app import create_app  # noqa: E402
+from db.session import auto_generate_users, create_async_session, async_session_factory, async_engine  # noqa: E402
+from lib.auth import get_client, get_admin_client, get_user_client  # noqa: E402
+from lib.query_count import count_queries, assert_query_budget  # noqa: E402
+from lib.utils import clear_database  # noqa: E402
+from models import User, Profile  # noqa: E402
+from core.config import get_config  # noqa: E402
 
 config = get_config()
 
 
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    """Count the queries of the body of tests marked `query_budget`, the fixtures are left out"""
+    marker = item.get_closest_marker("query_budget")
+    if marker is None:
+        return (yield)
+
+    with count_queries(async_engine) as queries:
+        result = yield
+    assert_query_budget(queries, *marker.args, **marker.kwargs)
+    return result
+
+
 @fixture(scope="session")
 def event_loop():
     return asyncio.get_event_loop()
@@ -51,32 +118,57 @@ async def db():
         await db_session.close()
 
 
-@asyncio_fixture(scope="session")
-async def session():
+@asyncio_fixture(autouse=True)
+async def transaction(request):
+    """
+    Run each test in a transaction rolled back at the end, so no test sees the changes of another.
+
+    Every session, those of the requests included, is bound to the test's connection and commits
+    to a savepoint. Tests marked `commits` run without it, for concurrent requests or other
+    processes, and clean up after themselves.
+    """
+    if request.node.get_closest_marker("commits"):
+        yield None
+        return
+
+    async with async_engine.connect() as connection:
+        outer_transaction = await connection.begin()
+        async_session_factory.configure(bind=connection, join_transaction_mode="create_savepoint")
+        try:
+            yield connection
+        finally:
+            async_session_factory.configure(bind=async_engine, join_transaction_mode="conditional_savepoint")
+            await outer_transaction.rollback()
+
+
+@asyncio_fixture
+async def session(transaction):
     """Creates a fresh session for each test."""
     async with async_session_factory() as db_session:
         yield db_session
 
 
-@asyncio_fixture(scope="function")
+@asyncio_fixture
 async def test_user(session):
     result = await session.execute(select(User).where(User.is_admin.is_(False)))
     return result.scalars().first()
 
 
-@asyncio_fixture(scope="session")
+@asyncio_fixture
 async def valid_users(session):
     result = await session.execute(select(User.username).where(User.is_admin.is_(False)))
     users = result.scalars().all()
     assert users, "There should be at least one valid user in the test DB"
     return users
 
-@asyncio_fixture(scope="session")
+
+@asyncio_fixture
 async def current_user(session):
     result = await session.execute(select(User).where(User.username == config.USER_USERNAME))
     return result.scalars().first()
 
-@asyncio_fixture(scope="session")
+
+@asyncio_fixture
 async def current_user_profile(session, current_user):
     """Ensures that the test user has a profile before testing."""
     if not current_user.profile:
@@ -93,10 +185,11 @@ async def current_user_profile(session, current_user):
         )
         session.add(profile)
         await session.commit()
+        await session.refresh(current_user)
     return current_user
 
 
-@asyncio_fixture(scope="session")
+@asyncio_fixture
 async def current_admin(session):
     result = await session.execute(select(User).where(User.username == config.ADMIN_USERNAME))
     return result.scalars().first()
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from lib.admission import AdmissionControlMiddleware, SHED_REQUESTS
+
+
+class SlowApp:
+    """Responds once `release` is set"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+
+    async def __call__(self, scope, receive, send):
+        await self.release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+def _client(middleware: AdmissionControlMiddleware) -> AsyncClient:
+    return AsyncClient(transport=ASGITransport(app=middleware), base_url="http://test")
+
+
+@pytest.mark.asyncio
+async def test_route_limit():
+    middleware = AdmissionControlMiddleware(SlowApp(), route_limits={"/login": 1})
+    shed = SHED_REQUESTS.labels(route="/login", reason="route_limit")
+    before = shed._value.get()
+
+    async with _client(middleware) as client:
+        busy = asyncio.create_task(client.get("/login"))
+        await asyncio.sleep(0.01)
+        response = await client.get("/login")
+        middleware.app.release.set()
+        assert (await busy).status_code == 200
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert shed._value.get() == before + 1
+    assert middleware.in_flight == 0 and middleware.route_in_flight["/login"] == 0
+
+
+@pytest.mark.asyncio
+async def test_route_limit_ignores_other_routes():
+    middleware = AdmissionControlMiddleware(SlowApp(), route_limits={"/login": 1})
+
+    async with _client(middleware) as client:
+        busy = asyncio.create_task(client.get("/login"))
+        await asyncio.sleep(0.01)
+        other = asyncio.create_task(client.get("/me"))
+        await asyncio.sleep(0.01)
+        middleware.app.release.set()
+        assert (await busy).status_code == 200
+        assert (await other).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_route_limit_under_root_path():
+    """Behind a proxy the path includes the root path the app is served under"""
+    middleware = AdmissionControlMiddleware(SlowApp(), route_limits={"/login": 1})
+    transport = ASGITransport(app=middleware, root_path="/backend")
+
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        busy = asyncio.create_task(client.get("/backend/login"))
+        await asyncio.sleep(0.01)
+        response = await client.get("/backend/login")
+        middleware.app.release.set()
+        assert (await busy).status_code == 200
+
+    assert response.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_max_in_flight():
+    middleware = AdmissionControlMiddleware(SlowApp(), max_in_flight=1, exempt_paths=("/health/",))
+
+    async with _client(middleware) as client:
+        busy = asyncio.create_task(client.get("/me"))
+        await asyncio.sleep(0.01)
+        rejected = await client.get("/all_users")
+        middleware.app.release.set()
+        # Health checks are never rejected
+        assert (await client.get("/health/live")).status_code == 200
+        assert (await busy).status_code == 200
+
+    assert rejected.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_event_loop_lag():
+    middleware = AdmissionControlMiddleware(SlowApp(), max_lag=0.5)
+    middleware.app.release.set()
+
+    async with _client(middleware) as client:
+        assert (await client.get("/me")).status_code == 200
+        middleware.lag_monitor.lag = 1
+        assert (await client.get("/me")).status_code == 503
+    middleware.lag_monitor.stop()
@@ -1,6 +1,14 @@
+import asyncio
+from datetime import timedelta
+
 import pytest
-from httpx import AsyncClient
+from passlib.hash import argon2
+from httpx import AsyncClient, ASGITransport
 from core.config import get_config
+from lib.auth import get_pwd_context, calibrate_argon2, create_user_access_token, decode_access_token, JWTAuth, \
+    create_access_token, token_cache
+from lib.rate_limit import MemoryRateLimiter
+from models import User
 
 config = get_config()
 
@@ -30,3 +38,189 @@ async def test_login_nonexistent_user(client: AsyncClient):
     assert response.status_code == 401
 
 
+@pytest.mark.asyncio
+async def test_login_rate_limited_per_username(client: AsyncClient):
+    """Login attempts over the per-username limit should be rejected with 429 and Retry-After"""
+    credentials = {"username": "rate_limited_user", "password": "wrong_password"}
+    for _ in range(config.RATE_LIMIT_LOGIN_PER_USERNAME):
+        response = await client.post("/login", json=credentials)
+        assert response.status_code == 401
+
+    response = await client.post("/login", json=credentials)
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+
+@pytest.mark.asyncio
+async def test_login_rate_limited_per_forwarded_ip(app, monkeypatch):
+    """Behind a trusted proxy the per-IP limit applies to the forwarded client address, not the proxy's"""
+    from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+    monkeypatch.setattr(config, "RATE_LIMIT_LOGIN_PER_IP", 2)
+    proxied = ProxyHeadersMiddleware(app, trusted_hosts=config.FORWARDED_ALLOW_IPS)
+    transport = ASGITransport(app=proxied, client=("127.0.0.1", 50000))
+
+    async def login(username: str, ip: str):
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/login", json={"username": username, "password": "wrong_password"},
+                                     headers={"X-Forwarded-For": ip})
+
+    assert (await login("forwarded_user_1", "203.0.113.1")).status_code == 401
+    assert (await login("forwarded_user_2", "203.0.113.1")).status_code == 401
+    assert (await login("forwarded_user_3", "203.0.113.1")).status_code == 429
+    assert (await login("forwarded_user_3", "203.0.113.2")).status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_memory_rate_limiter_sliding_window():
+    limiter = MemoryRateLimiter()
+
+    assert await limiter.hit("key", limit=2, window=0.2) == 0
+    assert await limiter.hit("key", limit=2, window=0.2) == 0
+    assert await limiter.hit("key", limit=2, window=0.2) > 0
+    assert await limiter.hit("other_key", limit=2, window=0.2) == 0
+
+    await asyncio.sleep(0.2)
+    assert await limiter.hit("key", limit=2, window=0.2) == 0
+
+
+@pytest.mark.asyncio
+async def test_login_rehashes_outdated_password_hash(client: AsyncClient, session):
+    """A hash made with other Argon2 parameters should be upgraded on the next successful login"""
+    outdated_hash = argon2.using(rounds=config.ARGON2_TIME_COST + 1, memory_cost=8192).hash("rehash_password")
+    user = User(username="rehash_user", password=outdated_hash)
+    session.add(user)
+    await session.commit()
+
+    response = await client.post("/login", json={"username": "rehash_user", "password": "rehash_password"})
+
+    assert response.status_code == 200
+    await session.refresh(user)
+    assert user.password != outdated_hash
+    assert not get_pwd_context().needs_update(user.password)
+    assert get_pwd_context().verify("rehash_password", user.password)
+
+
+def test_calibrate_argon2():
+    result = calibrate_argon2(target_ms=50, parallelism=1, max_memory_cost=16384)
+
+    assert result["ARGON2_TIME_COST"] >= 1
+    assert 8192 <= result["ARGON2_MEMORY_COST"] <= 16384
+    assert result["ARGON2_PARALLELISM"] == 1
+
+
+@pytest.fixture
+def stateless_tokens(monkeypatch):
+    monkeypatch.setattr(config, "STATELESS_TOKENS", True)
+
+
+def _token_client(app, token: str) -> AsyncClient:
+    return AsyncClient(auth=JWTAuth(token), transport=ASGITransport(app=app), base_url="http://test")
+
+
+@pytest.mark.asyncio
+async def test_stateless_token_claims(client: AsyncClient, stateless_tokens):
+    response = await client.post("/login", json={"username": config.ADMIN_USERNAME, "password": config.ADMIN_PASSWORD})
+
+    assert response.status_code == 200
+    payload = decode_access_token(response.json()["access_token"])
+    assert payload["adm"] is True
+    assert payload["act"] is True
+    assert payload["ver"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stateless_token_authorizes_without_database(app, stateless_tokens):
+    """A token with claims is trusted without looking the user up"""
+    token = create_user_access_token(User(id=999999, username="ghost", password="", is_admin=True))
+
+    response = await _token_client(app, token).get("/bulk_users/0")
+
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_block_user_revokes_tokens(app, admin_client: AsyncClient, session, stateless_tokens):
+    """Tokens issued before a user is blocked are rejected immediately, also once unblocked"""
+    user = User(username="revoked_user", password="")
+    session.add(user)
+    await session.commit()
+    await session.refresh(user)
+    client = _token_client(app, create_user_access_token(user))
+
+    assert (await client.get("/bulk_users/1")).status_code == 403
+
+    await admin_client.post(f"/users/{user.username}/block")
+    response = await client.get("/bulk_users/1")
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token revoked"
+    assert (await client.get("/me")).status_code == 401
+
+    await admin_client.post(f"/users/{user.username}/block")
+    await session.refresh(user)
+    assert (await client.get("/bulk_users/1")).status_code == 401
+    assert (await _token_client(app, create_user_access_token(user)).get("/bulk_users/1")).status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_reset_password_returns_a_new_token(app, session, stateless_tokens):
+    user = User(username="first_login_user", password="", has_password_reset=True)
+    session.add(user)
+    await session.commit()
+    await session.refresh(user)
+    old_token = create_user_access_token(user)
+
+    response = await _token_client(app, old_token).post("/reset_password", params={"new_password": "new_password"})
+
+    assert response.status_code == 200
+    assert response.json()["has_password_reset"] is False
+    assert (await _token_client(app, old_token).get("/bulk_users/1")).status_code == 401
+    new_client = _token_client(app, response.json()["access_token"])
+    assert (await new_client.get("/bulk_users/1")).status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_blocked_user_token_without_claims(app, session):
+    user = User(username="blocked_user", password="", is_active=False)
+    session.add(user)
+    await session.commit()
+    await session.refresh(user)
+
+    response = await _token_client(app, create_user_access_token(user)).get("/me")
+
+    assert response.status_code == 401
+    assert response.json()["detail"] == "User is blocked"
+
+
+def test_decode_access_token_cache(monkeypatch):
+    token = create_access_token(data={"sub": "1"})
+    token_cache.clear()
+
+    payload = decode_access_token(token)
+    payload["sub"] = "2"
+
+    assert token_cache.get(token)["sub"] == "1"
+    monkeypatch.setattr("lib.auth.decode_access_token_uncached", lambda token: None)
+    assert decode_access_token(token)["sub"] == "1"
+    assert decode_access_token(token[:-2]) is None
+
+
+@pytest.mark.asyncio
+async def test_decode_access_token_cache_honors_expiry():
+    token = create_access_token(data={"sub": "1"}, expires_delta=timedelta(seconds=1))
+    assert decode_access_token(token) is not None
+
+    await asyncio.sleep(2)
+
+    assert token_cache.get(token) is None
+    assert decode_access_token(token) is None
+
+
+def test_decode_access_token_cache_cleared_on_secret_rotation(monkeypatch):
+    token = create_access_token(data={"sub": "1"})
+    assert decode_access_token(token) is not None
+
+    monkeypatch.setattr(config, "JWT_SECRET", "rotated_secret")
+
+    assert decode_access_token(token) is None
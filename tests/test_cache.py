@@ -0,0 +1,334 @@
+import asyncio
+import time
+
+import orjson
+import pytest
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from httpx import AsyncClient
+
+from lib.cache import CoalescingCache, TieredBackend, LocalCache, CACHE_TIER_LOOKUPS
+
+
+@pytest.fixture
+def backend():
+    backend = InMemoryBackend()
+    FastAPICache.init(backend, prefix="test")
+    yield backend
+    InMemoryBackend._store.clear()
+    FastAPICache.reset()
+
+
+class SlowComputation:
+    def __init__(self, value="value", delay=0.05):
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.value
+
+
+async def store(backend, cache: CoalescingCache, key: str, value, age: float):
+    entry = orjson.dumps({"value": value, "created_at": time.time() - age, "duration": 0.01})
+    await backend.set(cache._full_key(key), entry, expire=1000)
+
+
+async def wait_for_refreshes(cache: CoalescingCache):
+    while cache._refreshes:
+        await asyncio.gather(*cache._refreshes)
+
+
+async def test_concurrent_misses_share_one_computation(backend):
+    cache = CoalescingCache()
+    compute = SlowComputation()
+
+    values = await asyncio.gather(*(cache.get_or_compute("key", compute, ttl=60) for _ in range(20)))
+
+    assert values == ["value"] * 20
+    assert compute.calls == 1
+    assert await cache.get_or_compute("key", compute, ttl=60) == "value"
+    assert compute.calls == 1
+
+
+async def test_concurrent_misses_share_one_computation_without_backend():
+    cache = CoalescingCache()
+    compute = SlowComputation()
+
+    values = await asyncio.gather(*(cache.get_or_compute("key", compute, ttl=60) for _ in range(5)))
+
+    assert values == ["value"] * 5
+    assert compute.calls == 1
+    # Nothing is kept without a backend
+    await cache.get_or_compute("key", compute, ttl=60)
+    assert compute.calls == 2
+
+
+async def test_failed_computation_is_raised_to_every_waiter(backend):
+    cache = CoalescingCache()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database down")
+
+    results = await asyncio.gather(*(cache.get_or_compute("key", fail, ttl=60) for _ in range(3)),
+                                   return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert "key" not in cache._in_flight
+
+
+async def test_stale_value_is_served_while_revalidated(backend):
+    cache = CoalescingCache(stale_ttl=300)
+    compute = SlowComputation("new")
+    await store(backend, cache, "key", "old", age=120)
+
+    values = await asyncio.gather(*(cache.get_or_compute("key", compute, ttl=60) for _ in range(10)))
+
+    assert values == ["old"] * 10
+    await wait_for_refreshes(cache)
+    assert compute.calls == 1
+    assert await cache.get_or_compute("key", compute, ttl=60) == "new"
+
+
+async def test_early_refresh_before_expiry(backend):
+    compute = SlowComputation("new")
+
+    cache = CoalescingCache(beta=0)
+    await store(backend, cache, "key", "old", age=30)
+    assert await cache.get_or_compute("key", compute, ttl=60) == "old"
+    assert not cache._refreshes
+
+    cache = CoalescingCache(beta=1e6)
+    assert await cache.get_or_compute("key", compute, ttl=60) == "old"
+    await wait_for_refreshes(cache)
+    assert compute.calls == 1
+    assert await cache.get_or_compute("key", compute, ttl=60) == "new"
+    await wait_for_refreshes(cache)
+
+
+async def test_invalidation_discards_running_computation(backend):
+    cache = CoalescingCache()
+    outdated = SlowComputation("outdated")
+
+    running = asyncio.ensure_future(cache.get_or_compute("key", outdated, ttl=60))
+    await asyncio.sleep(0.01)
+    await cache.invalidate("key")
+
+    assert await running == "outdated"
+    assert await cache.get_or_compute("key", SlowComputation("current"), ttl=60) == "current"
+    assert await cache.get_or_compute("key", SlowComputation("later"), ttl=60) == "current"
+
+
+async def test_all_users_cache_invalidated_on_block(backend, admin_client: AsyncClient, test_user):
+    response = await admin_client.get("/all_users")
+    assert response.status_code == 200
+    assert next(user for user in response.json() if user["id"] == test_user.id)["is_active"] is True
+
+    response = await admin_client.post(f"/users/{test_user.username}/block")
+    assert response.status_code == 200
+
+    response = await admin_client.get("/all_users")
+    assert next(user for user in response.json() if user["id"] == test_user.id)["is_active"] is False
+
+
+class FakeRedisServer:
+    """Keys and pub/sub channels shared by the FakeRedis clients of the tiered backend tests"""
+
+    def __init__(self):
+        self.data: dict[str, bytes] = {}
+        self.subscribers: list[asyncio.Queue] = []
+        self.reads = 0
+
+
+class FakePipeline:
+    def __init__(self, server: FakeRedisServer):
+        self.server = server
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def ttl(self, key):
+        self.commands.append(lambda: 60 if key in self.server.data else -2)
+        return self
+
+    def get(self, key):
+        def get():
+            self.server.reads += 1
+            return self.server.data.get(key)
+        self.commands.append(get)
+        return self
+
+    def set(self, key, value, ex=None):
+        self.commands.append(lambda: self.server.data.__setitem__(key, value))
+        return self
+
+    def delete(self, *keys):
+        self.commands.append(lambda: [self.server.data.pop(key, None) for key in keys])
+        return self
+
+    def publish(self, channel, message):
+        def publish():
+            for queue in self.server.subscribers:
+                queue.put_nowait({"type": "message", "data": message.encode()})
+        self.commands.append(publish)
+        return self
+
+    async def execute(self):
+        return [command() for command in self.commands]
+
+
+class FakePubSub:
+    def __init__(self, server: FakeRedisServer):
+        self.queue = asyncio.Queue()
+        server.subscribers.append(self.queue)
+
+    async def subscribe(self, channel):
+        pass
+
+    async def listen(self):
+        while True:
+            message = await self.queue.get()
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+    async def close(self):
+        pass
+
+
+class FakeRedis:
+    def __init__(self, server: FakeRedisServer):
+        self.server = server
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self.server)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self.server)
+
+    async def scan_iter(self, match):
+        for key in list(self.server.data):
+            if key.startswith(match.rstrip("*")):
+                yield key
+
+    async def close(self):
+        pass
+
+
+def connected_backend(server: FakeRedisServer, **kwargs) -> TieredBackend:
+    backend = TieredBackend(**kwargs)
+    backend.redis = FakeRedis(server)
+    backend._listener = asyncio.create_task(backend._listen(FakePubSub(server)))
+    return backend
+
+
+def lookups(tier: str, result: str) -> float:
+    return CACHE_TIER_LOOKUPS.labels(tier=tier, result=result)._value.get()
+
+
+def test_local_cache_evicts_least_recently_used_and_expired():
+    local = LocalCache(max_entries=2)
+    local.set("a", b"1", expires_at=100)
+    local.set("b", b"2", expires_at=100)
+    assert local.get("a", now=0) == (100, b"1")
+    local.set("c", b"3", expires_at=10)
+
+    assert local.get("b", now=0) is None
+    assert local.get("a", now=0) is not None
+    assert local.get("c", now=20) is None
+    assert len(local) == 1
+
+
+async def test_tiered_backend_without_redis_keeps_entries_in_process():
+    backend = TieredBackend()
+    assert not await backend.connect("redis://localhost:1", socket_timeout=0.2)
+
+    await backend.set("key", b"value", expire=60)
+    hits = lookups("l1", "hit")
+
+    assert await backend.get("key") == b"value"
+    assert lookups("l1", "hit") == hits + 1
+    assert await backend.clear(key="key") == 1
+    assert await backend.get("key") is None
+    await backend.close()
+
+
+async def test_tiered_backend_reads_through_to_redis():
+    server = FakeRedisServer()
+    writer = connected_backend(server)
+    reader = connected_backend(server)
+    l2_hits = lookups("l2", "hit")
+
+    await writer.set("key", b"value", expire=60)
+    assert await reader.get("key") == b"value"
+    assert await reader.get("key") == b"value"
+
+    # The second read is served from the reader's own tier
+    assert server.reads == 1
+    assert lookups("l2", "hit") == l2_hits + 1
+    await writer.close()
+    await reader.close()
+
+
+async def test_tiered_backend_spreads_invalidations():
+    server = FakeRedisServer()
+    first = connected_backend(server)
+    second = connected_backend(server)
+    await first.set("fastapi-cache:one", b"1", expire=60)
+    await first.set("fastapi-cache:two", b"2", expire=60)
+    assert await second.get("fastapi-cache:one") == b"1"
+    assert await second.get("fastapi-cache:two") == b"2"
+
+    await first.set("fastapi-cache:one", b"updated", expire=60)
+    await asyncio.sleep(0)
+    assert await second.get("fastapi-cache:one") == b"updated"
+
+    await first.clear(namespace="fastapi-cache")
+    await asyncio.sleep(0)
+    assert await second.get("fastapi-cache:two") is None
+    assert server.data == {}
+    await first.close()
+    await second.close()
+
+
+async def test_tiered_backend_bounds_the_in_process_lifetime():
+    server = FakeRedisServer()
+    backend = connected_backend(server, l1_ttl=0.05)
+    await backend.set("key", b"value", expire=60)
+    server.data["key"] = b"changed without a message"
+
+    assert await backend.get("key") == b"value"
+    await asyncio.sleep(0.06)
+    assert await backend.get("key") == b"changed without a message"
+    await backend.close()
+
+
+async def test_tiered_backend_resubscribes_when_the_subscription_is_lost():
+    server = FakeRedisServer()
+    first = connected_backend(server)
+    second = connected_backend(server, reconnect_delay=0.01)
+    await first.set("key", b"1", expire=60)
+    assert await second.get("key") == b"1"
+
+    # A malformed message is skipped, then the connection to Redis is lost
+    for queue in server.subscribers:
+        queue.put_nowait({"type": "message", "data": b"malformed"})
+    server.subscribers[1].put_nowait(ConnectionError("Connection reset by peer"))
+    await asyncio.sleep(0.05)
+
+    # Invalidations may have been missed, the second worker dropped its copy and follows them again
+    assert len(second.local) == 0
+    assert len(server.subscribers) == 3
+    assert await second.get("key") == b"1"
+    await first.set("key", b"2", expire=60)
+    await asyncio.sleep(0)
+    assert await second.get("key") == b"2"
+    await first.close()
+    await second.close()
@@ -0,0 +1,17 @@
+import subprocess
+import sys
+
+from core.config import get_base_dir
+
+LAZY_MODULES = ["pyinstrument", "psutil", "redis", "passlib", "argon2", "random_username"]
+
+
+def test_optional_modules_are_not_imported_on_startup():
+    """Optional subsystems should only be imported when first used."""
+    output = subprocess.run(
+        [sys.executable, "-c", f"import sys, main; print([m for m in {LAZY_MODULES!r} if m in sys.modules])"],
+        cwd=get_base_dir(), capture_output=True, text=True, check=True,
+    ).stdout
+
+    assert output.strip().splitlines()[-1] == "[]"
+
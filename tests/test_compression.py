@@ -0,0 +1,133 @@
+import gzip
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from httpx import AsyncClient, ASGITransport
+
+from lib.compression import CompressionMiddleware, GzipEncoder, create_encoders, parse_accept_encoding
+
+PAYLOAD = [{"id": i, "username": f"user_{i}", "university": "Test University"} for i in range(200)]
+
+
+class CountingGzipEncoder(GzipEncoder):
+    def __init__(self):
+        super().__init__(level=6)
+        self.calls = 0
+
+    def compress(self, body: bytes) -> bytes:
+        self.calls += 1
+        return super().compress(body)
+
+
+def create_test_app(encoders, cache_max_bytes=1024 * 1024) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, encoders=encoders, minimum_size=1000, cache_max_bytes=cache_max_bytes,
+                       cache_paths=("/large",))
+
+    @app.get("/large")
+    async def large():
+        return PAYLOAD
+
+    @app.get("/uncached")
+    async def uncached():
+        return PAYLOAD
+
+    @app.get("/tagged")
+    async def tagged(page: int = 0):
+        return JSONResponse(PAYLOAD[page:], headers={"ETag": '"v1"'})
+
+    @app.get("/small")
+    async def small():
+        return {"id": 1}
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            for item in PAYLOAD:
+                yield f"{item}\n"
+        return StreamingResponse(lines(), media_type="text/plain")
+
+    return app
+
+
+def _client(app: FastAPI) -> AsyncClient:
+    return AsyncClient(transport=ASGITransport(app=app), base_url="http://test")
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding("gzip, br;q=0.5, zstd;q=0") == {"gzip": 1.0, "br": 0.5, "zstd": 0.0}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+async def test_negotiated_encoding(encoding):
+    app = create_test_app(create_encoders(["zstd", "br", "gzip"]))
+
+    response = await _client(app).get("/large", headers={"Accept-Encoding": f"{encoding}, identity;q=0.5"})
+
+    assert response.headers["Content-Encoding"] == encoding
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.json() == PAYLOAD
+
+
+@pytest.mark.asyncio
+async def test_preferred_encoding_and_identity():
+    app = create_test_app([GzipEncoder(level=6)])
+
+    response = await _client(app).get("/large", headers={"Accept-Encoding": "br;q=1, gzip;q=0"})
+    assert "Content-Encoding" not in response.headers
+
+    response = await _client(app).get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_compressed_body_cache():
+    """A repeated payload is only compressed once"""
+    encoder = CountingGzipEncoder()
+    client = _client(create_test_app([encoder]))
+
+    for _ in range(3):
+        response = await client.get("/large", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+
+    assert encoder.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_compressed_body_cache_skips_other_paths():
+    """Bodies without an ETag outside of the cached paths are not kept"""
+    encoder = CountingGzipEncoder()
+    client = _client(create_test_app([encoder]))
+
+    for _ in range(2):
+        await client.get("/uncached", headers={"Accept-Encoding": "gzip"})
+
+    assert encoder.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_compressed_body_cache_keys_etags_by_query():
+    encoder = CountingGzipEncoder()
+    client = _client(create_test_app([encoder]))
+
+    first = await client.get("/tagged?page=0", headers={"Accept-Encoding": "gzip"})
+    second = await client.get("/tagged?page=1", headers={"Accept-Encoding": "gzip"})
+    await client.get("/tagged?page=1", headers={"Accept-Encoding": "gzip"})
+
+    assert first.json() == PAYLOAD
+    assert second.json() == PAYLOAD[1:]
+    assert encoder.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_streamed_response_compression():
+    app = create_test_app([GzipEncoder(level=6)])
+
+    async with _client(app).stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        raw = b"".join([chunk async for chunk in response.aiter_raw()])
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(raw).decode() == "".join(f"{item}\n" for item in PAYLOAD)
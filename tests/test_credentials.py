@@ -0,0 +1,68 @@
+import json
+
+import pytest
+from sqlalchemy import delete
+from sqlmodel import select
+
+from lib.auth import hash_password, verify_password
+from lib.credentials import rotate_user_passwords
+from models import User
+
+GROUP = "rotation"
+
+
+@pytest.fixture
+async def rotation_users(session):
+    users = [User(username=f"rotation_user_{i}", password=hash_password("old_password"), group=GROUP)
+             for i in range(5)]
+    session.add_all(users)
+    await session.commit()
+    result = await session.execute(select(User.id).where(User.group == GROUP).order_by(User.id))
+    yield list(result.scalars().all())
+
+    await session.execute(delete(User).where(User.group == GROUP))
+    await session.commit()
+
+
+async def _read_users(session) -> list[User]:
+    result = await session.execute(select(User).where(User.group == GROUP).order_by(User.id)
+                                   .execution_options(populate_existing=True))
+    return list(result.scalars().all())
+
+
+@pytest.mark.asyncio
+async def test_rotate_user_passwords(session, rotation_users, tmp_path):
+    output_path, checkpoint_path = str(tmp_path / "rotation.jsonl"), str(tmp_path / "rotation.checkpoint")
+    progress = []
+
+    rotated = await rotate_user_passwords(session, output_path, checkpoint_path, batch_size=2, workers=2,
+                                          group=GROUP, on_progress=lambda *args: progress.append(args))
+
+    assert rotated == 5
+    assert [rotated for rotated, _, _ in progress] == [2, 4, 5]
+    with open(checkpoint_path) as f:
+        assert json.load(f) == {"last_id": rotation_users[-1], "rotated": 5}
+
+    with open(output_path) as f:
+        credentials = {line["username"]: line["password"] for line in map(json.loads, f)}
+    for user in await _read_users(session):
+        assert user.has_password_reset is True
+        assert user.token_version == 1
+        assert verify_password(credentials[user.username], user.password)
+
+
+@pytest.mark.asyncio
+async def test_rotate_user_passwords_resume(session, rotation_users, tmp_path):
+    """An interrupted rotation continues after the last committed batch."""
+    output_path, checkpoint_path = str(tmp_path / "rotation.jsonl"), str(tmp_path / "rotation.checkpoint")
+    with open(checkpoint_path, "w") as f:
+        json.dump({"last_id": rotation_users[2], "rotated": 3}, f)
+    with open(output_path, "w"):
+        pass
+
+    rotated = await rotate_user_passwords(session, output_path, checkpoint_path, batch_size=2, workers=1,
+                                          group=GROUP, resume=True)
+
+    assert rotated == 5
+    users = await _read_users(session)
+    assert [verify_password("old_password", user.password) for user in users] == [True] * 3 + [False] * 2
@@ -0,0 +1,25 @@
+import pytest
+from sqlalchemy import func
+from sqlmodel import select
+
+from db.session import init_db, async_session_factory
+from lib.utils import auto_generate_users, has_users
+from models import User
+
+
+@pytest.mark.asyncio
+async def test_has_users(session):
+    assert await has_users(session) is True
+
+
+@pytest.mark.asyncio
+async def test_auto_generate_users_skips_seeded_database(session):
+    """Seeding must be a no-op once the user table has rows."""
+    count = (await session.execute(select(func.count()).select_from(User))).scalar()
+
+    async with async_session_factory() as db_session:
+        assert await auto_generate_users(db_session) is False
+
+    await init_db()
+
+    assert (await session.execute(select(func.count()).select_from(User))).scalar() == count
@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+from fastapi_cache import FastAPICache
+from sqlalchemy import update
+
+from core.config import get_config
+from db.session import async_session_factory
+from lib.cache import CoalescingCache, TieredBackend
+from lib.invalidation import UserChangeListener, UserChanges
+from lib.revocation import TokenRevocations
+from models import User, Profile
+
+config = get_config()
+
+
+def test_parse_user_changes():
+    changes = UserChanges.parse("3:2,5")
+    assert changes.user_ids == {3, 5}
+    assert changes.token_versions == {3: 2}
+    assert not changes.everything
+
+    assert changes.table is None
+
+    changes = UserChanges.parse("profile|5")
+    assert changes.user_ids == {5}
+    assert changes.table == "profile"
+    assert UserChanges.parse("*").everything
+    assert UserChanges.parse("user|*").everything and UserChanges.parse("user|*").table == "user"
+
+
+async def test_dispatch_runs_every_handler():
+    listener = UserChangeListener()
+    received = []
+
+    @listener.subscribe
+    def failing(changes):
+        raise RuntimeError("handler bug")
+
+    @listener.subscribe
+    def synchronous(changes):
+        received.append(("sync", changes.user_ids))
+
+    @listener.subscribe
+    async def asynchronous(changes):
+        received.append(("async", changes.user_ids))
+
+    listener.dispatch(UserChanges.parse("1"))
+    await asyncio.sleep(0)
+
+    assert received == [("sync", {1}), ("async", {1})]
+
+
+async def test_token_revocations_follow_user_changes(monkeypatch):
+    monkeypatch.setattr(config, "STATELESS_TOKENS", True)
+    revocations = TokenRevocations()
+
+    await revocations.apply_user_changes(UserChanges.parse("7:3,8"))
+
+    assert revocations.is_revoked(7, 2)
+    assert not revocations.is_revoked(7, 3)
+    assert not revocations.is_revoked(8, 0)
+
+
+async def test_token_revocations_are_bounded(monkeypatch):
+    revocations = TokenRevocations(ttl=0.05)
+    await revocations.revoke(1, 1)
+    assert len(revocations) == 0, "Nothing is kept without stateless tokens"
+
+    monkeypatch.setattr(config, "STATELESS_TOKENS", True)
+    await revocations.revoke(1, 1)
+    await asyncio.sleep(0.1)
+    await revocations.revoke(2, 1)
+
+    # The tokens revoked by the first version have expired
+    assert len(revocations) == 1
+    assert not revocations.is_revoked(1, 0)
+    assert revocations.is_revoked(2, 0)
+
+
+def _value(value):
+    async def compute():
+        return value
+    return compute
+
+
+async def test_evict_local_drops_the_in_process_copy():
+    backend = TieredBackend()
+    FastAPICache.init(backend, prefix="test")
+    try:
+        cache = CoalescingCache()
+        assert await cache.get_or_compute("key", _value("old"), ttl=60) == "old"
+        assert await cache.get_or_compute("key", _value("new"), ttl=60) == "old"
+        cache.evict_local("key")
+        assert await cache.get_or_compute("key", _value("new"), ttl=60) == "new"
+    finally:
+        FastAPICache.reset()
+
+
+def test_profile_changes_keep_the_user_listing(monkeypatch):
+    from services.user import ALL_USERS_CACHE_KEY, evict_cached_user_responses, response_cache
+
+    evicted = []
+    monkeypatch.setattr(response_cache, "evict_local", evicted.append)
+
+    evict_cached_user_responses(UserChanges.parse("profile|5"))
+    assert evicted == []
+    evict_cached_user_responses(UserChanges.parse("user|5:1"))
+    evict_cached_user_responses(UserChanges(everything=True))
+    assert evicted == [ALL_USERS_CACHE_KEY, ALL_USERS_CACHE_KEY]
+
+
+async def test_listener_retries_when_it_cannot_connect_at_startup(monkeypatch):
+    listener = UserChangeListener(reconnect_delay=0.01)
+    received: asyncio.Queue[UserChanges] = asyncio.Queue()
+    listener.subscribe(received.put_nowait)
+    attempts = []
+
+    async def listen():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise OSError("Connection refused")
+
+    monkeypatch.setattr(listener, "_listen", listen)
+    try:
+        assert not await listener.connect(config.DATABASE_URL)
+        assert (await asyncio.wait_for(received.get(), timeout=5)).everything
+        assert len(attempts) == 3
+    finally:
+        await listener.close()
+
+
+def test_listener_ignores_malformed_notifications():
+    listener = UserChangeListener()
+    received = []
+    listener.subscribe(received.append)
+
+    listener._on_notification(None, 0, listener.channel, "user|not_an_id")
+    listener._on_notification(None, 0, listener.channel, "user|3:2")
+
+    assert [changes.user_ids for changes in received] == [{3}]
+
+
+@pytest.mark.commits
+async def test_listener_receives_committed_changes(test_user):
+    listener = UserChangeListener()
+    received: asyncio.Queue[UserChanges] = asyncio.Queue()
+    listener.subscribe(received.put_nowait)
+    assert await listener.connect(config.DATABASE_URL)
+    try:
+        # Listening starts with a full resync
+        assert (await asyncio.wait_for(received.get(), timeout=5)).everything
+
+        async with async_session_factory() as session:
+            await session.execute(update(User).where(User.id == test_user.id)
+                                  .values(token_version=User.token_version + 1))
+            await session.commit()
+        changes = await asyncio.wait_for(received.get(), timeout=5)
+        assert changes.user_ids == {test_user.id}
+        assert changes.token_versions == {test_user.id: test_user.token_version + 1}
+        assert changes.table == "user"
+
+        async with async_session_factory() as session:
+            # Statements changing no row notify nothing
+            await session.execute(update(Profile).where(Profile.user_id == -1).values(year=2025))
+            await session.execute(update(User).where(User.id == test_user.id)
+                                  .values(token_version=test_user.token_version))
+            await session.commit()
+        changes = await asyncio.wait_for(received.get(), timeout=5)
+        assert changes.token_versions == {test_user.id: test_user.token_version}
+    finally:
+        await listener.close()
+
+    assert received.empty()
@@ -0,0 +1,204 @@
+import asyncio
+import json
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import delete
+
+from core.config import get_config
+from lib.jobs import JobWorker, RedisJobBackend, SQLiteJobBackend, job
+from models import User
+
+config = get_config()
+
+running_jobs = {"now": 0, "max": 0}
+
+
+@job("test_sleep")
+async def sleep_job(session, progress, seconds: float):
+    running_jobs["now"] += 1
+    running_jobs["max"] = max(running_jobs["max"], running_jobs["now"])
+    await asyncio.sleep(seconds)
+    running_jobs["now"] -= 1
+    await progress(1, 1)
+    return seconds
+
+
+@pytest.fixture
+async def job_backend(app, tmp_path):
+    backend = SQLiteJobBackend(str(tmp_path / "jobs.sqlite3"))
+    previous, app.state.job_backend = app.state.job_backend, backend
+    yield backend
+
+    app.state.job_backend = previous
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_bulk_users_job(admin_client: AsyncClient, job_backend, session):
+    """Users are created by the worker, the credentials are reported in the job result."""
+    response = await admin_client.post("/jobs/bulk_users/3")
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    assert response.json()["status"] == "queued"
+
+    await JobWorker(job_backend).run(burst=True)
+
+    response = await admin_client.get(f"/jobs/{job_id}")
+    assert response.status_code == 200
+    result = response.json()
+    assert result["status"] == "succeeded"
+    assert result["progress"] == result["total"] == 3
+    assert len(result["result"]) == 3
+    assert result["finished_at"] is not None
+    with open(config.USERS_PATH, encoding="utf-8") as f:
+        saved_users = json.load(f)
+    assert all(saved_users[user["username"]] == user["password"] for user in result["result"])
+
+    await session.execute(delete(User).where(User.username.in_([user["username"] for user in result["result"]])))
+    await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_bulk_users_job_user_forbidden(user_client: AsyncClient, job_backend):
+    response = await user_client.post("/jobs/bulk_users/3")
+
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_unknown_job(admin_client: AsyncClient, job_backend):
+    response = await admin_client.get("/jobs/unknown")
+
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_failed_job(job_backend):
+    queued = await job_backend.enqueue("missing_handler", {})
+
+    await JobWorker(job_backend).run(burst=True)
+
+    failed = await job_backend.get(queued["id"])
+    assert failed["status"] == "failed"
+    assert "missing_handler" in failed["error"]
+
+
+@pytest.mark.asyncio
+async def test_worker_concurrency(job_backend):
+    """No more than `concurrency` jobs run at once."""
+    running_jobs.update(now=0, max=0)
+    queued = [await job_backend.enqueue("test_sleep", {"seconds": 0.05}) for _ in range(5)]
+
+    await JobWorker(job_backend, concurrency=2).run(burst=True)
+
+    assert running_jobs["max"] == 2
+    for queued_job in queued:
+        assert (await job_backend.get(queued_job["id"]))["status"] == "succeeded"
+
+
+class FakeRedis:
+    """The commands of Redis used by RedisJobBackend, on in-memory data shared by the clients"""
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update({field.encode(): value.encode() for field, value in mapping.items()})
+
+    async def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    async def rpush(self, key, value):
+        self.data.setdefault(key, []).append(value.encode())
+
+    async def blmove(self, source, destination, timeout, src, dest):
+        if not self.data.get(source):
+            return None
+        value = self.data[source].pop(0)
+        self.data.setdefault(destination, []).append(value)
+        return value
+
+    async def lpop(self, key):
+        return self.data[key].pop(0) if self.data.get(key) else None
+
+    async def lrem(self, key, count, value):
+        self.data[key] = [item for item in self.data.get(key, []) if item != value.encode()]
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    async def exists(self, key):
+        return int(key in self.data)
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def expire(self, key, ttl):
+        pass
+
+    async def sadd(self, key, value):
+        self.data.setdefault(key, set()).add(value.encode())
+
+    async def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    async def srem(self, key, value):
+        self.data.get(key, set()).discard(value.encode())
+
+    async def close(self):
+        pass
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append(getattr(self.redis, name)(*args, **kwargs))
+
+    async def execute(self):
+        return [await command for command in self.commands]
+
+
+def _redis_job_backend(data: dict) -> RedisJobBackend:
+    backend = RedisJobBackend("redis://localhost")
+    backend.redis = FakeRedis(data)
+    return backend
+
+
+@pytest.mark.asyncio
+async def test_redis_jobs_of_stopped_workers_fail():
+    """A job taken by a worker that dies is failed once its lease expires, not left running"""
+    data = {}
+    crashed, finished, recovering = (_redis_job_backend(data) for _ in range(3))
+    lost = await crashed.enqueue("test_sleep", {"seconds": 0})
+    done = await finished.enqueue("test_sleep", {"seconds": 0})
+    assert (await crashed.dequeue(timeout=0))["status"] == "running"
+    await finished.dequeue(timeout=0)
+    await finished.update(done["id"], status="succeeded", finished_at=1.0)
+    assert data[finished._processing_key(finished.worker_id)] == []
+
+    # The crashed worker's lease expires, the finished one's is still valid
+    crashed._heartbeat.cancel()
+    await crashed.redis.delete(crashed._worker_key(crashed.worker_id))
+    try:
+        assert await recovering.recover() == 1
+    finally:
+        finished._heartbeat.cancel()
+
+    failed = await recovering.get(lost["id"])
+    assert failed["status"] == "failed"
+    assert failed["finished_at"] is not None
+    assert (await recovering.get(done["id"]))["status"] == "succeeded"
+    assert crashed.worker_id.encode() not in data[recovering.workers]
@@ -0,0 +1,82 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from core.config import get_base_dir
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _worker_pids(master: int) -> set[int]:
+    output = subprocess.run(["ps", "-o", "pid=", "--ppid", str(master)], capture_output=True, text=True).stdout
+    return {int(pid) for pid in output.split()}
+
+
+def _wait_for(condition, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.2)
+    raise TimeoutError
+
+
+def _is_ready(url: str) -> bool:
+    try:
+        return httpx.get(f"{url}/health/ready").status_code == 200
+    except httpx.TransportError:
+        return False
+
+
+def test_serve_restarts_workers():
+    """Dead workers are replaced and SIGHUP swaps every worker while the socket keeps serving."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    master = subprocess.Popen(
+        [sys.executable, "manage.py", "serve", "--host", "127.0.0.1", "--port", str(port), "--workers", "2",
+         "--graceful-timeout", "5", "--no-access-log"],
+        cwd=get_base_dir(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_for(lambda: _is_ready(url) and len(_worker_pids(master.pid)) == 2)
+        workers = _worker_pids(master.pid)
+
+        os.kill(next(iter(workers)), signal.SIGKILL)
+        _wait_for(lambda: len(_worker_pids(master.pid) - workers) == 1)
+
+        workers = _worker_pids(master.pid)
+        master.send_signal(signal.SIGHUP)
+        _wait_for(lambda: not _worker_pids(master.pid) & workers and len(_worker_pids(master.pid)) == 2)
+        assert httpx.get(f"{url}/health/live", timeout=10).status_code == 200
+    finally:
+        master.send_signal(signal.SIGTERM)
+        assert master.wait(timeout=15) == 0
+
+
+def test_serve_gives_up_on_failing_workers(tmp_path):
+    """Workers failing their lifespan startup are restarted with a backoff, then the launcher exits."""
+    (tmp_path / "failing_app.py").write_text(
+        "from contextlib import asynccontextmanager\n"
+        "from starlette.applications import Starlette\n\n\n"
+        "@asynccontextmanager\n"
+        "async def lifespan(app):\n"
+        "    raise RuntimeError('No database')\n"
+        "    yield\n\n\n"
+        "app = Starlette(lifespan=lifespan)\n"
+    )
+    code = (f"from lib.launcher import serve; serve('failing_app:app', host='127.0.0.1', port={_free_port()}, "
+            "workers=2, max_failures=3, backoff=0.1)")
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(tmp_path), get_base_dir()])}
+    master = subprocess.run([sys.executable, "-c", code], cwd=get_base_dir(), env=env, timeout=60,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    assert master.returncode == 1
@@ -0,0 +1,37 @@
+import pytest
+from httpx import AsyncClient
+
+from benchmarks.loadtest import Clients, compare, percentile, run_load_test
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert percentile(values, 0.50) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile(values, 0.99) == 99
+    assert percentile([7], 0.99) == 7
+
+
+@pytest.mark.commits
+@pytest.mark.asyncio
+async def test_run_load_test(client: AsyncClient, admin_client: AsyncClient, user_client: AsyncClient):
+    report = await run_load_test(Clients(client, admin_client, user_client), workload="me", concurrency=3,
+                                 requests=12)
+
+    assert report["total"]["requests"] == 12
+    me = report["endpoints"]["me"]
+    assert me["errors"] == 0
+    assert me["status_codes"] == {"200": 12}
+    assert 0 < me["p50_ms"] <= me["p95_ms"] <= me["p99_ms"]
+
+
+def test_compare():
+    baseline = {"total": {"p95_ms": 10, "throughput_rps": 100}, "endpoints": {"me": {"p95_ms": 10, "throughput_rps": 100}}}
+    report = {"total": {"p95_ms": 13, "throughput_rps": 80}, "endpoints": {"me": {"p95_ms": 11, "throughput_rps": 90}}}
+
+    changes, regressed = compare(report, baseline, threshold=0.2)
+
+    assert changes["me"] == {"throughput": -0.1, "p95": 0.1}
+    assert regressed
+    assert not compare(report, baseline, threshold=0.5)[1]
@@ -0,0 +1,123 @@
+import tracemalloc
+
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from pytest_asyncio import fixture as asyncio_fixture
+
+from lib.memory import memory_profiler
+
+leaked = []
+
+
+def leak(size: int, count: int = 1):
+    leaked.extend(bytearray(size) for _ in range(count))
+
+
+LEAK_SITE = f"test_memory.py:{leak.__code__.co_firstlineno + 1}"
+
+
+@asyncio_fixture
+async def tracing():
+    memory_profiler.start(frames=5)
+    try:
+        yield memory_profiler
+    finally:
+        memory_profiler.stop()
+
+
+async def test_memory_endpoints_need_an_admin(user_client: AsyncClient):
+    response = await user_client.post("/debug/memory/start")
+
+    assert response.status_code == 403
+    assert not tracemalloc.is_tracing()
+
+
+async def test_start_snapshot_and_stop(admin_client: AsyncClient):
+    try:
+        response = await admin_client.post("/debug/memory/start", params={"frames": 3})
+        assert response.status_code == 200
+        assert response.json()["tracing"] is True
+        assert response.json()["frames"] == 3
+
+        response = await admin_client.post("/debug/memory/snapshots")
+        assert response.status_code == 201
+        snapshot_id = response.json()["id"]
+
+        status = (await admin_client.get("/debug/memory")).json()
+        assert [snapshot["id"] for snapshot in status["snapshots"]] == [snapshot_id]
+    finally:
+        response = await admin_client.post("/debug/memory/stop")
+    assert response.json()["tracing"] is False
+    assert response.json()["snapshots"] == []
+
+
+async def test_diff_by_line(admin_client: AsyncClient, tracing):
+    start = tracing.take_snapshot()
+    leak(1000, count=1000)
+    end = tracing.take_snapshot()
+    try:
+        response = await admin_client.get("/debug/memory/diff", params={"start": start.id, "end": end.id})
+    finally:
+        leaked.clear()
+
+    assert response.status_code == 200
+    diff = response.json()
+    assert diff["traced_bytes_diff"] >= 1_000_000
+    top = diff["allocations"][0]
+    assert top["site"].endswith(LEAK_SITE)
+    assert top["size_diff"] >= 1_000_000
+    assert top["count_diff"] >= 1000
+
+
+async def test_diff_by_traceback(admin_client: AsyncClient, tracing):
+    start = tracing.take_snapshot()
+    leak(1_000_000)
+    try:
+        response = await admin_client.get("/debug/memory/diff", params={"start": start.id,
+                                                                        "group_by": "traceback", "limit": 1})
+    finally:
+        leaked.clear()
+
+    assert response.status_code == 200
+    allocation = response.json()["allocations"][0]
+    assert allocation["site"].endswith(LEAK_SITE)
+    assert allocation["traceback"][-1] == allocation["site"]
+
+
+async def test_diff_by_route(admin_client: AsyncClient, user_client: AsyncClient, tracing):
+    start = tracing.take_snapshot()
+    for _ in range(3):
+        assert (await user_client.get("/me")).status_code == 200
+
+    response = await admin_client.get("/debug/memory/diff", params={"start": start.id, "group_by": "route"})
+
+    assert response.status_code == 200
+    routes = {allocation["site"]: allocation for allocation in response.json()["allocations"]}
+    assert routes["GET /me"]["count_diff"] == 3
+    # The diff request itself is measured once it is done
+    assert "GET /debug/memory/diff" not in routes
+
+
+async def test_diff_errors(admin_client: AsyncClient):
+    response = await admin_client.get("/debug/memory/diff", params={"start": 1})
+    assert response.status_code == 409
+
+    memory_profiler.start()
+    try:
+        response = await admin_client.get("/debug/memory/diff", params={"start": 1000})
+    finally:
+        memory_profiler.stop()
+    assert response.status_code == 404
+
+
+async def test_sampler_exports_top_allocation_sites(tracing):
+    leak(2_000_000)
+    try:
+        await tracing.sample()
+    finally:
+        leaked.clear()
+
+    assert REGISTRY.get_sample_value("tracemalloc_traced_bytes") >= 2_000_000
+    sites = [sample.labels["site"] for metric in REGISTRY.collect()
+             if metric.name == "tracemalloc_top_allocation_bytes" for sample in metric.samples]
+    assert any(site.endswith(LEAK_SITE) for site in sites)
@@ -0,0 +1,16 @@
+from benchmarks.micro import check, run
+
+
+def test_run_suites():
+    results = run(["jwt", "serialization", "logging", "logging_middleware"], scale=0.01)
+
+    assert {"jwt_decode_cached", "user_response_build", "log_record_format",
+            "request_with_logging_middleware"} <= results.keys()
+    assert all(value > 0 for value in results.values())
+
+
+def test_check():
+    baselines = {"jwt_create": 10.0, "hash_password": 1000.0}
+
+    assert check({"jwt_create": 11.9, "hash_password": 900.0, "new": 5.0}, baselines) == {}
+    assert check({"jwt_create": 12.5, "hash_password": 1000.0}, baselines) == {"jwt_create": 0.25}
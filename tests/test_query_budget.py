@@ -0,0 +1,58 @@
+import pytest
+from httpx import AsyncClient
+
+from core.config import get_config
+from db.session import async_engine
+from lib.query_count import count_queries, assert_query_budget
+
+config = get_config()
+
+PROFILE = {
+    "first_name": "Budget",
+    "last_name": "Test",
+    "university": "Budget University",
+    "year": 2025,
+    "speciality": "Computer Science",
+    "department": "Performance",
+    "degree": "Bachelor",
+    "role": "Student",
+}
+
+
+@pytest.mark.query_budget(statements=2, round_trips=4)
+async def test_me_query_budget(user_client: AsyncClient):
+    response = await user_client.get("/me")
+    assert response.status_code == 200
+
+
+# The listing is loaded in its own session, the cache may compute it after the request ended
+@pytest.mark.query_budget(statements=2, round_trips=6)
+async def test_all_users_query_budget(admin_client: AsyncClient):
+    response = await admin_client.get("/all_users")
+    assert response.status_code == 200
+
+
+@pytest.mark.query_budget(statements=1, round_trips=3)
+async def test_login_query_budget(client: AsyncClient):
+    response = await client.post("/login", json={"username": config.USER_USERNAME,
+                                                 "password": config.USER_PASSWORD})
+    assert response.status_code == 200
+
+
+@pytest.mark.query_budget(statements=3, round_trips=5)
+async def test_update_profile_query_budget(user_client: AsyncClient, current_user_profile):
+    response = await user_client.put("/profile", json=PROFILE)
+    assert response.status_code == 200
+
+
+async def test_query_budget_exceeded(user_client: AsyncClient):
+    with count_queries(async_engine) as queries:
+        response = await user_client.get("/me")
+
+    assert response.status_code == 200
+    assert len(queries.statements) == 2
+    assert_query_budget(queries, statements=2)
+    with pytest.raises(AssertionError, match="Query budget of 1 statements exceeded"):
+        assert_query_budget(queries, statements=1)
+    with pytest.raises(AssertionError, match="round trips exceeded"):
+        assert_query_budget(queries, round_trips=1)
@@ -0,0 +1,45 @@
+import pytest
+from sqlalchemy import func
+from sqlmodel import select
+
+from lib.auth import verify_password
+from lib.seed import generate_people, seed_users
+from models import User, Profile
+
+
+def test_generate_people_is_deterministic():
+    assert list(generate_people(50, seed=7)) == list(generate_people(50, seed=7))
+    assert list(generate_people(50, seed=7)) != list(generate_people(50, seed=8))
+    assert list(generate_people(10, seed=7)) == list(generate_people(50, seed=7))[:10]
+
+
+def test_generate_people_profile_ratio():
+    people = list(generate_people(1000, seed=1, profile_ratio=0.5))
+    with_profile = sum(profile is not None for *_, profile in people)
+    assert 400 < with_profile < 600
+    assert len({username for username, *_ in people}) == 1000
+
+
+async def test_seed_users(session):
+    users_before = (await session.execute(select(func.count()).select_from(User))).scalar_one()
+
+    created, profiles = await seed_users(session, 120, seed=3, password="seeded", batch_size=50)
+
+    assert created == 120
+    assert profiles == sum(profile is not None for *_, profile in generate_people(120, seed=3))
+    assert (await session.execute(select(func.count()).select_from(User))).scalar_one() == users_before + 120
+
+    username = next(generate_people(1, seed=3))[0]
+    user = (await session.execute(select(User).where(User.username == username))).scalars().one()
+    assert verify_password("seeded", user.password)
+    assert not user.is_admin
+    seeded_profiles = await session.execute(
+        select(func.count()).select_from(Profile).join(User).where(User.username.like("%\\_3\\_%")))
+    assert seeded_profiles.scalar_one() == profiles
+
+
+async def test_seed_users_twice_with_the_same_seed(session):
+    await seed_users(session, 5, seed=4, batch_size=5)
+
+    with pytest.raises(ValueError, match="already seeded"):
+        await seed_users(session, 5, seed=4)
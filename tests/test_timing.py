@@ -0,0 +1,63 @@
+import pytest
+from httpx import AsyncClient
+
+from app import create_app
+from core.config import get_config
+from lib.auth import get_client, get_user_client
+from lib.timing import RequestTimings, server_timing_header
+
+config = get_config()
+
+
+@pytest.fixture(scope="module")
+def timed_app():
+    config.SERVER_TIMING_ENABLED = True
+    try:
+        return create_app()
+    finally:
+        config.SERVER_TIMING_ENABLED = False
+
+
+def _stages(response) -> dict[str, float]:
+    stages = {}
+    for metric in response.headers["Server-Timing"].split(", "):
+        name, duration, *_ = metric.split(";")
+        stages[name] = float(duration.removeprefix("dur="))
+    return stages
+
+
+def test_server_timing_header():
+    timings = RequestTimings()
+    timings.add("db", 0.002)
+    timings.add("db", 0.001)
+    timings.add("custom", 0.0005)
+
+    assert server_timing_header(timings, 0.01) == (
+        'db;dur=3.000;desc="Database (2)", custom;dur=0.500;desc="custom", total;dur=10.000'
+    )
+
+
+async def test_me_stages(timed_app):
+    client: AsyncClient = await get_user_client(timed_app)
+    response = await client.get("/me")
+
+    assert response.status_code == 200
+    stages = _stages(response)
+    assert {"jwt", "db", "endpoint", "serialize", "total"} <= stages.keys()
+    # The queries are made from the endpoint and its dependencies, within the request
+    assert stages["db"] <= stages["total"]
+
+
+async def test_login_stages(timed_app):
+    client: AsyncClient = await get_client(timed_app)
+    response = await client.post("/login", json={"username": config.USER_USERNAME,
+                                                 "password": config.USER_PASSWORD})
+
+    assert response.status_code == 200
+    assert {"hash", "db", "endpoint"} <= _stages(response).keys()
+
+
+async def test_disabled_by_default(user_client: AsyncClient):
+    response = await user_client.get("/me")
+
+    assert "Server-Timing" not in response.headers
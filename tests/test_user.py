@@ -1,6 +1,11 @@
+import csv
+import io
+import json
+
 import pytest
 from httpx import AsyncClient
 from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
@@ -124,6 +129,7 @@ async def test_update_profile_has_password_reset(user_client: AsyncClient, sessi
 async def test_acknowledge_instructions(user_client: AsyncClient, session, current_user_profile):
     """User should be able to acknowledge instructions (set is_akg = True)."""
 
+    first_name = current_user_profile.profile.first_name
     current_user_profile.is_akg = False
     await session.commit()
 
@@ -131,7 +137,7 @@ async def test_acknowledge_instructions(user_client: AsyncClient, session, curre
 
     assert response.status_code == 200
     data = response.json()
-    assert data["first_name"] == "John"
+    assert data["first_name"] == first_name
 
     await session.refresh(current_user_profile)
     assert current_user_profile.is_akg is True
@@ -141,6 +147,7 @@ async def test_acknowledge_instructions(user_client: AsyncClient, session, curre
 async def test_acknowledge_instructions_idempotent(user_client: AsyncClient, session, current_user_profile):
     """If `is_akg` is already True, API should return the existing profile without updating."""
 
+    first_name = current_user_profile.profile.first_name
     current_user_profile.is_akg = True
     await session.commit()
 
@@ -148,7 +155,7 @@ async def test_acknowledge_instructions_idempotent(user_client: AsyncClient, ses
 
     assert response.status_code == 200
     data = response.json()
-    assert data["first_name"] == "John"
+    assert data["first_name"] == first_name
 
     await session.refresh(current_user_profile)
     assert current_user_profile.is_akg is True
@@ -321,3 +328,151 @@ async def test_block_user_unauthorized(user_client: AsyncClient, test_user):
 
     assert response.status_code == 403
     assert response.json()["detail"] == "Not authorized"
+
+
+@pytest.mark.asyncio
+async def test_bulk_block_users(admin_client: AsyncClient, session, test_user):
+    """Admin should be able to block several users at once, with per-user outcomes."""
+
+    response = await admin_client.post("/users/block", json={
+        "usernames": [test_user.username, config.ADMIN_USERNAME, "non_existent_user"],
+        "block": True
+    })
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["updated"] == 1
+    statuses = {result["username"]: result["status"] for result in data["results"]}
+    assert statuses == {
+        test_user.username: "blocked",
+        config.ADMIN_USERNAME: "admin",
+        "non_existent_user": "not_found",
+    }
+
+    await session.refresh(test_user)
+    assert test_user.is_active is False
+
+
+@pytest.mark.asyncio
+async def test_bulk_unblock_users_by_group(admin_client: AsyncClient, session, test_user, current_admin):
+    """Admin should be able to unblock a whole group, admins are never touched."""
+
+    response = await admin_client.post("/users/block", json={"group": test_user.group, "block": False})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["updated"] >= 1
+    assert all(result["status"] == "unblocked" for result in data["results"])
+    assert config.ADMIN_USERNAME not in {result["username"] for result in data["results"]}
+
+    await session.refresh(test_user)
+    assert test_user.is_active is True
+
+
+@pytest.mark.asyncio
+async def test_bulk_block_users_requires_selector(admin_client: AsyncClient):
+    """A bulk block without usernames or filters should return 400."""
+
+    response = await admin_client.post("/users/block", json={"block": True})
+
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_bulk_block_users_unauthorized(user_client: AsyncClient, test_user):
+    """Non-admin users should not be allowed to bulk block users."""
+
+    response = await user_client.post("/users/block", json={"usernames": [test_user.username]})
+
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Not authorized"
+
+
+@pytest.mark.asyncio
+async def test_export_users_csv(admin_client: AsyncClient, session, monkeypatch):
+    """Admin should be able to export every user with its profile as CSV."""
+    monkeypatch.setattr(config, "EXPORT_BATCH_SIZE", 2)
+    user_count = len((await session.execute(select(User.id))).all())
+
+    response = await admin_client.get("/export/users", params={"format": "csv"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == user_count
+    assert "password" not in rows[0]
+    assert {row["username"] for row in rows} >= {config.ADMIN_USERNAME, config.USER_USERNAME}
+
+
+@pytest.mark.asyncio
+async def test_export_users_ndjson(admin_client: AsyncClient, session):
+    """The NDJSON export has one JSON object per user."""
+    user_count = len((await session.execute(select(User.id))).all())
+
+    response = await admin_client.get("/export/users")
+
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == user_count
+    assert {"username", "is_active", "university"} <= rows[0].keys()
+
+
+@pytest.mark.asyncio
+async def test_export_users_unauthorized(user_client: AsyncClient):
+    """Non-admin users should not be able to export users."""
+
+    response = await user_client.get("/export/users")
+
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_import_users_csv(admin_client: AsyncClient, session):
+    """Admin should be able to import users and profiles from a CSV, with per-row errors."""
+    content = "\n".join([
+        "username,password,group,first_name,last_name,university,year,speciality,department,degree,role",
+        "import_alice,alice_password,control,Alice,Smith,Import University,2024,Physics,Science,Master,Student",
+        "import_bob,,,,,,,,,,",
+        "import_carol,carol_password,,Carol,Jones,Import University,1800,Physics,Science,Master,Student",
+        "IMPORT_ALICE,other_password,,,,,,,,,",
+        f"{config.USER_USERNAME},user_password,,,,,,,,,",
+        "import_dave,dave_password,,Dave,,,,,,,",
+        "import_erin,short,,,,,,,,,",
+    ])
+
+    response = await admin_client.post("/import/users", files={"file": ("users.csv", content, "text/csv")})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["created"] == 2
+    assert {error["line"]: error["username"] for error in data["errors"]} == {
+        4: "import_carol", 5: "IMPORT_ALICE", 6: config.USER_USERNAME, 7: "import_dave", 8: "import_erin"}
+    assert [user["username"] for user in data["credentials"]] == ["import_bob"]
+
+    result = await session.execute(select(User).where(User.username == "import_alice"))
+    alice = result.scalars().first()
+    assert alice.group == "control"
+    assert alice.has_password_reset is False
+    assert alice.profile.university == "Import University"
+
+    response = await admin_client.post("/login", json={"username": "import_bob", "password": data["credentials"][0]["password"]})
+    assert response.status_code == 200
+    assert response.json()["has_password_reset"] is True
+
+
+@pytest.mark.asyncio
+async def test_usernames_are_unique_case_insensitively(session):
+    session.add(User(username=config.USER_USERNAME.upper(), password=""))
+
+    with pytest.raises(IntegrityError):
+        await session.commit()
+    await session.rollback()
+
+
+@pytest.mark.asyncio
+async def test_import_users_unauthorized(user_client: AsyncClient):
+    """Non-admin users should not be able to import users."""
+
+    response = await user_client.post("/import/users", files={"file": ("users.csv", "username\nnobody\n", "text/csv")})
+
+    assert response.status_code == 403
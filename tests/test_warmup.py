@@ -0,0 +1,68 @@
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+from httpx import AsyncClient
+
+from db.session import async_engine
+from lib.warmup import warm_up, warm_up_db
+
+
+@pytest.mark.asyncio
+async def test_warm_up_db_opens_pool_connections():
+    await warm_up_db(5)
+
+    assert async_engine.pool.checkedin() >= 5
+
+
+@pytest.mark.asyncio
+async def test_warm_up_db_without_connections():
+    await warm_up_db(0)
+
+
+@pytest.mark.asyncio
+async def test_warm_up_db_failure_does_not_block_startup(monkeypatch):
+    opened = 0
+    warnings = []
+
+    @asynccontextmanager
+    async def connect():
+        nonlocal opened
+        opened += 1
+        if opened == 2:
+            raise ConnectionError("database is down")
+        async with async_engine.connect() as connection:
+            yield connection
+
+    monkeypatch.setattr("lib.warmup.async_engine", SimpleNamespace(pool=async_engine.pool, connect=connect))
+    monkeypatch.setattr("lib.warmup.logger.warning", lambda message, *args: warnings.append(message % args))
+    await asyncio.wait_for(warm_up_db(3), timeout=5)
+
+    assert warnings == ["Database warm-up failed for 1 of 3 connections: database is down"]
+
+
+@pytest.mark.asyncio
+async def test_warm_up(app):
+    await warm_up(app)
+
+    assert app.openapi_schema is not None
+
+
+@pytest.mark.asyncio
+async def test_readiness(app, client: AsyncClient):
+    """Readiness is only reported once the lifespan startup has finished."""
+    app.state.ready = False
+    response = await client.get("/health/ready")
+    assert response.status_code == 503
+
+    app.state.ready = True
+    response = await client.get("/health/ready")
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_liveness(client: AsyncClient):
+    response = await client.get("/health/live")
+
+    assert response.status_code == 200